@@ -0,0 +1,385 @@
+import argparse
+import json
+import os
+import platform
+import queue
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from multiprocessing import Queue
+from typing import Any, Dict, List
+
+from config import load_cameras, settings
+
+# Скрипт, который выполняется в чистом процессе: время импорта приложения и загружены ли тяжёлые модули
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "cv2": "cv2" in sys.modules,
+    "mediapipe": "mediapipe" in sys.modules,
+}))
+"""
+
+
+def measure_import(runs: int) -> Dict[str, Any]:
+    """
+    Функция замера холодного импорта приложения, каждый замер в новом процессе интерпретатора
+
+    :param runs: Количество замеров
+    :type runs: int
+    :return: Медиана и разброс времени импорта, загружены ли cv2 и mediapipe
+    :rtype: Dict[str, Any]
+    """
+
+    results: List[dict] = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT], capture_output=True, text=True, check=True
+        ).stdout
+        # Приложение может что-то печатать при импорте, результат - последняя строка
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    seconds = [result["seconds"] for result in results]
+
+    return {
+        "runs": runs,
+        "median_s": round(statistics.median(seconds), 4),
+        "min_s": round(min(seconds), 4),
+        "max_s": round(max(seconds), 4),
+        "cv2_loaded": any(result["cv2"] for result in results),
+        "mediapipe_loaded": any(result["mediapipe"] for result in results),
+    }
+
+
+def measure_first_detection(
+        source: str | None, runs: int, inference_workers: int, timeout: float
+) -> Dict[str, Any]:
+    """
+    Функция замера времени от запуска камеры (как /start) до первого распознавания
+
+    :param source: Источник кадров (файл, номер камеры или ссылка), None - камера 0 из settings.json
+    :type source: str | None
+    :param runs: Количество замеров
+    :type runs: int
+    :param inference_workers: Количество воркеров распознавания, 0 - распознавать в процессе камеры
+    :type inference_workers: int
+    :param timeout: Максимальное время ожидания первого распознавания в секундах
+    :type timeout: float
+    :return: Медиана и разброс времени до первого распознавания
+    :rtype: Dict[str, Any]
+    """
+
+    # Импорт здесь, чтобы замер импорта выше не зависел от этого модуля
+    from cameras import CameraManager
+
+    camera: dict = dict(next(iter(load_cameras(settings).values())))
+    if source is not None:
+        # Номер USB камеры передаётся числом
+        camera["source"] = int(source) if source.isdigit() else source
+
+    seconds: List[float] = []
+    for _ in range(runs):
+        event_queue: Queue = Queue()
+        manager = CameraManager(
+            cameras={"bench": camera}, event_queue=event_queue, inference_workers=inference_workers
+        )
+        start = time.perf_counter()
+        manager.start("bench")
+        try:
+            deadline = start + timeout
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise TimeoutError(f"no detection in {timeout} s")
+                try:
+                    event = event_queue.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+                if event.get("type") == "started":
+                    seconds.append(time.perf_counter() - start)
+                    break
+        finally:
+            manager.stop_all()
+            # Дочитываем очередь, иначе процесс камеры не завершится, пока в ней есть данные
+            while True:
+                try:
+                    event_queue.get(timeout=0.1)
+                except queue.Empty:
+                    break
+
+    return {
+        "runs": runs,
+        "inference_workers": inference_workers,
+        "median_s": round(statistics.median(seconds), 4),
+        "min_s": round(min(seconds), 4),
+        "max_s": round(max(seconds), 4),
+    }
+
+
+def startup(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Функция замера запуска: холодный импорт приложения и время от /start до первого распознавания
+
+    :param args: Аргументы командной строки
+    :type args: argparse.Namespace
+    :return: Результаты замеров
+    :rtype: Dict[str, Any]
+    """
+
+    result: Dict[str, Any] = {"import": measure_import(runs=args.runs)}
+    if not args.skip_camera:
+        result["first_detection"] = measure_first_detection(
+            source=args.source,
+            runs=args.runs,
+            inference_workers=args.inference_workers,
+            timeout=args.timeout,
+        )
+
+    return result
+
+
+def git_revision() -> str | None:
+    """
+    Функция получения текущего коммита, чтобы было понятно, с какой версией сравнивается замер
+
+    :return: Короткий хеш коммита или None, если это не git репозиторий
+    :rtype: str | None
+    """
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def camera_report(stats: dict) -> Dict[str, Any]:
+    """
+    Функция выбора из статистики конвейера того, что сравнивается между версиями
+
+    :param stats: Последняя статистика процесса камеры или воркера распознавания
+    :type stats: dict
+    :return: Частота кадров, перцентили стадий, процессор, память и сохранённые кадры
+    :rtype: Dict[str, Any]
+    """
+
+    process = stats.get("process", {})
+    uptime = stats.get("uptime") or 0
+
+    return {
+        "uptime_s": uptime,
+        "fps": stats.get("fps", {}),
+        "stages": {
+            stage: {key: value for key, value in timings.items() if key in ("p50_ms", "p95_ms", "p99_ms")}
+            for stage, timings in stats.get("stages", {}).items()
+        },
+        "cpu_s": process.get("cpu_s"),
+        # Процент одного ядра за время работы конвейера
+        "cpu_percent": round(process["cpu_s"] / uptime * 100, 1) if uptime and process.get("cpu_s") else None,
+        "max_rss_mb": process.get("max_rss_mb"),
+        "counters": stats.get("counters", {}),
+    }
+
+
+def replay(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Функция прогона всего конвейера (захват, распознавание, трекинг, сохранение) на видео файле или папке кадров.
+    Фото и БД пишутся во временную папку, рабочие данные приложения не меняются
+
+    :param args: Аргументы командной строки
+    :type args: argparse.Namespace
+    :return: Отчёт: параметры прогона, статистика каждой камеры и воркеров распознавания, итоги
+    :rtype: Dict[str, Any]
+    """
+
+    from cameras import CameraManager
+    from storage import create_table, get_connection
+
+    source = os.path.abspath(args.source)
+    camera: dict = dict(next(iter(load_cameras(settings).values())))
+    camera.update(source=source, speed=args.speed, loop=args.loop)
+    if args.fps:
+        camera["fps"] = args.fps
+    cameras = {str(index): camera for index in range(args.cameras)}
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    # Процессы камер пишут фото и БД по относительным путям, поэтому работаем из временной папки
+    os.chdir(workdir)
+    os.makedirs(os.path.join("static", "images", "thumbs"))
+    conn = get_connection()
+    create_table(conn)
+
+    event_queue: Queue = Queue()
+    manager = CameraManager(cameras=cameras, event_queue=event_queue, inference_workers=args.inference_workers)
+    # Последняя статистика по камерам и воркерам
+    stats: Dict[str, dict] = {}
+    # Первое распознавание любой камеры: модель загружена, с этого момента идёт замер
+    started = threading.Event()
+
+    def collect() -> None:
+        while True:
+            event = event_queue.get()
+            if event is None:
+                break
+            if event.get("type") == "stats":
+                stats[event["camera_id"]] = event
+            elif event.get("type") == "started":
+                started.set()
+
+    collector = threading.Thread(target=collect, daemon=True)
+    collector.start()
+
+    for camera_id in cameras:
+        manager.start(camera_id)
+    # Загрузка и прогрев модели не входят в длительность прогона
+    while not started.wait(0.2) and any(worker.process.is_alive() for worker in manager.workers.values()):
+        pass
+    start = time.perf_counter()
+    # Без повтора видео камеры завершаются сами, когда кадры закончились
+    deadline = start + args.duration
+    while time.perf_counter() < deadline and any(
+            worker.process.is_alive() for worker in manager.workers.values()
+    ):
+        time.sleep(0.2)
+    manager.stop_all()
+    elapsed = time.perf_counter() - start
+    event_queue.put(None)
+    collector.join()
+
+    saved_rows = conn.execute("SELECT COUNT(*) FROM humans").fetchone()[0]
+    conn.close()
+
+    reports = {camera_id: camera_report(stats[camera_id]) for camera_id in cameras if camera_id in stats}
+
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "source": source,
+            "speed": args.speed,
+            "cameras": args.cameras,
+            "inference_workers": args.inference_workers,
+            "elapsed_s": round(elapsed, 3),
+            "detection": settings.get("detection", {}),
+            "workdir": workdir,
+        },
+        "cameras": reports,
+        "inference": {
+            name: camera_report(data) for name, data in stats.items() if name.startswith("inference-")
+        },
+        "totals": {
+            "processed_fps": round(sum(report["fps"].get("processed", 0) for report in reports.values()), 3),
+            "saved": sum(report["counters"].get("saved", 0) for report in reports.values()),
+            "saved_rows": saved_rows,
+        },
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Функция сравнения отчёта с сохранённым: падение частоты кадров и рост p95 стадий больше допуска
+
+    :param current: Текущий отчёт
+    :type current: dict
+    :param baseline: Отчёт, с которым сравниваем
+    :type baseline: dict
+    :param tolerance: Допустимое ухудшение в процентах
+    :type tolerance: float
+    :return: Описания ухудшений, пустой список - ухудшений нет
+    :rtype: List[str]
+    """
+
+    regressions: List[str] = []
+    limit = tolerance / 100
+
+    old_fps = baseline.get("totals", {}).get("processed_fps") or 0
+    new_fps = current["totals"]["processed_fps"]
+    if old_fps and new_fps < old_fps * (1 - limit):
+        regressions.append(f"processed_fps: {old_fps} -> {new_fps}")
+
+    for camera_id, report in current["cameras"].items():
+        old_stages = baseline.get("cameras", {}).get(camera_id, {}).get("stages", {})
+        for stage, timings in report["stages"].items():
+            old_p95 = old_stages.get(stage, {}).get("p95_ms")
+            new_p95 = timings.get("p95_ms")
+            if old_p95 and new_p95 is not None and new_p95 > old_p95 * (1 + limit):
+                regressions.append(f"camera {camera_id} {stage} p95_ms: {old_p95} -> {new_p95}")
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Замеры производительности приложения")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    startup_parser = commands.add_parser("startup", help="Холодный старт и время до первого распознавания")
+    startup_parser.add_argument("--runs", type=int, default=5, help="Количество замеров")
+    startup_parser.add_argument("--source", help="Источник кадров: видео файл, номер камеры или ссылка")
+    startup_parser.add_argument(
+        "--inference-workers", type=int, default=0, help="Воркеры распознавания, 0 - в процессе камеры"
+    )
+    startup_parser.add_argument("--timeout", type=float, default=30, help="Ожидание распознавания, секунды")
+    startup_parser.add_argument("--skip-camera", action="store_true", help="Замерить только импорт")
+    startup_parser.set_defaults(handler=startup)
+
+    replay_parser = commands.add_parser("replay", help="Прогон всего конвейера на видео файле или папке кадров")
+    replay_parser.add_argument("source", help="Видео файл или папка с изображениями")
+    replay_parser.add_argument(
+        "--speed",
+        choices=("native", "max"),
+        default="native",
+        help="native - с частотой записи, max - без ожидания (кольцевой буфер перезаписывает кадры, "
+             "которые конвейер не успел взять, подходит только для замера захвата)",
+    )
+    replay_parser.add_argument("--fps", type=float, help="Частота кадров папки с изображениями для native")
+    replay_parser.add_argument("--loop", action="store_true", help="Повторять видео до конца --duration")
+    replay_parser.add_argument("--cameras", type=int, default=1, help="Сколько камер читают один источник")
+    replay_parser.add_argument(
+        "--inference-workers",
+        type=int,
+        default=settings.get("workers", {}).get("inference", 0),
+        help="Воркеры распознавания, 0 - в процессе камеры",
+    )
+    replay_parser.add_argument("--duration", type=float, default=60, help="Максимальная длительность, секунды")
+    replay_parser.add_argument("--output", help="Сохранить отчёт в JSON файл (базовый замер для сравнения)")
+    replay_parser.add_argument("--compare", help="Сравнить с сохранённым отчётом")
+    replay_parser.add_argument("--tolerance", type=float, default=10, help="Допустимое ухудшение, проценты")
+    replay_parser.set_defaults(handler=replay)
+
+    args = parser.parse_args()
+    # Пути из аргументов считаются от папки запуска, replay меняет текущую папку
+    for name in ("source", "output", "compare"):
+        if getattr(args, name, None):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    result = args.handler(args)
+    if getattr(args, "output", None):
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2, ensure_ascii=False)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    if getattr(args, "compare", None):
+        with open(args.compare, "r", encoding="utf-8") as file:
+            regressions = compare(current=result, baseline=json.load(file), tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
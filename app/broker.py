@@ -0,0 +1,232 @@
+import asyncio
+import json
+import threading
+from multiprocessing.queues import Queue
+from typing import Dict, Set
+
+
+class EventBroker:
+    """
+    Брокер событий.
+
+    Получает каждое событие от процесса камеры один раз и раздаёт его всем подписчикам (SSE клиентам).
+    У каждого подписчика своя очередь ограниченного размера, медленные клиенты отключаются,
+    чтобы не копить события в памяти и не задерживать остальных.
+    Ретрансляторы (другие воркеры API) получают все события без разбора, как они пришли от процессов.
+    """
+
+    def __init__(self, queue_size: int = 16, relay_size: int = 256) -> None:
+        """
+        :param queue_size: Максимальное количество событий в очереди одного подписчика
+        :type queue_size: int
+        :param relay_size: Максимальное количество событий в очереди одного ретранслятора
+        :type relay_size: int
+        """
+
+        # Размер очереди подписчика
+        self.queue_size: int = queue_size
+        self.relay_size: int = relay_size
+        # Очереди подписчиков
+        self.subscribers: Set[asyncio.Queue] = set()
+        # Очереди ретрансляторов
+        self.relays: Set[asyncio.Queue] = set()
+        # Цикл событий, в котором работают подписчики
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # Поток, читающий очередь процесса камеры
+        self._reader: threading.Thread | None = None
+        # Последняя статистика конвейера по идентификатору камеры
+        self.stats: Dict[str, dict] = {}
+        # Последняя ошибка по идентификатору камеры: message и time
+        self.errors: Dict[str, dict] = {}
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Метод подписки на события
+
+        :return: Очередь, в которую будут приходить события
+        :rtype: asyncio.Queue
+        """
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """
+        Метод отписки от событий
+
+        :param queue: Очередь подписчика
+        :type queue: asyncio.Queue
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self.subscribers.discard(queue)
+
+    def add_relay(self) -> asyncio.Queue:
+        """
+        Метод подписки ретранслятора на все события процессов
+
+        :return: Очередь, в которую будут приходить события
+        :rtype: asyncio.Queue
+        """
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.relay_size)
+        self.relays.add(queue)
+
+        return queue
+
+    def remove_relay(self, queue: asyncio.Queue) -> None:
+        """
+        Метод отписки ретранслятора
+
+        :param queue: Очередь ретранслятора
+        :type queue: asyncio.Queue
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self.relays.discard(queue)
+
+    def close_relays(self) -> None:
+        """
+        Метод отключения всех ретрансляторов, они переподключатся к новому владельцу камер
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        for queue in list(self.relays):
+            self.relays.discard(queue)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    def publish(self, data: dict) -> None:
+        """
+        Метод рассылки события всем подписчикам, должен вызываться в цикле событий
+
+        :param data: Данные события
+        :type data: dict
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self._offer(self.subscribers, data)
+
+    def dispatch(self, data: dict) -> None:
+        """
+        Метод обработки события процесса, должен вызываться в цикле событий: статистика и ошибки запоминаются,
+        новые фото рассылаются подписчикам, все события - ретрансляторам
+
+        :param data: Данные события
+        :type data: dict
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self._offer(self.relays, data)
+        # Статистику не рассылаем, а запоминаем для эндпоинта
+        if data.get("type") == "stats":
+            self.stats[data["camera_id"]] = data
+        elif data.get("type") == "error":
+            self.errors[data["camera_id"]] = {"message": data["message"], "time": data["time"]}
+        # Клиентам рассылаются только новые фото, остальные служебные события пропускаем
+        elif data.get("type") == "new_image":
+            self.publish(data)
+
+    def start(self, source: Queue) -> None:
+        """
+        Метод запуска потока, который читает очередь процесса камеры и передаёт события в цикл событий
+
+        :param source: Очередь, в которую процесс камеры публикует события
+        :type source: multiprocessing.Queue
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self._loop = asyncio.get_running_loop()
+        self._reader = threading.Thread(
+            target=self._read, args=(source,), name="event-broker", daemon=True
+        )
+        self._reader.start()
+
+    def stop(self, source: Queue) -> None:
+        """
+        Метод остановки потока чтения очереди
+
+        :param source: Очередь, в которую процесс камеры публикует события
+        :type source: multiprocessing.Queue
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        # None - сигнал для завершения потока
+        source.put(None)
+        if self._reader is not None:
+            self._reader.join(timeout=1)
+
+    def _read(self, source: Queue) -> None:
+        """
+        Цикл потока чтения, блокируется на очереди, поэтому событие доставляется сразу после публикации
+
+        :param source: Очередь, в которую процесс камеры публикует события
+        :type source: multiprocessing.Queue
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        while True:
+            data = source.get()
+            if data is None:
+                break
+            self._loop.call_soon_threadsafe(self.dispatch, data)
+
+    def _offer(self, queues: Set[asyncio.Queue], data: dict) -> None:
+        for queue in list(queues):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                # Клиент не успевает забирать события - отключаем его.
+                # Очищаем очередь и кладём None, генератор увидит его и завершится,
+                # браузер (или воркер) переподключится сам
+                queues.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+
+async def image_event_generator(queue: asyncio.Queue) -> dict:
+    """
+    Корутина - генератор для отправки события после добавления фото
+
+    :param queue: Очередь подписчика, в которую брокер кладёт новые фото
+    :type queue: asyncio.Queue
+    :return: Словарь с данными
+    :rtype: dict
+    """
+
+    while True:
+        # Ждём новое фото от брокера, без опроса БД
+        new_image = await queue.get()
+
+        # None - брокер отключил клиента, так как он не успевал получать события
+        if new_image is None:
+            break
+
+        # Данные для ивента: фото и его миниатюра
+        data = {
+            "event": "new_image",
+            "id": None,
+            "retry": 15000,
+            "data": json.dumps(
+                {
+                    "image": f"images/{new_image['file_name']}",
+                    "thumbnail": f"images/{new_image['thumbnail']}",
+                    "camera_id": new_image["camera_id"],
+                }
+            ),
+        }
+        # возвращаем ивент
+        yield data
@@ -0,0 +1,348 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from multiprocessing import Event, Process, Queue, Value
+from typing import Any, Dict, List
+
+from inference import inference_worker
+from preview import PreviewBlock
+from tuning import SettingsBlock
+
+logger = logging.getLogger(__name__)
+
+
+def run_camera(*args) -> None:
+    """
+    Функция запущенная в процессе камеры. models (а с ним cv2 и mediapipe) импортируется только здесь,
+    процесс API их не загружает
+
+    :param args: Аргументы camera_process
+    :return: Ничего не возвращает
+    :rtype: None
+    """
+
+    from models import camera_process
+
+    camera_process(*args)
+
+
+class CameraWorker:
+    """
+    Процесс одной камеры, его стоп ивент, пульс и состояние для супервизора
+    """
+
+    def __init__(self, stop_event: Event) -> None:
+        self.process: Process | None = None
+        self.stop_event: Event = stop_event
+        # Время последнего пульса процесса (time.time()), процесс обновляет его на каждой итерации
+        self.heartbeat = Value("d", 0.0, lock=False)
+        # Время запуска текущего процесса
+        self.started_at: float = 0.0
+        # Количество перезапусков после падения
+        self.restarts: int = 0
+        # Падения подряд, от них зависит задержка перед перезапуском
+        self.failures: int = 0
+        # Время, после которого процесс можно перезапустить, если процесса нет
+        self.restart_at: float | None = None
+        # Причина последнего завершения процесса, замеченная супервизором
+        self.last_exit: Dict[str, str] | None = None
+        # Причина принудительного завершения зависшего процесса
+        self.hung: str | None = None
+
+    def exited(self, message: str) -> None:
+        """
+        Метод записи причины завершения процесса
+
+        :param message: Причина завершения
+        :type message: str
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self.last_exit = {"message": message, "time": datetime.now().isoformat(timespec="seconds")}
+
+
+class CameraManager:
+    """
+    Менеджер камер: запускает по процессу на каждую камеру и общий пул воркеров распознавания,
+    следит за процессами и перезапускает упавшие.
+
+    Супервизор считает процесс камеры упавшим, если он завершился сам или перестал обновлять пульс
+    (завис на чтении камеры), и перезапускает его с экспоненциальной задержкой: backoff_base, 2 * backoff_base, ...
+    до backoff_max. Если процесс проработал дольше backoff_max, счётчик падений сбрасывается.
+
+    start и supervise не ждут процессы и вызываются прямо из цикла событий: процессы создаются только
+    в его потоке, процесс, созданный fork из потока пула, завершается с кодом 1 при выходе.
+    stop и stop_all ждут процессы до stop_timeout, из цикла событий они вызываются в потоке.
+    Все вызовы идут под lock, чтобы запуск, остановка и проверка процессов не пересекались.
+    """
+
+    def __init__(
+            self,
+            cameras: Dict[str, dict],
+            event_queue: Queue,
+            inference_workers: int = 0,
+            heartbeat_timeout: float = 10,
+            startup_timeout: float = 30,
+            backoff_base: float = 1,
+            backoff_max: float = 60,
+            stop_timeout: float = 5,
+            tuning: Dict[str, SettingsBlock] | None = None,
+            previews: Dict[str, PreviewBlock] | None = None,
+    ) -> None:
+        """
+        :param cameras: Настройки камер по идентификатору
+        :type cameras: Dict[str, dict]
+        :param event_queue: Очередь, в которую процессы камер публикуют события
+        :type event_queue: multiprocessing.Queue
+        :param inference_workers: Количество воркеров распознавания, 0 - распознавать в процессе камеры
+        :type inference_workers: int
+        :param heartbeat_timeout: Через сколько секунд без пульса процесс считается зависшим
+        :type heartbeat_timeout: float
+        :param startup_timeout: Сколько секунд после запуска процесс может не отправлять пульс (загрузка модели,
+            подключение к камере)
+        :type startup_timeout: float
+        :param backoff_base: Задержка перед первым перезапуском в секундах
+        :type backoff_base: float
+        :param backoff_max: Максимальная задержка перед перезапуском в секундах
+        :type backoff_max: float
+        :param stop_timeout: Сколько секунд ждать остановки процесса, затем он завершается принудительно
+        :type stop_timeout: float
+        :param tuning: Блоки настроек камер в общей памяти, изменения подхватываются без перезапуска процесса
+        :type tuning: Dict[str, SettingsBlock] | None
+        :param previews: Блоки последних размеченных кадров камер для /stream, пустой - /stream отключён
+        :type previews: Dict[str, PreviewBlock] | None
+        """
+
+        self.cameras: Dict[str, dict] = cameras
+        self.event_queue: Queue = event_queue
+        self.inference_workers: int = inference_workers
+        self.heartbeat_timeout: float = heartbeat_timeout
+        self.startup_timeout: float = startup_timeout
+        self.backoff_base: float = backoff_base
+        self.backoff_max: float = backoff_max
+        self.stop_timeout: float = stop_timeout
+        self.tuning: Dict[str, SettingsBlock] = tuning or {}
+        self.previews: Dict[str, PreviewBlock] = previews or {}
+        # Запущенные камеры
+        self.workers: Dict[str, CameraWorker] = {}
+        # Пул воркеров распознавания
+        self.pool: List[Process] = []
+        self.pool_stop: Event | None = None
+        self.task_queue: Queue | None = None
+        # Тригер профайлера, общий для всех процессов: выставлен - профайлеры работают
+        self.profile_event: Event = Event()
+        # Очереди результатов создаются сразу для всех камер, воркеры получают их при запуске
+        self.result_queues: Dict[str, Queue] = {}
+        if inference_workers:
+            self.task_queue = Queue()
+            self.result_queues = {camera_id: Queue() for camera_id in cameras}
+        # Блокировка для вызовов из цикла событий
+        self.lock = asyncio.Lock()
+
+    def is_running(self, camera_id: str) -> bool:
+        """
+        Метод проверки, запущена ли камера
+
+        :param camera_id: Идентификатор камеры
+        :type camera_id: str
+        :return: Запущена ли камера
+        :rtype: bool
+        """
+
+        return camera_id in self.workers
+
+    def start(self, camera_id: str) -> None:
+        """
+        Метод запуска процесса камеры
+
+        :param camera_id: Идентификатор камеры
+        :type camera_id: str
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        # Пул запускается вместе с первой камерой
+        if self.inference_workers and not self.pool:
+            self._start_pool()
+
+        worker = CameraWorker(stop_event=Event())
+        self._spawn(camera_id=camera_id, worker=worker)
+        self.workers[camera_id] = worker
+
+    def stop(self, camera_id: str) -> None:
+        """
+        Метод остановки процесса камеры, ждёт не дольше stop_timeout, затем завершает процесс принудительно
+
+        :param camera_id: Идентификатор камеры
+        :type camera_id: str
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        worker = self.workers.pop(camera_id)
+        worker.stop_event.set()
+        if worker.process is not None:
+            self._join(worker.process, name=f"camera {camera_id}")
+
+        # Пул больше не нужен, если камер не осталось
+        if not self.workers:
+            self._stop_pool()
+
+    def stop_all(self) -> None:
+        """
+        Метод остановки всех камер и пула
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        # Сначала отправляем сигнал всем, чтобы камеры останавливались одновременно
+        for worker in self.workers.values():
+            worker.stop_event.set()
+        for camera_id in list(self.workers):
+            self.stop(camera_id)
+        self._stop_pool()
+
+    def supervise(self) -> None:
+        """
+        Метод проверки процессов: зависшие завершаются, упавшие камеры перезапускаются с задержкой,
+        упавшие воркеры распознавания - сразу
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        now = time.time()
+        for camera_id, worker in self.workers.items():
+            process = worker.process
+
+            if process is not None:
+                if process.is_alive():
+                    silent = now - worker.heartbeat.value
+                    starting = now - worker.started_at <= self.startup_timeout
+                    if worker.hung is None and not starting and silent > self.heartbeat_timeout:
+                        # Процесс не ждём, на следующей проверке он уже будет завершён
+                        logger.warning("camera %s has no heartbeat for %.1f s, terminating", camera_id, silent)
+                        worker.hung = f"no heartbeat for {silent:.1f} s"
+                        process.terminate()
+                    continue
+
+                # Процесс завершился - назначаем перезапуск
+                worker.exited(worker.hung or f"process exited with code {process.exitcode}")
+                # Долго проработавший процесс - это не череда падений
+                if now - worker.started_at > self.backoff_max:
+                    worker.failures = 0
+                worker.failures += 1
+                delay = min(self.backoff_base * 2 ** (worker.failures - 1), self.backoff_max)
+                worker.process = None
+                worker.restart_at = now + delay
+                logger.warning("camera %s stopped, restarting in %.1f s", camera_id, delay)
+            elif now >= worker.restart_at:
+                worker.stop_event.clear()
+                self._spawn(camera_id=camera_id, worker=worker)
+                worker.restarts += 1
+
+        # Пул останавливается - не перезапускаем
+        if self.pool_stop is None or self.pool_stop.is_set():
+            return
+        for index, process in enumerate(self.pool):
+            if not process.is_alive():
+                logger.warning(
+                    "inference worker %s exited with code %s, restarting", index, process.exitcode
+                )
+                self.pool[index] = self._spawn_inference(index)
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Метод получения состояния камер и пула для супервизора
+
+        :return: Состояние каждой камеры из настроек и воркеров распознавания
+        :rtype: Dict[str, Any]
+        """
+
+        now = time.time()
+        cameras = {}
+        for camera_id in self.cameras:
+            worker = self.workers.get(camera_id)
+            if worker is None:
+                cameras[camera_id] = {"state": "stopped"}
+                continue
+
+            alive = worker.process is not None and worker.process.is_alive()
+            cameras[camera_id] = {
+                "state": "running" if alive else "restarting",
+                "pid": worker.process.pid if alive else None,
+                "uptime": round(now - worker.started_at, 3) if alive else 0.0,
+                "heartbeat_age": round(now - worker.heartbeat.value, 3) if alive else None,
+                "restarts": worker.restarts,
+                "failures": worker.failures,
+                "restart_in": (
+                    round(max(worker.restart_at - now, 0), 3) if worker.restart_at is not None else None
+                ),
+                "last_exit": worker.last_exit,
+            }
+
+        return {
+            "cameras": cameras,
+            "inference": [
+                {"pid": process.pid, "alive": process.is_alive()} for process in self.pool
+            ],
+        }
+
+    def _spawn(self, camera_id: str, worker: CameraWorker) -> None:
+        # До первого пульса процесса отсчёт идёт от запуска
+        worker.heartbeat.value = time.time()
+        worker.started_at = time.time()
+        worker.restart_at = None
+        worker.hung = None
+        worker.process = Process(
+            target=run_camera,
+            args=(
+                camera_id,
+                worker.stop_event,
+                self.event_queue,
+                self.task_queue,
+                self.result_queues.get(camera_id),
+                self.cameras[camera_id],
+                self.profile_event,
+                worker.heartbeat,
+                self.tuning.get(camera_id),
+                self.previews.get(camera_id),
+            ),
+            name=f"camera-{camera_id}",
+        )
+        worker.process.start()
+
+    def _spawn_inference(self, index: int) -> Process:
+        process = Process(
+            target=inference_worker,
+            args=(
+                self.task_queue, self.result_queues, self.pool_stop, self.event_queue, index, self.profile_event
+            ),
+            name=f"inference-{index}",
+        )
+        process.start()
+
+        return process
+
+    def _start_pool(self) -> None:
+        self.pool_stop = Event()
+        self.pool = [self._spawn_inference(index) for index in range(self.inference_workers)]
+
+    def _stop_pool(self) -> None:
+        if not self.pool:
+            return
+        self.pool_stop.set()
+        for index, process in enumerate(self.pool):
+            self._join(process, name=f"inference worker {index}")
+        self.pool = []
+
+    def _join(self, process: Process, name: str) -> None:
+        # Процесс дописывает очереди и закрывает камеру, но не дольше stop_timeout
+        process.join(timeout=self.stop_timeout)
+        if process.is_alive():
+            logger.warning("%s did not stop in %.1f s, terminating", name, self.stop_timeout)
+            process.terminate()
+            process.join(timeout=1)
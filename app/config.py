@@ -0,0 +1,45 @@
+import json
+import os
+from typing import Dict
+
+
+def load_settings(file_name: str = "settings.json") -> Dict[str, Dict[str, str]]:
+    """
+    Функция загрузки настроек области для распознавания лица в кадре
+
+    :param file_name: Имя файла с настройками
+    :type file_name: str
+    :return: Ключ с набором параметров
+    :rtype: Dict[str, Dict[str, str]]
+    """
+    app_path = os.path.abspath(os.path.dirname(__file__))
+    settings_path = os.path.abspath(os.path.join(app_path, "..", file_name))
+
+    with open(settings_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def load_cameras(settings: dict) -> Dict[str, dict]:
+    """
+    Функция получения настроек камер: источник (номер USB камеры, ссылка RTSP, видео файл или папка с кадрами),
+    области распознавания и параметры воспроизведения файлов.
+    Если камеры не заданы, используется одна камера 0 с общими областями
+
+    :param settings: Настройки приложения
+    :type settings: dict
+    :return: Настройки камер по идентификатору
+    :rtype: Dict[str, dict]
+    """
+
+    # Именованные области распознавания, если их нет - используем одну область frame
+    regions: Dict[str, Dict[str, int]] = settings.get("regions") or {"frame": settings.get("frame")}
+    cameras: Dict[str, dict] = settings.get("cameras") or {"0": {"source": 0}}
+
+    return {
+        str(camera_id): {**camera, "source": camera.get("source", 0), "regions": camera.get("regions") or regions}
+        for camera_id, camera in cameras.items()
+    }
+
+
+# Настройки приложения. Модуль не импортирует cv2 и mediapipe, поэтому процесс API загружает только его
+settings: dict = load_settings()
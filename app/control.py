@@ -0,0 +1,532 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+from multiprocessing.queues import Queue
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+
+from broker import EventBroker
+from cameras import CameraManager
+from metrics import queue_depth
+from preview import preview_frames
+
+# lockf и Unix сокеты есть только на Unix, без него воркер всегда владелец камер
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class OwnerUnavailable(Exception):
+    """Владелец камер не отвечает: он завершается, а другой воркер ещё не взял блокировку"""
+
+
+def error_response(message: str) -> dict:
+    """
+    Функция получения ответа владельца об ошибке команды
+
+    :param message: Текст ошибки
+    :type message: str
+    :return: Ответ с ключами ok и error
+    :rtype: dict
+    """
+
+    return {"ok": False, "error": message}
+
+
+class CameraControl:
+    """
+    Управление камерами из нескольких воркеров API.
+
+    При запуске uvicorn с --workers N каждый воркер импортирует приложение, но процессы камер
+    запускает только один - владелец, взявший файловую блокировку (lockf). Владелец принимает команды
+    остальных воркеров через Unix сокет и пересылает им все события процессов (новые фото, статистику,
+    ошибки), поэтому /events, /pipeline и /status отвечают одинаково в любом воркере.
+    Остальные воркеры ждут блокировку: если владелец завершился, камерами завладеет следующий.
+
+    Протокол - JSON по строкам: запрос {"op": ..., ...параметры}, ответ - один JSON объект.
+    На запрос subscribe владелец отвечает потоком событий до закрытия соединения, на запрос preview -
+    потоком кадров /stream: строка с размером кадра в байтах, затем сам кадр.
+    """
+
+    def __init__(
+            self,
+            manager: CameraManager,
+            broker: EventBroker,
+            event_queue: Queue,
+            socket_path: str = "camera.sock",
+            lock_path: str = "camera.lock",
+            supervise_interval: float = 1,
+            retry_interval: float = 1,
+            timeout: float = 10,
+            on_acquire: Callable[[], Awaitable[None]] | None = None,
+            on_release: Callable[[], Awaitable[None]] | None = None,
+    ) -> None:
+        """
+        :param manager: Менеджер процессов камер, работает только у владельца
+        :type manager: CameraManager
+        :param broker: Брокер событий этого воркера
+        :type broker: EventBroker
+        :param event_queue: Очередь, в которую процессы камер публикуют события
+        :type event_queue: multiprocessing.Queue
+        :param socket_path: Путь к Unix сокету владельца
+        :type socket_path: str
+        :param lock_path: Путь к файлу блокировки
+        :type lock_path: str
+        :param supervise_interval: Интервал проверки процессов камер в секундах
+        :type supervise_interval: float
+        :param retry_interval: Интервал повторного подключения к владельцу в секундах
+        :type retry_interval: float
+        :param timeout: Максимальное время ожидания ответа владельца в секундах
+        :type timeout: float
+        :param on_acquire: Корутина, выполняемая после того, как воркер стал владельцем
+        :type on_acquire: Callable[[], Awaitable[None]] | None
+        :param on_release: Корутина, выполняемая перед остановкой камер владельца
+        :type on_release: Callable[[], Awaitable[None]] | None
+        """
+
+        self.manager: CameraManager = manager
+        self.broker: EventBroker = broker
+        self.event_queue: Queue = event_queue
+        self.socket_path: str = os.path.abspath(socket_path)
+        self.lock_path: str = os.path.abspath(lock_path)
+        self.supervise_interval: float = supervise_interval
+        self.retry_interval: float = retry_interval
+        self.timeout: float = timeout
+        self.on_acquire: Callable[[], Awaitable[None]] | None = on_acquire
+        self.on_release: Callable[[], Awaitable[None]] | None = on_release
+        # Владеет ли этот воркер камерами
+        self.owner: bool = False
+        # Открытый файл блокировки владельца
+        self._lock_fd: int | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._supervisor: asyncio.Task | None = None
+        # Подписка на события владельца у остальных воркеров
+        self._follower: asyncio.Task | None = None
+        self._operations: Dict[str, Callable[..., Awaitable[Any]]] = {
+            "start": self._start_camera,
+            "stop": self._stop_camera,
+            "status": self._status,
+            "settings": self._settings,
+            "update_settings": self._update_settings,
+            "profiler": self._profiler,
+            "metrics": self._metrics,
+        }
+
+    async def start(self) -> None:
+        """
+        Метод запуска: воркер становится владельцем камер или подписывается на события владельца
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        if self._try_lock():
+            await self._acquire()
+        else:
+            logger.info("cameras are owned by another worker, control socket %s", self.socket_path)
+            self._follower = asyncio.create_task(self._follow())
+
+    async def stop(self) -> None:
+        """
+        Метод остановки: владелец останавливает камеры и отпускает блокировку
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        if self._follower is not None:
+            self._follower.cancel()
+        if not self.owner:
+            return
+
+        if self._server is not None:
+            self._server.close()
+        # Отключаем воркеры, получающие события, их соединения закроются до остановки цикла событий
+        self.broker.close_relays()
+        self._supervisor.cancel()
+        if self.on_release is not None:
+            await self.on_release()
+        # Останавливаем камеры и пул распознавания, каждый процесс ждём не дольше stop_timeout
+        async with self.manager.lock:
+            await asyncio.to_thread(self.manager.stop_all)
+        self.broker.stop(source=self.event_queue)
+        # Сокет удаляем, пока держим блокировку: новый владелец создаст свой
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.owner = False
+
+    async def call(self, op: str, **params: Any) -> Any:
+        """
+        Метод выполнения команды владельцем камер: в воркере-владельце напрямую, в остальных - через сокет
+
+        :param op: Команда: start, stop, status, settings, update_settings, profiler, metrics
+        :type op: str
+        :param params: Параметры команды
+        :type params: Any
+        :return: Результат команды
+        :rtype: Any
+        :raises OwnerUnavailable: Если владелец не ответил
+        """
+
+        if self.owner:
+            return await self._execute({"op": op, **params})
+
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.socket_path), timeout=self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as error:
+            raise OwnerUnavailable(str(error)) from error
+
+        try:
+            writer.write(json.dumps({"op": op, **params}).encode() + b"\n")
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+        except (OSError, asyncio.TimeoutError) as error:
+            raise OwnerUnavailable(str(error)) from error
+        finally:
+            writer.close()
+
+        if not line:
+            raise OwnerUnavailable("connection closed by the camera owner")
+
+        return json.loads(line)
+
+    async def preview(self, camera_id: str, fps: float) -> AsyncIterator[bytes]:
+        """
+        Метод подключения зрителя к кадрам камеры для /stream: в воркере-владельце кадры читаются из общей памяти,
+        в остальных - приходят через сокет
+
+        :param camera_id: Идентификатор камеры
+        :type camera_id: str
+        :param fps: Максимальная частота кадров зрителя
+        :type fps: float
+        :return: Генератор кадров в JPEG, завершается, когда владелец закрыл соединение
+        :rtype: AsyncIterator[bytes]
+        :raises OwnerUnavailable: Если владелец не ответил
+        """
+
+        if self.owner:
+            return preview_frames(self.manager.previews[camera_id], fps=fps)
+
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.socket_path), timeout=self.timeout
+            )
+            writer.write(json.dumps({"op": "preview", "camera_id": camera_id, "fps": fps}).encode() + b"\n")
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError) as error:
+            raise OwnerUnavailable(str(error)) from error
+
+        async def frames() -> AsyncIterator[bytes]:
+            try:
+                while line := await reader.readline():
+                    yield await reader.readexactly(int(line))
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                # Владелец завершился - зритель переподключится
+                pass
+            finally:
+                writer.close()
+
+        return frames()
+
+    def _try_lock(self) -> bool:
+        """
+        Метод попытки взять блокировку владельца без ожидания
+
+        :return: Взята ли блокировка
+        :rtype: bool
+        """
+
+        if fcntl is None:
+            return True
+
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Блокировка POSIX (lockf) не наследуется процессами камер при fork: после падения владельца
+            # её отпускает ОС, даже если его процессы ещё работают
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # Блокировка держится, пока этот процесс не закроет файл
+        self._lock_fd = fd
+
+        return True
+
+    async def _acquire(self) -> None:
+        """
+        Метод запуска камер в этом воркере после взятия блокировки
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self.owner = True
+        logger.info("worker %d owns the cameras", os.getpid())
+        # Запускаем брокер событий
+        self.broker.start(source=self.event_queue)
+        # Запускаем наблюдение за процессами камер
+        self._supervisor = asyncio.create_task(self._supervise())
+        if fcntl is not None:
+            # Сокет мог остаться от владельца, который упал
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self._server = await asyncio.start_unix_server(self._serve, path=self.socket_path)
+        if self.on_acquire is not None:
+            await self.on_acquire()
+
+    async def _supervise(self) -> None:
+        """
+        Корутина для периодической проверки процессов камер: зависшие процессы завершаются,
+        упавшие перезапускаются с экспоненциальной задержкой
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        while True:
+            async with self.manager.lock:
+                self.manager.supervise()
+            await asyncio.sleep(self.supervise_interval)
+
+    async def _follow(self) -> None:
+        """
+        Корутина воркера, который не владеет камерами: получает события владельца и передаёт их своему брокеру.
+        Если соединение закрылось, пробует взять блокировку - владелец мог завершиться
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError:
+                # Владелец ещё не создал сокет или уже завершился
+                reader = None
+
+            if reader is not None:
+                try:
+                    writer.write(b'{"op": "subscribe"}\n')
+                    await writer.drain()
+                    while line := await reader.readline():
+                        # Битая строка не должна останавливать ретрансляцию, пропускаем её
+                        try:
+                            event = json.loads(line)
+                        except ValueError:
+                            logger.warning("skipping malformed event from the camera owner: %r", line[:200])
+                            continue
+                        if isinstance(event, dict):
+                            self.broker.dispatch(event)
+                except OSError:
+                    pass
+                finally:
+                    writer.close()
+
+            if self._try_lock():
+                await self._acquire()
+                return
+            await asyncio.sleep(self.retry_interval)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Корутина обработки соединения другого воркера
+
+        :param reader: Чтение из сокета
+        :type reader: asyncio.StreamReader
+        :param writer: Запись в сокет
+        :type writer: asyncio.StreamWriter
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = self._parse(line)
+                except ValueError as error:
+                    # На неверный запрос отвечаем ошибкой, соединение остаётся открытым
+                    response = error_response(str(error))
+                else:
+                    if request["op"] == "subscribe":
+                        await self._relay(writer)
+                        break
+                    if request["op"] == "preview":
+                        await self._send_preview(writer, camera_id=request["camera_id"], fps=request["fps"])
+                        break
+                    response = await self._execute(request)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except OSError:
+            # Воркер отключился
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse(line: bytes) -> dict:
+        """
+        Метод разбора запроса другого воркера
+
+        :param line: Строка запроса
+        :type line: bytes
+        :return: Запрос
+        :rtype: dict
+        :raises ValueError: Если запрос не JSON объект с командой или у preview нет камеры и частоты кадров
+        """
+
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            raise ValueError(f"invalid JSON: {error}") from error
+        if not isinstance(request, dict) or not isinstance(request.get("op"), str):
+            raise ValueError("request must be a JSON object with op")
+        if request["op"] == "preview":
+            fps = request.get("fps")
+            if not isinstance(request.get("camera_id"), str) or isinstance(fps, bool) or not isinstance(
+                    fps, (int, float)
+            ) or fps <= 0:
+                raise ValueError("preview requires camera_id and a positive fps")
+
+        return request
+
+    async def _relay(self, writer: asyncio.StreamWriter) -> None:
+        """
+        Корутина пересылки событий процессов другому воркеру, пока он не отключится или не начнёт отставать
+
+        :param writer: Запись в сокет
+        :type writer: asyncio.StreamWriter
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        queue = self.broker.add_relay()
+        try:
+            while (data := await queue.get()) is not None:
+                writer.write(json.dumps(data).encode() + b"\n")
+                await writer.drain()
+        finally:
+            self.broker.remove_relay(queue)
+
+    async def _send_preview(self, writer: asyncio.StreamWriter, camera_id: str, fps: float) -> None:
+        """
+        Корутина отправки кадров /stream другому воркеру, пока зритель не отключится
+
+        :param writer: Запись в сокет
+        :type writer: asyncio.StreamWriter
+        :param camera_id: Идентификатор камеры
+        :type camera_id: str
+        :param fps: Максимальная частота кадров зрителя
+        :type fps: float
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        block = self.manager.previews.get(camera_id)
+        if block is None:
+            return
+
+        frames = preview_frames(block, fps=fps)
+        try:
+            async for data in frames:
+                writer.write(f"{len(data)}\n".encode() + data)
+                await writer.drain()
+        finally:
+            # Зритель отключился - генератор отписывает его от кадров камеры
+            await frames.aclose()
+
+    async def _execute(self, request: dict) -> Any:
+        """
+        Метод выполнения команды владельцем
+
+        :param request: Команда и её параметры
+        :type request: dict
+        :return: Результат команды, при ошибке - error_response
+        :rtype: Any
+        """
+
+        params = dict(request)
+        operation = self._operations.get(params.pop("op", None))
+        if operation is None:
+            return error_response(f"unknown operation {request.get('op')}")
+        # Параметры проверяются до вызова: лишний или пропущенный параметр - ошибка запроса, а не команды
+        try:
+            inspect.signature(operation).bind(**params)
+        except TypeError as error:
+            return error_response(f"invalid parameters for {request['op']}: {error}")
+        camera_id = params.get("camera_id")
+        if camera_id is not None and (not isinstance(camera_id, str) or camera_id not in self.manager.cameras):
+            return error_response(f"camera {camera_id} not found")
+
+        return await operation(**params)
+
+    async def _start_camera(self, camera_id: str) -> dict:
+        async with self.manager.lock:
+            running = self.manager.is_running(camera_id)
+            # Процесс создаётся в потоке цикла событий: fork из другого потока небезопасен
+            if not running:
+                self.manager.start(camera_id)
+
+        return {"started": not running}
+
+    async def _stop_camera(self, camera_id: str) -> dict:
+        async with self.manager.lock:
+            running = self.manager.is_running(camera_id)
+            # Завершаем процесс, не блокируя цикл событий
+            if running:
+                await asyncio.to_thread(self.manager.stop, camera_id)
+
+        return {"stopped": running}
+
+    async def _status(self) -> dict:
+        return self.manager.status()
+
+    async def _settings(self) -> dict:
+        return {
+            camera_id: {"version": block.version, **block.values}
+            for camera_id, block in self.manager.tuning.items()
+        }
+
+    async def _update_settings(self, changes: dict, camera_id: str | None = None) -> dict:
+        if not isinstance(changes, dict):
+            return error_response("changes must be a JSON object")
+        blocks = {camera_id: self.manager.tuning[camera_id]} if camera_id is not None else self.manager.tuning
+        # Сначала проверяем настройки всех камер и только потом пишем: обновление применяется целиком или никак
+        merged = {block_id: {**block.values, **changes} for block_id, block in blocks.items()}
+        try:
+            for block_id, block in blocks.items():
+                block.validate(merged[block_id])
+        except ValueError as error:
+            return error_response(str(error))
+
+        return {
+            block_id: {"version": block.write(merged[block_id]), **block.values}
+            for block_id, block in blocks.items()
+        }
+
+    async def _profiler(self, enabled: bool | None = None) -> dict:
+        if enabled is True:
+            self.manager.profile_event.set()
+        elif enabled is False:
+            self.manager.profile_event.clear()
+
+        return {"enabled": self.manager.profile_event.is_set()}
+
+    async def _metrics(self) -> dict:
+        queues = {"events": self.event_queue, "inference_tasks": self.manager.task_queue}
+
+        return {
+            "running": {camera_id: self.manager.is_running(camera_id) for camera_id in self.manager.cameras},
+            "restarts": {camera_id: worker.restarts for camera_id, worker in self.manager.workers.items()},
+            "queues": {
+                name: queue_depth(queue) for name, queue in queues.items() if queue is not None
+            },
+        }
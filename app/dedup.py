@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Tuple
+
+import cv2
+import numpy as np
+from numpy import ndarray
+
+from tracking import BBox
+
+# Что делать с почти одинаковым снимком: suppress - не сохранять, merge - не сохранять,
+# а отметить в записи похожего снимка, что лицо всё ещё в области
+POLICIES = ("suppress", "merge")
+
+
+def phash(image: ndarray, bbox: BBox | None = None) -> int:
+    """
+    Функция расчёта перцептивного хэша (pHash): 64 бита низких частот DCT уменьшенной серой копии.
+    Небольшие изменения освещения, сжатия и сдвиг на пару пикселей почти не меняют хэш
+
+    :param image: Кадр BGR или серое изображение
+    :type image: ndarray
+    :param bbox: Рамка лица, None - хэш всего изображения
+    :type bbox: BBox | None
+    :return: Хэш в виде 64-битного числа
+    :rtype: int
+    """
+
+    if bbox is not None:
+        x, y, width, height = bbox
+        # Рамка трекера может выходить за кадр
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, image.shape[1]), min(y + height, image.shape[0])
+        if x1 > x0 and y1 > y0:
+            image = image[y0:y1, x0:x1]
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # Постоянная составляющая (яркость всего изображения) в медиану не входит
+    bits = low > np.median(low[1:])
+
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class HashIndex:
+    """
+    Индекс хэшей недавних снимков одной камеры.
+
+    Хранит не больше size хэшей за последние window секунд, поиск - перебор с расстоянием Хэмминга:
+    при сотнях записей это микросекунды, отдельная структура (BK-дерево, LSH) не нужна.
+    Хэши добавляют потоки записи фото, а ищет цикл распознавания, поэтому доступ под блокировкой.
+    """
+
+    def __init__(self, threshold: int = 8, window: float = 300, size: int = 256) -> None:
+        """
+        :param threshold: Максимальное расстояние Хэмминга (из 64 бит), при котором снимки считаются одинаковыми
+        :type threshold: int
+        :param window: Сколько секунд снимок участвует в сравнении
+        :type window: float
+        :param size: Максимальное количество хэшей в индексе
+        :type size: int
+        """
+
+        self.threshold: int = threshold
+        self.window: float = window
+        # Хэш, время снимка и имя файла, старые в начале
+        self._entries: Deque[Tuple[int, float, str]] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def find(self, value: int, now: float | None = None) -> str | None:
+        """
+        Метод поиска похожего недавнего снимка
+
+        :param value: Хэш нового снимка
+        :type value: int
+        :param now: Текущее время, None - time.time()
+        :type now: float | None
+        :return: Имя файла ближайшего похожего снимка, None - похожих нет
+        :rtype: str | None
+        """
+
+        if now is None:
+            now = time.time()
+        found, distance = None, self.threshold + 1
+        with self._lock:
+            # Устаревшие снимки больше не сравниваем
+            while self._entries and self._entries[0][1] < now - self.window:
+                self._entries.popleft()
+
+            for entry, _, name in self._entries:
+                current = (entry ^ value).bit_count()
+                if current < distance:
+                    found, distance = name, current
+
+        return found
+
+    def add(self, value: int, name: str, now: float | None = None) -> None:
+        """
+        Метод добавления хэша сохранённого снимка
+
+        :param value: Хэш снимка
+        :type value: int
+        :param name: Имя файла снимка
+        :type name: str
+        :param now: Время снимка, None - time.time()
+        :type now: float | None
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        with self._lock:
+            self._entries.append((value, time.time() if now is None else now, name))
@@ -0,0 +1,408 @@
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.queues import Queue
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+from numpy import ndarray
+
+from pipeline import PipelineStats
+from tracking import BBox, iou
+
+# Кадр, области распознавания камеры и порог уверенности детектора
+Task = Tuple[ndarray, Dict[str, Dict[str, int]], float]
+# Рамка лица и уверенность детектора
+Detection = Tuple[BBox, float]
+# Папка приложения, относительные пути к моделям считаются от неё, а не от текущей папки
+app_path = os.path.abspath(os.path.dirname(__file__))
+
+
+def region_crop(
+        region: Dict[str, int], margin: int, frame_shape: Tuple[int, ...]
+) -> Tuple[int, int, int, int]:
+    """
+    Функция расчёта области кадра для распознавания: область с отступом, обрезанная по границам кадра
+
+    :param region: Область распознавания
+    :type region: Dict[str, int]
+    :param margin: Отступ вокруг области в пикселях
+    :type margin: int
+    :param frame_shape: Размер кадра
+    :type frame_shape: Tuple[int, ...]
+    :return: Координаты x0, y0, x1, y1
+    :rtype: Tuple[int, int, int, int]
+    """
+
+    height, width = frame_shape[:2]
+    x0 = max(region["x"] - margin, 0)
+    y0 = max(region["y"] - margin, 0)
+    x1 = min(region["x"] + region["width"] + margin, width)
+    y1 = min(region["y"] + region["height"] + margin, height)
+
+    return x0, y0, x1, y1
+
+
+class DetectionBackend:
+    """
+    Бэкенд детектора лиц: получает пачку изображений и возвращает рамки с уверенностью для каждого.
+    score_threshold бэкенда - нижняя граница, порог камеры применяет движок, поэтому его можно менять на ходу
+    """
+
+    name: str = ""
+
+    def detect_batch(self, images: List[ndarray]) -> List[List[Detection]]:
+        """
+        Метод поиска лиц на пачке изображений
+
+        :param images: Изображения (непрерывные в памяти) разного размера
+        :type images: List[ndarray]
+        :return: Рамки лиц (x, y, ширина, высота) в координатах каждого изображения и уверенность детектора
+        :rtype: List[List[Detection]]
+        """
+
+        raise NotImplementedError
+
+    def warmup(self) -> None:
+        """
+        Метод прогрева на пустом кадре: первый вызов намного дольше следующих
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self.detect_batch([np.zeros((128, 128, 3), dtype=np.uint8)])
+
+    def close(self) -> None:
+        """
+        Метод освобождения ресурсов бэкенда
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+
+class MediaPipeBackend(DetectionBackend):
+    """
+    Детектор MediaPipe (BlazeFace). Пакетного режима у MediaPipe нет, поэтому пачка
+    раздаётся нескольким экземплярам детектора в пуле потоков (по одному на поток)
+    """
+
+    name = "mediapipe"
+
+    def __init__(
+            self, model: str = "blaze_face_short_range.tflite", threads: int = 1, score_threshold: float = 0.5
+    ) -> None:
+        """
+        :param model: Путь к модели
+        :type model: str
+        :param threads: Количество экземпляров детектора и потоков
+        :type threads: int
+        :param score_threshold: Минимальная уверенность детектора
+        :type score_threshold: float
+        """
+
+        import mediapipe as mp
+        from mediapipe.tasks import python
+        from mediapipe.tasks.python import vision
+
+        self._mp = mp
+        options = vision.FaceDetectorOptions(
+            base_options=python.BaseOptions(model_asset_path=os.path.join(app_path, model)),
+            min_detection_confidence=score_threshold,
+        )
+        self.detectors = [
+            vision.FaceDetector.create_from_options(options) for _ in range(max(threads, 1))
+        ]
+        self.executor: ThreadPoolExecutor | None = (
+            ThreadPoolExecutor(max_workers=len(self.detectors), thread_name_prefix="mediapipe")
+            if len(self.detectors) > 1 else None
+        )
+
+    def detect_batch(self, images: List[ndarray]) -> List[List[Detection]]:
+        if self.executor is None:
+            return [self._detect(self.detectors[0], image) for image in images]
+
+        # Изображения раздаются экземплярам по кругу, один экземпляр не используется двумя потоками сразу
+        count = len(self.detectors)
+        chunks = self.executor.map(
+            lambda index: [
+                (position, self._detect(self.detectors[index], images[position]))
+                for position in range(index, len(images), count)
+            ],
+            range(count),
+        )
+        result: List[List[Detection]] = [[] for _ in images]
+        for chunk in chunks:
+            for position, found in chunk:
+                result[position] = found
+
+        return result
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+        for detector in self.detectors:
+            detector.close()
+
+    def _detect(self, detector, image: ndarray) -> List[Detection]:
+        # Преобразуем фото в формат для распознавания
+        mp_image = self._mp.Image(image_format=self._mp.ImageFormat.SRGB, data=image)
+
+        return [
+            (
+                (
+                    detection.bounding_box.origin_x,
+                    detection.bounding_box.origin_y,
+                    detection.bounding_box.width,
+                    detection.bounding_box.height,
+                ),
+                detection.categories[0].score if detection.categories else 1.0,
+            )
+            for detection in detector.detect(mp_image).detections
+        ]
+
+
+class OnnxBackend(DetectionBackend):
+    """
+    Детектор на ONNX Runtime (CPU). Пачка изображений приводится к размеру входа модели
+    и выполняется одним вызовом сессии.
+
+    Ожидается модель в формате UltraFace (version-RFB-320.onnx): вход NCHW RGB, нормализация (x - 127) / 128,
+    выходы scores [N, K, 2] и boxes [N, K, 4] с углами рамок в долях изображения.
+    """
+
+    name = "onnx"
+
+    def __init__(
+            self,
+            model: str = "version-RFB-320.onnx",
+            threads: int = 1,
+            score_threshold: float = 0.7,
+            nms_threshold: float = 0.3,
+    ) -> None:
+        """
+        :param model: Путь к модели
+        :type model: str
+        :param threads: Количество потоков ONNX Runtime для одной пачки
+        :type threads: int
+        :param score_threshold: Минимальная уверенность детектора
+        :type score_threshold: float
+        :param nms_threshold: Пересечение, выше которого рамки считаются одним лицом
+        :type nms_threshold: float
+        """
+
+        # Необязательная зависимость, нужна только для этого бэкенда
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = max(threads, 1)
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(app_path, model), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.score_threshold: float = score_threshold
+        self.nms_threshold: float = nms_threshold
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name: str = model_input.name
+        batch, _, height, width = model_input.shape
+        # Размер входа задан в модели, для динамических размеров берём размер UltraFace 320
+        self.input_size: Tuple[int, int] = (
+            width if isinstance(width, int) else 320,
+            height if isinstance(height, int) else 240,
+        )
+        # Модель может быть экспортирована с фиксированной пачкой, тогда пачка делится на части
+        self.max_batch: int | None = batch if isinstance(batch, int) else None
+
+    def detect_batch(self, images: List[ndarray]) -> List[List[Detection]]:
+        blob = np.stack(
+            [
+                cv2.cvtColor(cv2.resize(image, self.input_size), cv2.COLOR_BGR2RGB)
+                for image in images
+            ]
+        ).transpose(0, 3, 1, 2).astype(np.float32)
+        blob = (blob - 127) / 128
+
+        step = self.max_batch or len(images)
+        scores, boxes = [], []
+        for start in range(0, len(images), step):
+            part_scores, part_boxes = self.session.run(
+                ["scores", "boxes"], {self.input_name: blob[start:start + step]}
+            )
+            scores.append(part_scores)
+            boxes.append(part_boxes)
+        scores = np.concatenate(scores)
+        boxes = np.concatenate(boxes)
+
+        return [
+            self._decode(scores[index, :, 1], boxes[index], images[index].shape)
+            for index in range(len(images))
+        ]
+
+    def _decode(self, scores: ndarray, boxes: ndarray, shape: Tuple[int, ...]) -> List[Detection]:
+        keep = scores > self.score_threshold
+        if not keep.any():
+            return []
+
+        height, width = shape[:2]
+        # Углы в долях изображения переводим в рамки (x, y, ширина, высота) в пикселях
+        corners = boxes[keep] * np.array([width, height, width, height], dtype=np.float32)
+        rects = [
+            (int(x0), int(y0), int(x1 - x0), int(y1 - y0)) for x0, y0, x1, y1 in corners.tolist()
+        ]
+        kept_scores = scores[keep].tolist()
+        indexes = cv2.dnn.NMSBoxes(rects, kept_scores, self.score_threshold, self.nms_threshold)
+
+        return [(rects[index], kept_scores[index]) for index in np.array(indexes).reshape(-1)]
+
+
+# Доступные бэкенды по названию из настроек
+BACKENDS = {
+    MediaPipeBackend.name: MediaPipeBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def create_backend(name: str = "mediapipe", **options) -> DetectionBackend:
+    """
+    Функция создания и прогрева бэкенда детектора по названию
+
+    :param name: Название бэкенда: mediapipe или onnx
+    :type name: str
+    :param options: Параметры бэкенда (model, threads, score_threshold)
+    :return: Прогретый бэкенд
+    :rtype: DetectionBackend
+    """
+
+    if name not in BACKENDS:
+        raise ValueError(f"unknown detection backend: {name}")
+    backend = BACKENDS[name](**options)
+    backend.warmup()
+
+    return backend
+
+
+class DetectionEngine:
+    """
+    Движок распознавания: принимает кадры нескольких камер и выполняет их одной пачкой.
+
+    Каждый кадр режется на области распознавания (режим roi), все области всех кадров уходят в бэкенд
+    одним вызовом, найденные рамки переводятся обратно в координаты своего кадра.
+    """
+
+    def __init__(
+            self,
+            backend: DetectionBackend,
+            roi: bool = True,
+            margin: int = 0,
+            stats: PipelineStats | None = None,
+    ) -> None:
+        """
+        :param backend: Бэкенд детектора
+        :type backend: DetectionBackend
+        :param roi: Распознавать только внутри областей, иначе на всём кадре
+        :type roi: bool
+        :param margin: Отступ вокруг области в пикселях
+        :type margin: int
+        :param stats: Статистика движка: кадры, пачки, время пачки
+        :type stats: PipelineStats | None
+        """
+
+        self.backend: DetectionBackend = backend
+        self.roi: bool = roi
+        self.margin: int = margin
+        self.stats: PipelineStats = stats or PipelineStats()
+
+    def detect(self, tasks: List[Task]) -> List[List[BBox]]:
+        """
+        Метод поиска лиц на пачке кадров
+
+        :param tasks: Кадры, области распознавания и пороги уверенности их камер
+        :type tasks: List[Task]
+        :return: Рамки лиц в координатах каждого кадра
+        :rtype: List[List[BBox]]
+        """
+
+        images: List[ndarray] = []
+        # Для каждого изображения: номер кадра и смещение области в кадре
+        origins: List[Tuple[int, int, int]] = []
+        for index, (frame, regions, _) in enumerate(tasks):
+            if not self.roi:
+                images.append(frame)
+                origins.append((index, 0, 0))
+                continue
+            for region in regions.values():
+                x0, y0, x1, y1 = region_crop(region=region, margin=self.margin, frame_shape=frame.shape)
+                # Срез - это представление без копирования кадра. Детектор требует непрерывную память,
+                # поэтому копируется только область, а не весь кадр
+                images.append(np.ascontiguousarray(frame[y0:y1, x0:x1]))
+                origins.append((index, x0, y0))
+
+        start = time.perf_counter()
+        found = self.backend.detect_batch(images) if images else []
+        self.stats.observe("batch", time.perf_counter() - start)
+        self.stats.inc("batches")
+        self.stats.inc("processed", len(tasks))
+        self.stats.inc("crops", len(images))
+        self.stats.set_gauge("batch_size", len(tasks))
+
+        result: List[List[BBox]] = [[] for _ in tasks]
+        for (index, x0, y0), detections in zip(origins, found):
+            score_threshold = tasks[index][2]
+            # Переводим рамки в координаты кадра
+            for (bx, by, bw, bh), score in detections:
+                if score < score_threshold:
+                    continue
+                bbox = (bx + x0, by + y0, bw, bh)
+                # Области могут пересекаться, одно лицо не должно попасть в список дважды
+                if all(iou(bbox, other) < 0.5 for other in result[index]):
+                    result[index].append(bbox)
+
+        return result
+
+    def snapshot(self) -> dict:
+        """
+        Метод получения статистики движка с названием бэкенда
+
+        :return: Статистика движка
+        :rtype: dict
+        """
+
+        return {"backend": self.backend.name, "pid": os.getpid(), **self.stats.snapshot()}
+
+
+def collect_batch(source: Queue, max_batch: int, max_latency: float, timeout: float = 0.5) -> list:
+    """
+    Функция сбора пачки из очереди: ждёт первый элемент, затем добирает пачку,
+    пока она не заполнится или не истечёт max_latency с момента первого элемента
+
+    :param source: Очередь задач
+    :type source: multiprocessing.Queue
+    :param max_batch: Максимальный размер пачки
+    :type max_batch: int
+    :param max_latency: Максимальная задержка первого элемента ради пачки в секундах
+    :type max_latency: float
+    :param timeout: Максимальное время ожидания первого элемента в секундах
+    :type timeout: float
+    :return: Пачка, пустая если задач не было
+    :rtype: list
+    """
+
+    try:
+        batch = [source.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+
+    deadline = time.monotonic() + max_latency
+    while len(batch) < max_batch:
+        remaining = deadline - time.monotonic()
+        try:
+            # Уже лежащие в очереди задачи забираем без ожидания, даже если срок вышел
+            batch.append(source.get(timeout=remaining) if remaining > 0 else source.get_nowait())
+        except queue.Empty:
+            break
+
+    return batch
@@ -0,0 +1,330 @@
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Mapping, Tuple
+
+from pipeline import PipelineStats
+
+# lockf есть только на Unix, на Windows запускается один воркер API и блокировка не нужна
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Имена фото содержат время снимка и не меняются, поэтому браузер может не перепроверять их год
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Тип содержимого по расширению файла
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".png": "image/png",
+}
+# Файл блокировки обхода папки кэша, общий для всех процессов API
+LOCK_FILE = ".lock"
+# Через сколько секунд временный файл копии считается оставшимся после сбоя
+TMP_GRACE = 3600
+# Сколько фото, которые не шире запрошенной копии, запоминать
+PASSTHROUGH_ENTRIES = 10000
+
+
+def image_etag(stat: os.stat_result, width: int | None = None) -> str:
+    """
+    Функция получения сильного ETag фото: размер и время изменения файла, для уменьшенной копии - ещё ширина.
+    Копия однозначно получается из оригинала, поэтому её ETag известен без пережатия
+
+    :param stat: Результат os.stat оригинала
+    :type stat: os.stat_result
+    :param width: Ширина уменьшенной копии, None - оригинал
+    :type width: int | None
+    :return: ETag в кавычках
+    :rtype: str
+    """
+
+    tag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    if width is not None:
+        tag += f"-w{width}"
+
+    return f'"{tag}"'
+
+
+def is_not_modified(headers: Mapping[str, str], etag: str, modified: float) -> bool:
+    """
+    Функция проверки условного запроса: есть ли у клиента актуальная копия.
+    If-None-Match сравнивается слабо (W/ не учитывается), If-Modified-Since проверяется, только если
+    If-None-Match не передан
+
+    :param headers: Заголовки запроса
+    :type headers: Mapping[str, str]
+    :param etag: ETag файла
+    :type etag: str
+    :param modified: Время изменения файла
+    :type modified: float
+    :return: Можно ответить 304
+    :rtype: bool
+    """
+
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # В заголовке время с точностью до секунды
+        return int(modified) <= since
+
+    return False
+
+
+class ResizeCache:
+    """
+    Кэш уменьшенных копий фото на диске с вытеснением давно не запрошенных (LRU).
+
+    Запрошенная ширина округляется вверх до одной из widths, чтобы число копий одного фото было ограничено.
+    Копия пережимается Pillow в пуле потоков (процесс API не загружает cv2), одновременные запросы одной копии
+    ждут одно пережатие. Папку кэша делят все процессы API, поэтому размер кэша считается по самой папке:
+    процесс ведёт оценку с последнего обхода папки и при её превышении (или раз в scan_interval) обходит
+    папку под блокировкой lockf и удаляет самые старые копии. Давность копии - время её создания или последнего
+    попадания в кэш этого процесса: попадания запоминаются в памяти, файлы копий при чтении не меняются.
+    Фото не шире запрошенной копии отдаются как есть, их ширина запоминается, чтобы не открывать фото снова.
+    """
+
+    def __init__(
+            self,
+            directory: str = "cache/images",
+            max_size_mb: float = 256,
+            widths: List[int] | None = None,
+            quality: int = 80,
+            scan_interval: float = 60,
+    ) -> None:
+        """
+        :param directory: Папка кэша
+        :type directory: str
+        :param max_size_mb: Максимальный размер кэша в мегабайтах
+        :type max_size_mb: float
+        :param widths: Допустимые ширины копий в пикселях
+        :type widths: List[int] | None
+        :param quality: Качество сжатия копий от 0 до 100
+        :type quality: int
+        :param scan_interval: Как часто в секундах пересчитывать размер кэша по папке, если копии добавляются
+        :type scan_interval: float
+        """
+
+        self.directory: str = directory
+        self.max_size: int = int(max_size_mb * 1024 * 1024)
+        self.widths: List[int] = sorted(widths or [160, 320, 640, 1280])
+        self.quality: int = quality
+        self.scan_interval: float = scan_interval
+        self.stats = PipelineStats()
+        # Оценка размера и количества копий: обход папки плюс копии, созданные этим процессом после него
+        self._size: int = 0
+        self._count: int = 0
+        self._scanned_at: float = 0
+        # Время последнего попадания в кэш этого процесса по ключу "ширина/имя фото"
+        self._used: Dict[str, float] = {}
+        # Ширина фото, которые не шире запрошенной копии, по имени: (время изменения фото, ширина)
+        self._passthrough: OrderedDict[str, Tuple[int, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Пережатия, которые сейчас выполняются
+        self._pending: Dict[str, asyncio.Future] = {}
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def pick_width(self, requested: int) -> int:
+        """
+        Метод выбора ширины копии: наименьшая из допустимых, не меньше запрошенной
+
+        :param requested: Запрошенная ширина
+        :type requested: int
+        :return: Ширина копии
+        :rtype: int
+        """
+
+        for width in self.widths:
+            if width >= requested:
+                return width
+
+        return self.widths[-1]
+
+    async def get(self, source: str, name: str, width: int) -> str | None:
+        """
+        Метод получения пути к уменьшенной копии, при промахе копия создаётся
+
+        :param source: Путь к оригиналу
+        :type source: str
+        :param name: Имя фото относительно папки с фото
+        :type name: str
+        :param width: Ширина копии из widths
+        :type width: int
+        :return: Путь к копии, None - оригинал не шире копии, отдаётся он сам
+        :rtype: str | None
+        """
+
+        key = f"{width}/{name}"
+        path = os.path.join(self.directory, str(width), name)
+        try:
+            source_mtime = os.stat(source).st_mtime_ns
+        except FileNotFoundError:
+            source_mtime = None
+
+        # Оригинал уже открывали, и он не шире копии
+        known = self._passthrough.get(name)
+        if known is not None and known[0] == source_mtime and known[1] <= width:
+            self.stats.inc("passthrough")
+            return None
+
+        # Копия есть и не старше оригинала (её мог создать другой процесс API)
+        try:
+            fresh = source_mtime is not None and os.stat(path).st_mtime_ns >= source_mtime
+        except FileNotFoundError:
+            fresh = False
+        if fresh:
+            with self._lock:
+                self._used[key] = time.time()
+            self.stats.inc("hits")
+            return path
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.get_running_loop().create_future()
+            self._pending[key] = pending
+            try:
+                result = await asyncio.to_thread(self._render, source, name, path, width)
+                pending.set_result(result)
+            except Exception as error:
+                pending.set_exception(error)
+                # Исключение получат и ожидающие запросы, здесь его не перевыбрасываем повторно
+                pending.exception()
+                raise
+            finally:
+                del self._pending[key]
+            return result
+
+        self.stats.inc("coalesced")
+        return await asyncio.shield(pending)
+
+    def snapshot(self) -> dict:
+        """
+        Метод получения статистики кэша
+
+        :return: Снимок PipelineStats с размером кэша
+        :rtype: dict
+        """
+
+        self.stats.set_gauge("image_cache_bytes", self._size)
+        self.stats.set_gauge("image_cache_entries", self._count)
+
+        return self.stats.snapshot()
+
+    def _render(self, source: str, name: str, path: str, width: int) -> str | None:
+        from PIL import Image
+
+        start = time.perf_counter()
+        with Image.open(source) as image:
+            if image.width <= width:
+                self._remember_passthrough(name, os.stat(source).st_mtime_ns, image.width)
+                self.stats.inc("passthrough")
+                return None
+            image_format = image.format
+            image.thumbnail((width, image.height), Image.Resampling.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Атомарная запись в свой временный файл: параллельный запрос (в том числе из другого процесса)
+            # не прочитает недописанную копию и не запишет в тот же файл
+            descriptor, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(descriptor, "wb") as file:
+                    image.save(file, format=image_format, quality=self.quality)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        self.stats.observe("resize", time.perf_counter() - start)
+        self.stats.inc("misses")
+
+        size = os.path.getsize(path)
+        with self._lock:
+            self._size += size
+            self._count += 1
+            scan = self._size > self.max_size or time.time() - self._scanned_at >= self.scan_interval
+        if scan:
+            self._scan()
+
+        return path
+
+    def _remember_passthrough(self, name: str, source_mtime: int, width: int) -> None:
+        with self._lock:
+            self._passthrough[name] = (source_mtime, width)
+            self._passthrough.move_to_end(name)
+            while len(self._passthrough) > PASSTHROUGH_ENTRIES:
+                self._passthrough.popitem(last=False)
+
+    def _scan(self) -> None:
+        # Обход папки под блокировкой между процессами: размер по файлам на диске, удаление самых старых копий
+        if fcntl is None:
+            self._scan_locked()
+            return
+
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as lock:
+            fcntl.lockf(lock, fcntl.LOCK_EX)
+            try:
+                self._scan_locked()
+            finally:
+                fcntl.lockf(lock, fcntl.LOCK_UN)
+
+    def _scan_locked(self) -> None:
+        now = time.time()
+        with self._lock:
+            used = dict(self._used)
+
+        found: List[Tuple[float, str, str, int]] = []
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                    # Временные файлы остаются после сбоя записи, свежие может дописывать другой процесс
+                    if file_name.endswith(".tmp"):
+                        if now - stat.st_mtime > TMP_GRACE:
+                            os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if root == self.directory and file_name == LOCK_FILE:
+                    continue
+                key = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                found.append((max(stat.st_mtime, used.get(key, 0)), key, path, stat.st_size))
+
+        # От давно не запрошенных к недавним, последнюю копию не удаляем
+        found.sort()
+        total = sum(size for *_, size in found)
+        evicted = set()
+        for _, key, path, size in found[:-1]:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted.add(key)
+            self.stats.inc("evictions")
+
+        with self._lock:
+            self._size = total
+            self._count = len(found) - len(evicted)
+            self._scanned_at = now
+            # Попадания удалённых копий больше не нужны
+            present = {key for _, key, _, _ in found} - evicted
+            self._used = {key: value for key, value in self._used.items() if key in present}
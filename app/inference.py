@@ -0,0 +1,265 @@
+import itertools
+import logging
+import os
+import queue
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.queues import Queue
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.synchronize import Event
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+logger = logging.getLogger(__name__)
+
+
+def attach_frame(
+        name: str, shape: Tuple[int, ...], dtype: str
+) -> Tuple[SharedMemory, ndarray]:
+    """
+    Функция подключения к кадру в общей памяти, созданному другим процессом
+
+    :param name: Имя блока общей памяти
+    :type name: str
+    :param shape: Размер кадра
+    :type shape: Tuple[int, ...]
+    :param dtype: Тип данных кадра
+    :type dtype: str
+    :return: Блок общей памяти и кадр поверх него (без копирования)
+    :rtype: Tuple[SharedMemory, ndarray]
+    """
+
+    shm = SharedMemory(name=name)
+    # Блоком владеет процесс камеры, он его и удалит.
+    # Без этого трекер ресурсов удалит блок при завершении воркера
+    resource_tracker.unregister(shm._name, "shared_memory")
+
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+class RemoteDetector:
+    """
+    Детектор на стороне процесса камеры, отправляет кадр в пул воркеров распознавания.
+
+    Кадр копируется в блок общей памяти камеры, по очереди задач передаётся только его имя и размер.
+    Следующий кадр записывается в тот же блок только после получения результата, поэтому воркер не увидит
+    кадр, который перезаписывается. Если результат не пришёл за timeout, воркер ещё может читать кадр:
+    следующий кадр пишется в новый блок, а старый удаляется (подключённый воркер дочитает его, новый
+    не подключится и пропустит задачу).
+    """
+
+    def __init__(
+            self,
+            camera_id: str,
+            regions: Dict[str, Dict[str, int]],
+            score_threshold: float,
+            task_queue: Queue,
+            result_queue: Queue,
+            timeout: float = 5,
+    ) -> None:
+        """
+        :param camera_id: Идентификатор камеры
+        :type camera_id: str
+        :param regions: Области распознавания камеры, процесс камеры заменяет их при изменении настроек
+        :type regions: Dict[str, Dict[str, int]]
+        :param score_threshold: Минимальная уверенность детектора, меняется вместе с областями
+        :type score_threshold: float
+        :param task_queue: Общая очередь задач пула
+        :type task_queue: multiprocessing.Queue
+        :param result_queue: Очередь результатов этой камеры
+        :type result_queue: multiprocessing.Queue
+        :param timeout: Максимальное время ожидания результата в секундах
+        :type timeout: float
+        """
+
+        self.camera_id: str = camera_id
+        self.regions: Dict[str, Dict[str, int]] = regions
+        self.score_threshold: float = score_threshold
+        self.task_queue: Queue = task_queue
+        self.result_queue: Queue = result_queue
+        self.timeout: float = timeout
+        self.shm: SharedMemory | None = None
+        self.frame: ndarray | None = None
+        # Номер запроса, нужен чтобы отбросить опоздавшие ответы. Очередь результатов переживает перезапуск
+        # процесса камеры, поэтому номер включает pid: ответ прошлому процессу не совпадёт с новым запросом
+        self._counter = itertools.count(1)
+        self._seq: Tuple[int, int] | None = None
+        # Ответ на последний запрос не получен, блок может читать воркер
+        self._pending: bool = False
+
+    def detect(self, frame: ndarray) -> List[Tuple[int, int, int, int]]:
+        """
+        Метод поиска лиц в пуле воркеров
+
+        :param frame: Кадр
+        :type frame: numpy.ndarray
+        :return: Рамки лиц в координатах кадра
+        :rtype: List[Tuple[int, int, int, int]]
+        """
+
+        # Блок создаётся при первом кадре и пересоздаётся, если изменился размер кадра
+        # или воркер ещё может читать кадр запроса, на который не дождались ответа
+        if self.frame is None or self.frame.shape != frame.shape or self._pending:
+            self.close()
+            self.shm = SharedMemory(create=True, size=frame.nbytes)
+            self.frame = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.shm.buf)
+
+        np.copyto(self.frame, frame)
+        self._seq = (os.getpid(), next(self._counter))
+        self._pending = True
+        self.task_queue.put(
+            (
+                self.camera_id,
+                self._seq,
+                self.shm.name,
+                frame.shape,
+                frame.dtype.str,
+                self.regions,
+                self.score_threshold,
+            )
+        )
+
+        while True:
+            try:
+                seq, found = self.result_queue.get(timeout=self.timeout)
+            except queue.Empty:
+                # Пул не успел ответить, считаем что лиц нет
+                return []
+            if seq == self._seq:
+                self._pending = False
+                return found
+
+    def close(self) -> None:
+        """
+        Метод освобождения общей памяти
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        if self.shm is not None:
+            self.frame = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+def inference_worker(
+        task_queue: Queue,
+        result_queues: Dict[str, Queue],
+        stop_event: Event,
+        event_queue: Queue | None = None,
+        index: int = 0,
+        profile_event: Event | None = None,
+) -> None:
+    """
+    Функция запущенная в процессе воркера распознавания, берёт кадры любых камер из общей очереди.
+
+    Задачи собираются в пачку (до max_batch кадров, первый кадр ждёт не дольше max_latency),
+    пачка выполняется движком распознавания одним вызовом бэкенда.
+
+    :param task_queue: Общая очередь задач
+    :type task_queue: multiprocessing.Queue
+    :param result_queues: Очереди результатов по идентификатору камеры
+    :type result_queues: Dict[str, multiprocessing.Queue]
+    :param stop_event: Тригер для прекращения бесконечного цикла
+    :type stop_event: Event
+    :param event_queue: Очередь для публикации статистики движка, None - не публиковать
+    :type event_queue: multiprocessing.Queue | None
+    :param index: Номер воркера в пуле
+    :type index: int
+    :param profile_event: Тригер включения профайлера, None - профайлер не используется
+    :type profile_event: Event | None
+    :return: Ничего не возвращает
+    :rtype: None
+    """
+
+    # cv2 и mediapipe загружаются только в процессе воркера, модель создаётся и прогревается сразу,
+    # а не на первом кадре
+    from config import settings
+    from engine import collect_batch
+    from models import detection_settings, get_engine
+    from profiler import ProfilerSwitch
+
+    engine = get_engine()
+    max_batch: int = detection_settings.get("max_batch", 8)
+    max_latency: float = detection_settings.get("max_latency", 0.01)
+    stats_interval: float = settings.get("pipeline", {}).get("stats_interval", 5)
+    next_report: float = time.monotonic() + stats_interval
+
+    # Профайлер включается во время работы через /profiler
+    profiler: ProfilerSwitch | None = None
+    if profile_event is not None:
+        profiler_settings: dict = settings.get("profiler", {})
+        profiler = ProfilerSwitch(
+            event=profile_event,
+            name=f"inference-{index}",
+            directory=profiler_settings.get("directory", "profiles"),
+            interval=profiler_settings.get("interval", 0.01),
+        )
+        profiler.start()
+
+    # Воркер API, который запустил пул
+    parent_pid = os.getppid()
+    # Подключённые блоки общей памяти по идентификатору камеры
+    attached: Dict[str, Tuple[SharedMemory, ndarray]] = {}
+    # Заменённые блоки: кадры из них ещё могут быть в текущей пачке, закрываются после неё
+    released: List[SharedMemory] = []
+
+    try:
+        while not stop_event.is_set():
+            if event_queue is not None and time.monotonic() >= next_report:
+                next_report = time.monotonic() + stats_interval
+                event_queue.put(
+                    {"type": "stats", "camera_id": f"inference-{index}", **engine.snapshot()}
+                )
+                # Владелец камер завершился, не остановив пул
+                if os.getppid() != parent_pid:
+                    break
+
+            batch = collect_batch(task_queue, max_batch=max_batch, max_latency=max_latency)
+            tasks = []
+            for task in batch:
+                camera_id, seq, name, shape, dtype, regions, score_threshold = task
+                frame_shm = attached.get(camera_id)
+                # Камера перезапустилась или изменился размер кадра - подключаемся к новому блоку
+                if frame_shm is None or frame_shm[0].name != name or frame_shm[1].shape != shape:
+                    if frame_shm is not None:
+                        # В одной пачке могут оказаться задача со старым блоком (камера не дождалась ответа
+                        # или перезапустилась) и задача с новым, поэтому старый блок закрывается после пачки
+                        released.append(attached.pop(camera_id)[0])
+                        frame_shm = None
+                    try:
+                        frame_shm = attached[camera_id] = attach_frame(name=name, shape=shape, dtype=dtype)
+                    except FileNotFoundError:
+                        # Камера уже остановлена и удалила блок
+                        continue
+                tasks.append((camera_id, seq, frame_shm[1], regions, score_threshold))
+
+            if tasks:
+                try:
+                    found = engine.detect([task[2:] for task in tasks])
+                except Exception:
+                    logger.exception("detection failed for a batch of %d frames", len(tasks))
+                    found = [[] for _ in tasks]
+
+                for (camera_id, seq), bboxes in zip([task[:2] for task in tasks], found):
+                    result_queues[camera_id].put((seq, bboxes))
+
+            # Сначала отпускаем кадры пачки, иначе блоки нельзя закрыть
+            tasks = []
+            while released:
+                released.pop().close()
+    finally:
+        tasks = []
+        while released:
+            released.pop().close()
+        while attached:
+            shm = attached.popitem()[1][0]
+            shm.close()
+        if profiler is not None:
+            profiler.stop()
+        if event_queue is not None:
+            event_queue.put({"type": "stats", "camera_id": f"inference-{index}", **engine.snapshot()})
@@ -1,22 +1,41 @@
+import asyncio
+import json
+import logging
+import os
+import time
 from contextlib import asynccontextmanager
-from multiprocessing import Event, Process
-from typing import Annotated, List
+from email.utils import formatdate
+from multiprocessing import Event, Process, Queue
+from typing import Annotated, List, Literal
 
 from fastapi import FastAPI, Query, Request, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from sse_starlette.sse import EventSourceResponse
 from starlette.responses import FileResponse
 
-from models import (
-    camera_process,
-    create_table,
-    get_all_images_from_db,
-    get_connection,
-    image_event_generator,
+from broker import EventBroker, image_event_generator
+from cameras import CameraManager
+from config import load_cameras, settings
+from control import CameraControl, OwnerUnavailable
+from images import IMMUTABLE, MEDIA_TYPES, ResizeCache, image_etag, is_not_modified
+from metrics import CONTENT_TYPE, MetricsWriter, add_pipeline
+from preview import BOUNDARY, create_previews, mjpeg_part
+from profiler import ProfilerSwitch
+from retention import retention_worker
+from shemas import Camera, CameraSettings, Humans
+from storage import (
+    AsyncDatabase,
     check_static,
+    create_table,
+    db_timestamp,
+    decode_cursor,
+    encode_cursor,
+    get_images_page,
+    get_session_stats,
+    session_bucket,
 )
-from shemas import Camera, Humans
+from tuning import create_blocks, score_floor
 
 # Словарь с тегами, нужен для отображения описания тегов в /docs
 tags_metadata = [
@@ -32,29 +51,137 @@ tags_metadata = [
         "name": "static",
         "description": "Набор методов для работы со статическими файлами.",
     },
+    {
+        "name": "stats",
+        "description": "Набор методов для статистики посещений.",
+    },
+    {
+        "name": "service",
+        "description": "Набор методов для наблюдения за работой приложения.",
+    },
 ]
 
-# Флаг включения камеры
-camera_run: bool = False
-# Стоп ивент для прерывания процесса камеры
-stop_event = None
-# Процесс в котором запущенна камера
-camera_proc = None
+# Логи всех процессов в stderr, процессы камер наследуют настройку
+logging.basicConfig(
+    level=settings.get("logging", {}).get("level", "INFO"),
+    format="%(asctime)s %(processName)s %(name)s %(levelname)s: %(message)s",
+)
+
+# Очередь, в которую процессы камер публикуют новые фото
+event_queue: Queue = Queue()
+# Брокер, раздающий новые фото всем SSE клиентам
+broker = EventBroker()
+# Асинхронный доступ к БД из обработчиков
+database = AsyncDatabase(pool_size=settings.get("database", {}).get("pool_size", 4))
+# Настройки супервизора процессов камер
+supervisor_settings: dict = settings.get("supervisor", {})
+# Менеджер процессов камер и пула распознавания
+camera_manager = CameraManager(
+    cameras=load_cameras(settings),
+    event_queue=event_queue,
+    inference_workers=settings.get("workers", {}).get("inference", 0),
+    heartbeat_timeout=supervisor_settings.get("heartbeat_timeout", 10),
+    startup_timeout=supervisor_settings.get("startup_timeout", 30),
+    backoff_base=supervisor_settings.get("backoff_base", 1),
+    backoff_max=supervisor_settings.get("backoff_max", 60),
+    stop_timeout=supervisor_settings.get("stop_timeout", 5),
+    # Блоки настроек создаются до запуска камер, процессы камер получают их при fork
+    tuning=create_blocks(settings),
+    # Блоки последних размеченных кадров для /stream, тоже до запуска камер
+    previews=create_previews(settings),
+)
+# Кэш уменьшенных копий фото для /images
+image_cache_settings: dict = settings.get("image_cache", {})
+image_cache = ResizeCache(
+    directory=image_cache_settings.get("directory", "cache/images"),
+    max_size_mb=image_cache_settings.get("max_size_mb", 256),
+    widths=image_cache_settings.get("widths"),
+    quality=image_cache_settings.get("quality", 80),
+    scan_interval=image_cache_settings.get("scan_interval", 60),
+)
+# Папка с фото, /images отдаёт только файлы внутри неё
+images_root = os.path.realpath(os.path.join("static", "images"))
+# Профайлер процесса API, включается вместе с профайлерами камер через /profiler
+profiler_settings: dict = settings.get("profiler", {})
+profiler = ProfilerSwitch(
+    event=camera_manager.profile_event,
+    name="api",
+    directory=profiler_settings.get("directory", "profiles"),
+    interval=profiler_settings.get("interval", 0.01),
+)
+# Очистка папки с фото, работает только у владельца камер
+retention_stop = Event()
+retention: Process | None = None
+
+
+async def start_retention() -> None:
+    """
+    Корутина запуска очистки папки с фото в отдельном процессе: проход по сотням тысяч файлов не мешает API
+
+    :return: Ничего не возвращает
+    :rtype: None
+    """
+
+    global retention
+
+    if settings.get("retention", {}).get("enabled", False):
+        retention = Process(target=retention_worker, args=(retention_stop, event_queue), name="retention")
+        retention.start()
+
+
+async def stop_retention() -> None:
+    """
+    Корутина остановки очистки папки с фото
+
+    :return: Ничего не возвращает
+    :rtype: None
+    """
+
+    if retention is not None:
+        retention_stop.set()
+        # Очистка останавливается между пачками, процесс ждём не дольше stop_timeout
+        await asyncio.to_thread(retention.join, camera_manager.stop_timeout)
+        if retention.is_alive():
+            retention.terminate()
+
+
+# Камерами владеет один воркер API, остальные управляют ими через его сокет
+control_settings: dict = settings.get("control", {})
+control = CameraControl(
+    manager=camera_manager,
+    broker=broker,
+    event_queue=event_queue,
+    socket_path=control_settings.get("socket", "camera.sock"),
+    lock_path=control_settings.get("lock", "camera.lock"),
+    supervise_interval=supervisor_settings.get("interval", 1),
+    retry_interval=control_settings.get("retry_interval", 1),
+    timeout=control_settings.get("timeout", 10),
+    on_acquire=start_retention,
+    on_release=stop_retention,
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Событийный контекст менеджер, нужен для выполнения кода до старта приложения и после завершения работы"""
 
-    # Создаём подключение
-    conn = get_connection()
     # Создаём таблицы в БД
-    create_table(conn=conn)
+    await database.run(create_table)
     # Проверяем созданы ли папки, если нет - создаём
     check_static()
+    # Становимся владельцем камер (брокер событий, наблюдение за процессами камер, очистка)
+    # или подписываемся на события владельца
+    await control.start()
+    profiler.start()
 
     yield
 
+    profiler.stop()
+    # Владелец останавливает очистку, камеры, пул распознавания и брокер событий
+    await control.stop()
+    # Закрываем соединения с БД
+    database.close()
+
 
 # Создаём приложение fastapi с настройками
 app = FastAPI(
@@ -66,6 +193,47 @@ app = FastAPI(
 )
 
 
+@app.exception_handler(OwnerUnavailable)
+async def owner_unavailable(request: Request, error: OwnerUnavailable) -> JSONResponse:
+    """
+    Обработчик недоступности владельца камер: он завершился, а другой воркер ещё не занял его место
+
+    :param request: Запрос
+    :type request: Request
+    :param error: Ошибка
+    :type error: OwnerUnavailable
+    :return: Ответ 503
+    :rtype: JSONResponse
+    """
+
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"message": f"camera owner is unavailable: {error}"},
+    )
+
+
+CameraId = Annotated[
+    str,
+    Query(description="Идентификатор камеры из settings.json"),
+]
+
+
+def camera_not_found(camera_id: str) -> JSONResponse:
+    """
+    Функция ответа для неизвестной камеры
+
+    :param camera_id: Идентификатор камеры
+    :type camera_id: str
+    :return: Ответ 404
+    :rtype: JSONResponse
+    """
+
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content={"message": f"camera {camera_id} not found"},
+    )
+
+
 @app.get(
     path="/start",
     response_model=Camera,
@@ -73,25 +241,21 @@ app = FastAPI(
     summary="Включить камеру",
     description="Эндпоинт для включения камеры.",
 )
-async def camera_start():
+async def camera_start(camera_id: CameraId = "0"):
     """
     Эндпоинт для включения камеры.
+
+    :param camera_id: Идентификатор камеры
     """
 
-    # Объявляем, что будем работать с данными глобальными переменными
-    global camera_run, camera_proc, stop_event
+    # Если такой камеры нет в настройках
+    if camera_id not in camera_manager.cameras:
+        return camera_not_found(camera_id)
 
-    # Если камера не запущено
-    if not camera_run:
-        # Изменяем флаг
-        camera_run = True
-        # Готовим стоп ивент
-        stop_event = Event()
-        # Создаём процесс
-        camera_proc = Process(target=camera_process, args=(stop_event,))
-        # Запускам камеру в отдельном процессе
-        camera_proc.start()
+    # Если камера не запущена, владелец запускает её в отдельном процессе
+    result = await control.call("start", camera_id=camera_id)
 
+    if result["started"]:
         # Сообщаем, что запустили камеру
         return JSONResponse(
             status_code=status.HTTP_200_OK, content={"message": "camera started"}
@@ -111,23 +275,21 @@ async def camera_start():
     summary="Выключить камеру",
     description="Эндпоинт для выключения камеры.",
 )
-async def camera_stop():
+async def camera_stop(camera_id: CameraId = "0"):
     """
     Эндпоинт для выключения камеры.
+
+    :param camera_id: Идентификатор камеры
     """
 
-    # Объявляем, что будем работать с данными глобальными переменными
-    global camera_run, camera_proc, stop_event
+    # Если такой камеры нет в настройках
+    if camera_id not in camera_manager.cameras:
+        return camera_not_found(camera_id)
 
-    # Если камера запущена
-    if camera_run:
-        # Изменяем флаг
-        camera_run = False
-        # Устанавливаем стоп ивент
-        stop_event.set()
-        # Завершаем процесс с камерой
-        camera_proc.join()
+    # Если камера запущена, владелец завершает её процесс
+    result = await control.call("stop", camera_id=camera_id)
 
+    if result["stopped"]:
         # Сообщаем, что выключили камеру
         return JSONResponse(
             status_code=status.HTTP_200_OK, content={"message": "camera stopped"}
@@ -140,14 +302,327 @@ async def camera_stop():
     )
 
 
+@app.get(
+    path="/pipeline",
+    tags=["camera"],
+    summary="Статистика конвейеров камер",
+    description="Эндпоинт для получения времени работы стадий конвейера, частоты кадров и счётчиков пропущенных кадров по каждой камере.",
+)
+async def pipeline_stats():
+    """
+    Эндпоинт для получения статистики конвейеров камер.
+    """
+    return JSONResponse(status_code=status.HTTP_200_OK, content=broker.stats)
+
+
+@app.get(
+    path="/stream",
+    tags=["camera"],
+    summary="Видео с разметкой",
+    description="Эндпоинт для просмотра камеры в реальном времени (MJPEG): последний обработанный кадр "
+                "с областями распознавания и рамками лиц. Кадр кодируется один раз для всех зрителей "
+                "и только пока есть хотя бы один зритель.",
+    response_class=StreamingResponse,
+)
+async def camera_stream(
+        camera_id: CameraId = "0",
+        fps: Annotated[
+            float | None,
+            Query(gt=0, description="Частота кадров, не больше preview.max_fps"),
+        ] = None,
+):
+    """
+    Эндпоинт для просмотра камеры с разметкой.
+
+    :param camera_id: Идентификатор камеры
+    :param fps: Частота кадров зрителя
+    """
+
+    preview_settings: dict = settings.get("preview", {})
+    # Если такой камеры нет в настройках или просмотр отключён
+    if camera_id not in camera_manager.cameras:
+        return camera_not_found(camera_id)
+    if not preview_settings.get("enabled", False):
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"message": "preview is disabled"})
+
+    max_fps: float = preview_settings.get("max_fps", 10)
+    frames = await control.preview(camera_id, fps=min(fps or max_fps, max_fps))
+
+    async def parts():
+        try:
+            async for data in frames:
+                yield mjpeg_part(data)
+        finally:
+            # Зритель отключился - отписываемся, без зрителей камера не кодирует кадры
+            await frames.aclose()
+
+    return StreamingResponse(parts(), media_type=f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+
+
+@app.get(
+    path="/settings",
+    tags=["camera"],
+    summary="Настройки камер",
+    description="Эндпоинт для получения текущих областей, времени нахождения в области, частоты распознавания "
+                "и порога уверенности каждой камеры.",
+)
+async def get_settings():
+    """
+    Эндпоинт для получения настроек камер, которые меняются без перезапуска.
+    """
+
+    return JSONResponse(status_code=status.HTTP_200_OK, content=await control.call("settings"))
+
+
+@app.put(
+    path="/settings",
+    tags=["camera"],
+    summary="Изменить настройки камер",
+    description="Эндпоинт для изменения областей, времени нахождения в области, частоты распознавания "
+                "и порога уверенности без перезапуска камеры: процесс камеры применяет их со следующего кадра. "
+                "Не переданные поля не меняются, изменения действуют до перезапуска приложения.",
+)
+async def put_settings(
+        update: CameraSettings,
+        camera_id: Annotated[
+            str | None,
+            Query(description="Идентификатор камеры, если не указан - настройки меняются у всех камер"),
+        ] = None,
+):
+    """
+    Эндпоинт для изменения настроек камер на ходу.
+
+    :param update: Новые значения настроек
+    :param camera_id: Идентификатор камеры
+    """
+
+    if camera_id is not None and camera_id not in camera_manager.tuning:
+        return camera_not_found(camera_id)
+
+    # Бэкенд детектора создан с нижней границей уверенности, ниже неё порог не опустить без перезапуска
+    floor = score_floor(settings)
+    if update.score_threshold is not None and update.score_threshold < floor:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content={"message": f"score_threshold must be at least {floor} (detection.min_score)"},
+        )
+
+    # Блоки настроек в общей памяти владельца, новые значения записывает он
+    result = await control.call(
+        "update_settings", changes=update.model_dump(exclude_none=True), camera_id=camera_id
+    )
+    if "error" in result:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, content={"message": result["error"]}
+        )
+
+    return JSONResponse(status_code=status.HTTP_200_OK, content=result)
+
+
+@app.get(
+    path="/status",
+    tags=["service"],
+    summary="Состояние камер",
+    description="Эндпоинт для получения состояния процессов камер: время работы, частота кадров, перезапуски, "
+                "время до следующего перезапуска и последняя ошибка.",
+)
+async def cameras_status():
+    """
+    Эндпоинт для получения состояния процессов камер.
+    """
+
+    result = await control.call("status")
+    for camera_id, camera in result["cameras"].items():
+        stats = broker.stats.get(camera_id, {})
+        # Частота кадров из последней статистики конвейера, у остановленной камеры - 0
+        camera["fps"] = stats.get("fps", {}).get("processed", 0.0) if camera["state"] == "running" else 0.0
+        # Последняя ошибка, о которой сообщил процесс камеры
+        camera["last_error"] = broker.errors.get(camera_id)
+
+    return JSONResponse(status_code=status.HTTP_200_OK, content=result)
+
+
+@app.get(
+    path="/database",
+    tags=["service"],
+    summary="Метрики пула БД",
+    description="Эндпоинт для получения размера очереди запросов к БД, времени ожидания и выполнения запросов.",
+)
+async def database_stats():
+    """
+    Эндпоинт для получения метрик пула БД.
+    """
+    return JSONResponse(status_code=status.HTTP_200_OK, content=database.snapshot())
+
+
+@app.get(
+    path="/metrics",
+    tags=["service"],
+    summary="Метрики Prometheus",
+    description="Эндпоинт для сбора метрик Prometheus: гистограммы стадий, частота кадров и счётчики каждой камеры "
+                "и воркера распознавания, подписчики SSE, глубина очередей, пул БД.",
+    response_class=PlainTextResponse,
+)
+async def metrics():
+    """
+    Эндпоинт для сбора метрик Prometheus.
+    Процессы камер и воркеры распознавания присылают статистику через очередь событий,
+    здесь собираются последние снимки всех процессов.
+    """
+
+    writer = MetricsWriter()
+    for source, stats in list(broker.stats.items()):
+        add_pipeline(writer, source=source, stats=stats)
+        # Статистика движка распознавания в процессе камеры, ресурсы процесса уже учтены в камере
+        if "engine" in stats:
+            engine = {key: value for key, value in stats["engine"].items() if key != "process"}
+            add_pipeline(writer, source=f"{source}-engine", stats=engine)
+    add_pipeline(writer, source="api", stats=database.stats.snapshot())
+    # Кэш копий работает в процессе API, ресурсы процесса уже учтены в api
+    cache_stats = {key: value for key, value in image_cache.snapshot().items() if key != "process"}
+    add_pipeline(writer, source="image-cache", stats=cache_stats)
+
+    writer.add("sse_subscribers", "gauge", "Подключённые SSE клиенты", len(broker.subscribers))
+    writer.add("queue_depth", "gauge", "Количество элементов в очереди", database.queued, queue="database")
+    writer.add("database_running", "gauge", "Выполняющиеся запросы к БД", database.running)
+
+    # Процессы камер и их очереди у владельца камер, без него отдаём только метрики этого воркера
+    try:
+        cameras = await control.call("metrics")
+    except OwnerUnavailable:
+        cameras = {"queues": {}, "running": {}, "restarts": {}}
+    for name, depth in cameras["queues"].items():
+        if depth is not None:
+            writer.add("queue_depth", "gauge", "Количество элементов в очереди", depth, queue=name)
+    for camera_id, running in cameras["running"].items():
+        writer.add("camera_running", "gauge", "Запущена ли камера", int(running), camera=camera_id)
+    for camera_id, restarts in cameras["restarts"].items():
+        writer.add("camera_restarts_total", "counter", "Перезапуски процесса камеры", restarts, camera=camera_id)
+
+    return PlainTextResponse(content=writer.render(), media_type=CONTENT_TYPE)
+
+
+@app.get(
+    path="/profiler",
+    tags=["service"],
+    summary="Профайлер",
+    description="Эндпоинт для включения и выключения семплирующего профайлера во всех процессах. "
+                "После выключения стеки записываются в папку профайлера в формате collapsed stacks.",
+)
+async def profiler_switch(
+        enabled: Annotated[
+            bool | None,
+            Query(description="true - включить, false - выключить и записать результат, без параметра - состояние"),
+        ] = None,
+):
+    """
+    Эндпоинт для управления профайлером.
+
+    :param enabled: Включить или выключить профайлер
+    """
+
+    result = await control.call("profiler", enabled=enabled)
+    directory = profiler.directory
+    files = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"enabled": result["enabled"], "directory": directory, "files": files},
+    )
+
+
+@app.get(
+    path="/stats",
+    tags=["stats"],
+    summary="Статистика посещений",
+    description="Эндпоинт для получения количества сеансов нахождения лица в области, снимков и длительности сеансов "
+                "по минутам, часам или дням. Считается по сводкам, которые обновляются при записи сеансов, "
+                "время ответа зависит только от количества корзин.",
+)
+async def get_stats(
+        start_date: Annotated[
+            str | None,
+            Query(
+                pattern=r"\b\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\b",
+                description="Дата и время в формате YYYY-MM-DD HH:MM:SS, по умолчанию - сутки назад",
+            ),
+        ] = None,
+        end_date: Annotated[
+            str | None,
+            Query(
+                pattern=r"\b\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\b",
+                description="Дата и время в формате YYYY-MM-DD HH:MM:SS, по умолчанию - сейчас",
+            ),
+        ] = None,
+        bucket: Annotated[
+            Literal["minute", "hour", "day"],
+            Query(description="Размер корзины"),
+        ] = "hour",
+        camera_id: Annotated[
+            str | None,
+            Query(description="Идентификатор камеры, если не указан - все камеры"),
+        ] = None,
+):
+    """
+    Эндпоинт для получения статистики сеансов по корзинам.
+
+    :param start_date: Дата от которой считать статистику
+    :param end_date: Дата по которую считать статистику
+    :param bucket: Размер корзины
+    :param camera_id: Идентификатор камеры
+    """
+
+    # Время в БД в UTC, как и время сеансов
+    end_date = end_date or db_timestamp()
+    # Первая корзина учитывается целиком, поэтому диапазон начинается с её начала
+    start_date = session_bucket(start_date or db_timestamp(time.time() - 24 * 60 * 60), bucket)
+
+    rows = await database.run(
+        get_session_stats, start_date=start_date, end_date=end_date, bucket=bucket, camera_id=camera_id
+    )
+    buckets = [
+        {
+            "start": period,
+            "sessions": sessions,
+            "snapshots": snapshots,
+            "total_duration": round(duration, 3),
+            "avg_duration": round(duration / sessions, 3),
+            "max_duration": round(max_duration, 3),
+        }
+        for period, sessions, snapshots, duration, max_duration in rows
+    ]
+    sessions = sum(item["sessions"] for item in buckets)
+    duration = sum(item["total_duration"] for item in buckets)
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "start_date": start_date,
+            "end_date": end_date,
+            "bucket": bucket,
+            "buckets": buckets,
+            "total": {
+                "sessions": sessions,
+                "snapshots": sum(item["snapshots"] for item in buckets),
+                "total_duration": round(duration, 3),
+                "avg_duration": round(duration / sessions, 3) if sessions else 0.0,
+                "max_duration": max((item["max_duration"] for item in buckets), default=0.0),
+            },
+        },
+    )
+
+
 @app.get(
     path="/humans",
     response_model=Humans,
     tags=["images"],
     summary="Получить список всех фото",
-    description="Эндпоинт для получения списка ссылок на все фото из БД.",
+    description="Эндпоинт для получения списка ссылок на фото из БД постранично. "
+                "Для следующей страницы передайте next_cursor в параметре cursor. "
+                "С format=ndjson отдаёт все фото диапазона потоком, по одному JSON объекту на строку.",
 )
 async def get_humans(
+        request: Request,
         start_date: Annotated[
             str | None,
             Query(
@@ -164,20 +639,138 @@ async def get_humans(
                 description="Дата и время в формате YYYY-MM-DD HH:MM:SS",
             ),
         ] = "2025-01-01 00:00:00",
+        camera_id: Annotated[
+            str | None,
+            Query(description="Идентификатор камеры, если не указан - фото со всех камер"),
+        ] = None,
+        limit: Annotated[
+            int,
+            Query(ge=1, le=1000, description="Количество фото на странице"),
+        ] = 100,
+        cursor: Annotated[
+            str | None,
+            Query(description="Курсор следующей страницы из next_cursor"),
+        ] = None,
+        response_format: Annotated[
+            Literal["json", "ndjson"],
+            Query(alias="format", description="json - страница, ndjson - поток всех фото"),
+        ] = "json",
 ):
     """
-    Эндпоинт для получения списка ссылок на все фото из БД.
+    Эндпоинт для получения списка ссылок на фото из БД.
 
+    :param request: Запрос, из него берётся адрес сервера для ссылок
     :param start_date: Дата от которой вести поиск
     :param end_date: Дата по которую вести поиск
+    :param camera_id: Идентификатор камеры
+    :param limit: Количество фото на странице
+    :param cursor: Курсор следующей страницы
+    :param response_format: Формат ответа
     :return:
     """
-    conn = get_connection()
-    images: List[str] = get_all_images_from_db(
-        conn=conn, start_date=start_date, end_date=end_date
+
+    # Позиция, после которой продолжать выдачу
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST, content={"message": "invalid cursor"}
+        )
+
+    # Ссылки строим от адреса, по которому пришёл запрос
+    images_url: str = str(request.base_url) + "images/"
+
+    if response_format == "ndjson":
+
+        async def rows():
+            # Страницы читаются по очереди через пул БД, весь результат в памяти не держим
+            async for row_id, filename, created_at, row_camera_id in database.iterate(
+                    get_images_page,
+                    key=lambda row: (row[2], row[0]),
+                    start_date=start_date,
+                    end_date=end_date,
+                    camera_id=camera_id,
+                    after=after,
+            ):
+                yield json.dumps(
+                    {
+                        "id": row_id,
+                        "url": images_url + filename,
+                        "created_at": created_at,
+                        "camera_id": row_camera_id,
+                    }
+                ) + "\n"
+
+        return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+    page = await database.run(
+        get_images_page,
+        start_date=start_date,
+        end_date=end_date,
+        camera_id=camera_id,
+        after=after,
+        limit=limit,
     )
 
-    return JSONResponse({"images": images})
+    images: List[str] = [images_url + filename for _, filename, _, _ in page]
+    # Если страница полная, дальше могут быть ещё записи
+    next_cursor = encode_cursor(page[-1][2], page[-1][0]) if len(page) == limit else None
+    # Если записей нет совсем, сообщаем что файлов нет
+    if not images and after is None:
+        images = ["Not_files"]
+
+    return JSONResponse({"images": images, "next_cursor": next_cursor})
+
+
+@app.get(
+    path="/images/{path:path}",
+    name="image",
+    tags=["images"],
+    summary="Получить фото",
+    description="Эндпоинт для получения фото или миниатюры (thumbs/...) с кэшированием в браузере: "
+                "ETag, Cache-Control immutable и ответ 304 на условные запросы. "
+                "С параметром w отдаёт уменьшенную копию, копии хранятся в кэше на диске.",
+    response_class=Response,
+)
+async def get_image(
+        request: Request,
+        path: str,
+        w: Annotated[
+            int | None,
+            Query(ge=16, le=4096, description="Ширина копии, округляется вверх до ширины из image_cache.widths"),
+        ] = None,
+):
+    """
+    Эндпоинт для получения фото.
+
+    :param request: Запрос, из него берутся условные заголовки
+    :param path: Имя фото относительно static/images
+    :param w: Ширина уменьшенной копии
+    """
+
+    # Файл должен лежать внутри папки с фото
+    source = os.path.realpath(os.path.join(images_root, path))
+    extension = os.path.splitext(source)[1].lower()
+    if not source.startswith(images_root + os.sep) or extension not in MEDIA_TYPES or not os.path.isfile(source):
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"message": "image not found"})
+
+    stat = os.stat(source)
+    width = image_cache.pick_width(w) if w is not None else None
+    # Валидаторы строятся по оригиналу: копия из кэша могла быть создана позже, но она однозначно следует из него
+    headers = {
+        "ETag": image_etag(stat, width),
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": IMMUTABLE,
+    }
+    # У клиента уже есть это фото - отвечаем без тела
+    if is_not_modified(request.headers, headers["ETag"], stat.st_mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    file_path = source
+    if width is not None:
+        file_path = await image_cache.get(source, os.path.relpath(source, images_root), width) or source
+
+    return FileResponse(file_path, media_type=MEDIA_TYPES[extension], headers=headers)
 
 
 @app.get(
@@ -190,7 +783,18 @@ async def event_stream(request: Request):
     """
     Эндпоинт - ивент, отправляет на frontend ссылку на новое фото, если камера распознала лицо, и оно находилось в кадре 5 или более секунд
     """
-    return EventSourceResponse(image_event_generator())
+    # Подписываемся на события брокера
+    queue = broker.subscribe()
+
+    async def generator():
+        try:
+            async for data in image_event_generator(queue=queue):
+                yield data
+        finally:
+            # Клиент отключился - отписываемся
+            broker.unsubscribe(queue)
+
+    return EventSourceResponse(generator())
 
 
 # Подключаем статику
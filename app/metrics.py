@@ -0,0 +1,154 @@
+import re
+from typing import Dict, List
+
+from pipeline import LATENCY_BUCKETS
+
+# Префикс всех метрик приложения
+PREFIX = "aivision"
+# Тип содержимого текстового формата Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _name(name: str) -> str:
+    # В именах метрик допустимы только буквы, цифры и подчёркивание
+    return f"{PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class MetricsWriter:
+    """
+    Сборщик текста в формате Prometheus: строки одной метрики идут подряд под общими HELP и TYPE
+    """
+
+    def __init__(self) -> None:
+        # Строки по имени метрики, порядок метрик - порядок первого добавления
+        self._metrics: Dict[str, List[str]] = {}
+
+    def add(self, name: str, metric_type: str, help_text: str, value: float, **labels: str) -> None:
+        """
+        Метод добавления значения метрики
+
+        :param name: Имя метрики без префикса
+        :type name: str
+        :param metric_type: Тип метрики: counter, gauge или histogram
+        :type metric_type: str
+        :param help_text: Описание метрики
+        :type help_text: str
+        :param value: Значение
+        :type value: float
+        :param labels: Метки значения
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self._series(name, metric_type, help_text).append(f"{_name(name)}{_labels(**labels)} {value}")
+
+    def add_histogram(self, name: str, help_text: str, histogram: dict, **labels: str) -> None:
+        """
+        Метод добавления гистограммы из PipelineStats: корзины переводятся в накопительные
+
+        :param name: Имя метрики без префикса
+        :type name: str
+        :param help_text: Описание метрики
+        :type help_text: str
+        :param histogram: Гистограмма: buckets, sum, count
+        :type histogram: dict
+        :param labels: Метки значения
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        lines = self._series(name, "histogram", help_text)
+        metric = _name(name)
+        total = 0
+        for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), histogram["buckets"]):
+            total += count
+            lines.append(f"{metric}_bucket{_labels(**labels, le=bound)} {total}")
+        lines.append(f"{metric}_sum{_labels(**labels)} {histogram['sum']}")
+        lines.append(f"{metric}_count{_labels(**labels)} {histogram['count']}")
+
+    def render(self) -> str:
+        """
+        Метод получения текста для /metrics
+
+        :return: Метрики в текстовом формате Prometheus
+        :rtype: str
+        """
+
+        return "".join(line + "\n" for lines in self._metrics.values() for line in lines)
+
+    def _series(self, name: str, metric_type: str, help_text: str) -> List[str]:
+        if name not in self._metrics:
+            self._metrics[name] = [f"# HELP {_name(name)} {help_text}", f"# TYPE {_name(name)} {metric_type}"]
+
+        return self._metrics[name]
+
+
+def add_pipeline(writer: MetricsWriter, source: str, stats: dict) -> None:
+    """
+    Функция добавления статистики одного процесса (камеры, воркера распознавания или API)
+
+    :param writer: Сборщик метрик
+    :type writer: MetricsWriter
+    :param source: Источник статистики: идентификатор камеры, inference-N или api
+    :type source: str
+    :param stats: Снимок PipelineStats
+    :type stats: dict
+    :return: Ничего не возвращает
+    :rtype: None
+    """
+
+    for stage, histogram in stats.get("histograms", {}).items():
+        writer.add_histogram(
+            "stage_duration_seconds",
+            "Время выполнения стадии конвейера",
+            histogram,
+            source=source,
+            stage=stage,
+        )
+    for counter, value in stats.get("counters", {}).items():
+        writer.add(f"{counter}_total", "counter", f"Счётчик {counter}", value, source=source)
+    for gauge, value in stats.get("gauges", {}).items():
+        writer.add(gauge, "gauge", f"Текущее значение {gauge}", value, source=source)
+    for kind, value in stats.get("fps", {}).items():
+        writer.add("fps", "gauge", "Средняя частота кадров с запуска процесса", value, source=source, kind=kind)
+    writer.add("uptime_seconds", "gauge", "Время работы процесса", stats.get("uptime", 0), source=source)
+
+    process = stats.get("process") or {}
+    if process.get("cpu_s") is not None:
+        writer.add(
+            "process_cpu_seconds_total", "counter", "Процессорное время процесса", process["cpu_s"], source=source
+        )
+    if process.get("max_rss_mb") is not None:
+        writer.add(
+            "process_max_rss_bytes",
+            "gauge",
+            "Пиковая память процесса",
+            int(process["max_rss_mb"] * 1024 * 1024),
+            source=source,
+        )
+
+
+def queue_depth(queue) -> int | None:
+    """
+    Функция получения длины очереди процессов
+
+    :param queue: Очередь multiprocessing
+    :return: Количество элементов, None - размер недоступен (qsize не реализован в macOS)
+    :rtype: int | None
+    """
+
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        return None
@@ -1,335 +1,691 @@
-import asyncio
-import json
 import os
-import sqlite3
+import sys
+import threading
 import time
-from datetime import datetime
+from datetime import datetime, timezone
+from multiprocessing.queues import Queue
 from multiprocessing.synchronize import Event
-from sqlite3 import Connection, Error
-from typing import Dict, List
+from typing import Callable, Dict, List
 
 import cv2
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
 from numpy import ndarray
 
-
-def load_settings(file_name: str = "settings.json") -> Dict[str, Dict[str, str]]:
-    """
-    Функция загрузки настроек области для распознавания лица в кадре
-
-    :param file_name: Имя файла с настройками
-    :type file_name: str
-    :return: Ключ с набором параметров
-    :rtype: Dict[str, Dict[str, str]]
-    """
-    app_path = os.path.abspath(os.path.dirname(__file__))
-    settings_path = os.path.abspath(os.path.join(app_path, "..", file_name))
-
-    with open(settings_path, "r", encoding="utf-8") as file:
-        return json.load(file)
-
+from config import load_cameras, load_settings, settings
+from dedup import POLICIES as DEDUP_POLICIES, HashIndex, phash
+from engine import DetectionEngine, create_backend
+from inference import RemoteDetector
+from motion import MotionGate
+from persistence import ImageWriter
+from preview import PreviewBlock
+from pipeline import CaptureThread, FrameRingBuffer, PipelineStats
+from profiler import ProfilerSwitch
+from sources import open_source
+from storage import DatabaseWriter, db_timestamp, shard_name
+from tracking import BBox, FaceTracker, Track
+from tuning import SettingsBlock, camera_tuning, score_floor
 
 # Путь к статическим файлам (фото)
 file_path = "static/images"
 
-# Выбираем видеокамеру
-camera: cv2.VideoCapture = cv2.VideoCapture(0)
-# Загружаем настройки камеры
-camera_region_detect: dict = load_settings()["frame"]
+# Настройки распознавания: roi - распознавать только внутри областей, margin - отступ вокруг области,
+# backend, model, threads - бэкенд детектора и его параметры, score_threshold - порог уверенности по умолчанию
+detection_settings: dict = settings.get("detection", {})
 
-# Настройка распознавания лица
-base_options = python.BaseOptions(
-    model_asset_path="blaze_face_short_range.tflite",
-)
-options = vision.FaceDetectorOptions(base_options=base_options)
-detector = vision.FaceDetector.create_from_options(options)
-mp_drawing = mp.solutions.drawing_utils
+# Движок распознавания текущего процесса и pid процесса, в котором он создан
+_engine: DetectionEngine | None = None
+_engine_pid: int | None = None
 
 
-def check_static() -> None:
+def get_engine() -> DetectionEngine:
     """
-    Функция для проверки существования папок static и images
+    Функция получения движка распознавания. Движок создаётся в том процессе, где используется:
+    созданный в родительском процессе детектор не работает после fork (его потоки не копируются).
+    Модель загружается один раз на процесс и сразу прогревается на пустом кадре
 
-    :return: Ничего не возвращает
-    :rtype: None
+    :return: Движок распознавания
+    :rtype: DetectionEngine
     """
 
-    # Путь к приложению
-    app_path = os.path.abspath(os.path.dirname(__file__))
+    global _engine, _engine_pid
 
-    # Если папки не существует, создаём
-    if not os.path.exists(os.path.join(app_path, "static")):
-        os.mkdir(os.path.join(app_path, "static"))
+    if _engine is None or _engine_pid != os.getpid():
+        options = {
+            key: detection_settings[key]
+            for key in ("model", "threads")
+            if key in detection_settings
+        }
+        # Бэкенд отдаёт лица с уверенностью от нижней границы, порог камеры применяет движок
+        options["score_threshold"] = score_floor(settings)
+        _engine = DetectionEngine(
+            backend=create_backend(detection_settings.get("backend", "mediapipe"), **options),
+            roi=detection_settings.get("roi", True),
+            margin=detection_settings.get("margin", 0),
+        )
+        _engine_pid = os.getpid()
 
-    # Если папки не существует, создаём
-    if not os.path.exists(os.path.join(app_path, "static", "images")):
-        os.mkdir(os.path.join(app_path, "static", "images"))
+    return _engine
 
 
-def get_connection() -> Connection:
+def in_region(bbox: BBox, region: Dict[str, int]) -> bool:
     """
-    Функция получения соединения с БД
+    Функция проверки, находится ли лицо в области распознавания
 
-    :return: Соединение с БД
-    :rtype: Connection
+    :param bbox: Рамка лица (x, y, ширина, высота) в координатах кадра
+    :type bbox: BBox
+    :param region: Область распознавания
+    :type region: Dict[str, int]
+    :return: Находится ли лицо в области
+    :rtype: bool
     """
 
-    with sqlite3.connect(database="database.db") as conn:
-        return conn
+    # Верхняя левая точка начала области распознавания
+    x, y, = region["x"], region["y"]
+    # Область распознавания
+    w, h = region["width"], region["height"]
+    # Нижняя правая точка лица
+    right, bottom = int(bbox[0] + bbox[2]), int(bbox[1] + bbox[3])
 
+    return (x < right < x + w) and (y < bottom < y + h)
 
-def create_table(conn: Connection) -> None:
-    """
-    Функция создания таблиц в БД
 
-    :param conn: Соединение с базой данных
-    :type conn: Connection
-    :return: Ничего не возвращает
-    :rtype: None
+def detect_boxes(
+        frame: ndarray, regions: Dict[str, Dict[str, int]], score_threshold: float | None = None
+) -> List[BBox]:
     """
+    Функция поиска лиц на кадре
 
-    # Запрос для БД
-    query: str = """
-    CREATE TABLE IF NOT EXISTS humans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                filename TEXT NOT NULL,
-                created_at TEXT DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """
+    В режиме roi детектор запускается только на части кадра вокруг каждой области (с отступом margin),
+    все области уходят в бэкенд одной пачкой, найденные рамки переводятся обратно в координаты кадра.
+    Иначе детектор запускается один раз на весь кадр.
 
-    try:
-        # Создаём курсор для выполнения запроса в БД
-        cursor = conn.cursor()
-        # Выполняем запрос
-        cursor.execute(query)
-        # Сохраняем в БД
-        conn.commit()
-    except Error as exc:
-        # Выводим ошибку
-        print(exc, type(exc))
-
-
-def save_image_to_db(conn: Connection, filename: str) -> None:
+    :param frame: Кадр полученный с камеры
+    :type frame: numpy.ndarray
+    :param regions: Области распознавания камеры
+    :type regions: Dict[str, Dict[str, int]]
+    :param score_threshold: Минимальная уверенность детектора, None - из settings.json
+    :type score_threshold: float | None
+    :return: Рамки лиц в координатах кадра
+    :rtype: List[BBox]
     """
-    Функция записи названия файла в БД
 
-    :param conn: Соединение с базой данных
-    :type conn: Connection
-    :param filename: Имя файла
-    :type filename: str
-    :return: Ничего не возвращает
-    :rtype: None
-    """
+    if score_threshold is None:
+        score_threshold = detection_settings.get("score_threshold", 0.5)
 
-    # Запрос для БД
-    query: str = """
-    INSERT INTO humans (filename) VALUES (?)
-    """
+    return get_engine().detect([(frame, regions, score_threshold)])[0]
 
-    try:
-        # Создаём курсор для выполнения запроса в БД
-        cursor = conn.cursor()
-        # Выполняем запрос
-        cursor.execute(query, (filename,))
-        # Сохраняем в БД
-        conn.commit()
-    except Error as exc:
-        # Выводим ошибку
-        print(exc, type(exc))
-
-
-def get_all_images_from_db(
-        conn: Connection, start_date: str, end_date: str
-) -> List[str]:
+
+def fase_detect(frame: ndarray, regions: Dict[str, Dict[str, int]]) -> List[str]:
     """
-    Функция получения всех путей к файлам из БД по фильтру дат
-
-    :param conn: Соединение с базой данных
-    :type conn: Connection
-    :param start_date: Дата начала
-    :type start_date: str
-    :param end_date: Дата окончания
-    :type end_date: str
-    :return: Список путей к файлу
+    Функция распознавания лица
+
+    :param frame: Кадр полученный с камеры
+    :type frame: numpy.ndarray
+    :param regions: Области распознавания камеры
+    :type regions: Dict[str, Dict[str, int]]
+    :return: Названия областей, в которых найдено лицо (пустой список - лиц нет)
     :rtype: List[str]
     """
 
-    # Запрос для БД
-    query: str = """SELECT filename FROM humans WHERE created_at BETWEEN ? AND ?"""
+    bboxes = detect_boxes(frame, regions=regions)
 
-    try:
-        # Создаём курсор для выполнения запроса в БД
-        cursor = conn.cursor()
-        # Выполняем запрос
-        cursor.execute(query, (start_date, end_date))
-        # Получаем данные
-        images = cursor.fetchall()
-        if images:
-            # Создаём список ссылок к файлам
-
-            # Создаём список ссылок на фото
-            images: List[str] = [f"http://127.0.0.1:5000/static/images/{i_image[0]}" for i_image in images]
-            # Возвращаем список ссылок на файлы
-            return images
-    except Error as exc:
-        # Выводим ошибку
-        print(exc, type(exc))
-
-    # Если нет записей в бд или ошибка возвращаем, что файлов нет
-    return ["Not_files"]
-
-
-def get_latest_image_from_db(conn: Connection) -> Dict[str, str] | None:
+    # Лиц может быть несколько, проверяем каждую область по своей рамке
+    return [
+        name
+        for name, region in regions.items()
+        if any(in_region(bbox=bbox, region=region) for bbox in bboxes)
+    ]
+
+
+def annotate_frame(
+        frame: ndarray, regions: Dict[str, Dict[str, int]], tracks: List[Track], width: int = 0
+) -> ndarray:
+    """
+    Функция разметки кадра для /stream: области распознавания и рамки лиц.
+    Лицо в области - зелёная рамка, вне областей - жёлтая
+
+    :param frame: Кадр, не изменяется
+    :type frame: numpy.ndarray
+    :param regions: Области распознавания камеры
+    :type regions: Dict[str, Dict[str, int]]
+    :param tracks: Отслеживаемые лица
+    :type tracks: List[Track]
+    :param width: Ширина размеченного кадра, 0 или больше ширины кадра - без уменьшения
+    :type width: int
+    :return: Размеченная копия кадра
+    :rtype: numpy.ndarray
     """
-    Функция для получения последнего файла из БД
 
-    :param conn: Соединение с базой данных
-    :type conn: Connection
-    :return: Возвращает имя последнего файла
-    :rtype: Dict[str, str]
+    height, frame_width = frame.shape[:2]
+    scale = 1.0
+    if 0 < width < frame_width:
+        # Уменьшаем до разметки, рисовать на меньшем кадре дешевле
+        scale = width / frame_width
+        image = cv2.resize(frame, (width, max(round(height * scale), 1)), interpolation=cv2.INTER_AREA)
+    else:
+        image = frame.copy()
+
+    for name, region in regions.items():
+        left, top = round(region["x"] * scale), round(region["y"] * scale)
+        cv2.rectangle(
+            image,
+            (left, top),
+            (round((region["x"] + region["width"]) * scale), round((region["y"] + region["height"]) * scale)),
+            (255, 0, 0),
+            2,
+        )
+        cv2.putText(image, name, (left + 4, top + 16), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
+
+    for track in tracks:
+        x, y, w, h = track.bbox
+        inside = any(in_region(bbox=track.bbox, region=region) for region in regions.values())
+        color = (0, 255, 0) if inside else (0, 255, 255)
+        left, top = round(x * scale), round(y * scale)
+        cv2.rectangle(image, (left, top), (round((x + w) * scale), round((y + h) * scale)), color, 2)
+        cv2.putText(
+            image, str(track.track_id), (left, max(top - 4, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1
+        )
+
+    return image
+
+
+def on_image_saved(
+        file_name: str,
+        created_at: str,
+        size: int,
+        camera_id: str,
+        event_queue: Queue,
+        writer: DatabaseWriter,
+        thumbnail: bool = True,
+        phash: str | None = None,
+) -> None:
     """
+    Функция, вызываемая после записи фото на диск: запись в БД и событие для брокера
 
-    # Запрос для БД
-    query: str = """SELECT filename FROM humans ORDER BY created_at DESC LIMIT 1"""
+    :param file_name: Имя файла
+    :type file_name: str
+    :param created_at: Время снимка
+    :type created_at: str
+    :param size: Размер фото с миниатюрой в байтах
+    :type size: int
+    :param camera_id: Идентификатор камеры
+    :type camera_id: str
+    :param event_queue: Очередь для публикации событий о новых фото
+    :type event_queue: multiprocessing.Queue
+    :param writer: Поток записи в БД
+    :type writer: DatabaseWriter
+    :param thumbnail: Создана ли миниатюра фото
+    :type thumbnail: bool
+    :param phash: Перцептивный хэш лица в шестнадцатеричном виде, None - дедупликация выключена
+    :type phash: str | None
+    :return: Ничего не возвращает
+    :rtype: None
+    """
 
-    try:
-        # Создаём курсор для выполнения запроса в БД
-        cursor = conn.cursor()
-        # Выполняем запрос
-        cursor.execute(query)
-        # Получаем данные
-        image = cursor.fetchone()
-        if image:
-            # Возвращаем имя последнего файла
-            return {"file_name": image[0]}
-    except Error as exc:
-        print(exc, type(exc))
-
-    # Если ничего не найдено
-    return None
-
-
-def fase_detect(frame: ndarray) -> bool:
+    # Ставим запись в очередь, она попадёт в БД пачкой
+    writer.add(filename=file_name, camera_id=camera_id, created_at=created_at, size=size, phash=phash)
+    # Публикуем событие один раз, брокер раздаст его всем клиентам
+    event_queue.put(
+        {
+            "type": "new_image",
+            "camera_id": camera_id,
+            "file_name": file_name,
+            "thumbnail": f"thumbs/{file_name}" if thumbnail else file_name,
+        }
+    )
+
+
+def end_session(track: Track, camera_id: str, writer: DatabaseWriter, stats: PipelineStats) -> None:
+    """
+    Функция завершения сеанса нахождения лица в области. Сеанс записывается, только если за него
+    был хотя бы один снимок (лицо пробыло в области dwell_time), проходящие мимо не учитываются
+
+    :param track: Трек лица
+    :type track: Track
+    :param camera_id: Идентификатор камеры
+    :type camera_id: str
+    :param writer: Поток записи в БД
+    :type writer: DatabaseWriter
+    :param stats: Статистика конвейера
+    :type stats: PipelineStats
+    :return: Ничего не возвращает
+    :rtype: None
     """
-    Функция распознавания лица
 
-    :param frame: Кадр полученный с камеры
-    :type frame: numpy.ndarray
-    :return: Возвращает найдено лицо в указанно области или нет
-    :rtype: bool
+    if track.session_start is not None and track.snapshots:
+        writer.add_session(
+            camera_id=camera_id,
+            started_at=db_timestamp(track.session_start),
+            ended_at=db_timestamp(track.last_seen),
+            duration=round(track.last_seen - track.session_start, 3),
+            snapshots=track.snapshots,
+        )
+        stats.inc("sessions")
+    track.session_start = None
+    track.last_seen = None
+    track.snapshots = 0
+
+
+def stats_event(camera_id: str, stats: PipelineStats, local: bool) -> dict:
+    """
+    Функция формирования события со статистикой камеры
+
+    :param camera_id: Идентификатор камеры
+    :type camera_id: str
+    :param stats: Статистика конвейера камеры
+    :type stats: PipelineStats
+    :param local: Распознавание в процессе камеры, тогда добавляется статистика движка распознавания
+    :type local: bool
+    :return: Событие для брокера
+    :rtype: dict
     """
 
-    # Верхняя левая точка начала области распознавания
-    x, y, = camera_region_detect["x"], camera_region_detect["y"]
-    # Область распознавания
-    w, h = camera_region_detect["width"], camera_region_detect["height"]
-    # Преобразуем фото в формат для распознавания
-    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame)
-    # Пытаемся найти лицо/лица на фото
-    result = detector.detect(mp_image)
-
-    # Если лицо обнаружено
-    if result.detections:
-        # Лиц может быть несколько, проверяем все
-        for detection in result.detections:
-            # Область в которой распознано лицо
-            bbox = detection.bounding_box
-            # Преобразуем область в нужные значения
-            bbox = int(bbox.origin_x + bbox.width), int(bbox.origin_y + bbox.height)
-            # Если лицо в нужной нам области, прерываем цикл
-            if (x < bbox[0] < x + w) and (y < bbox[1] < y + h):
-                break
-        else:
-            # Если цикл успешно завершён, значит лиц в заданной области не обнаружено
-            return False
-        # Если лицо найдено
-        return True
-    # Если на кадре не найдено лиц
-    return False
-
-
-def camera_process(stop_event: Event) -> None:
+    data = {"type": "stats", "camera_id": camera_id, **stats.snapshot()}
+    if local:
+        data["engine"] = get_engine().snapshot()
+
+    return data
+
+
+def camera_process(
+        camera_id: str,
+        stop_event: Event,
+        event_queue: Queue,
+        task_queue: Queue | None = None,
+        result_queue: Queue | None = None,
+        camera_settings: dict | None = None,
+        profile_event: Event | None = None,
+        heartbeat=None,
+        tuning: SettingsBlock | None = None,
+        preview: PreviewBlock | None = None,
+) -> None:
     """
-    Функция запущенная в процессе, получает изображение с камеры, и отправляет его на распознавание лица
+    Функция запущенная в процессе, получает изображение с камеры, и отправляет его на распознавание лица.
 
+    Работает как конвейер из трёх стадий:
+    захват (отдельный поток пишет кадры в кольцевой буфер),
+    распознавание (этот поток, всегда берёт самый новый кадр),
+    сохранение (пул потоков с ограниченной очередью).
+    Если передана очередь задач, распознавание выполняет общий пул воркеров, кадр передаётся через общую память.
+
+    :param camera_id: Идентификатор камеры из настроек
+    :type camera_id: str
     :param stop_event: Тригер для прекращения бесконечного цикла
     :type stop_event: Event
+    :param event_queue: Очередь для публикации событий о новых фото и статистики
+    :type event_queue: multiprocessing.Queue
+    :param task_queue: Очередь задач пула распознавания, None - распознавать в этом процессе
+    :type task_queue: multiprocessing.Queue | None
+    :param result_queue: Очередь результатов распознавания этой камеры
+    :type result_queue: multiprocessing.Queue | None
+    :param camera_settings: Источник и области камеры, None - взять из settings.json
+    :type camera_settings: dict | None
+    :param profile_event: Тригер включения профайлера, None - профайлер не используется
+    :type profile_event: Event | None
+    :param heartbeat: Общая с супервизором переменная (multiprocessing.Value), в неё пишется время последнего кадра,
+        None - пульс не отправляется
+    :param tuning: Общий с API блок настроек (области, время в области, частота, порог уверенности),
+        изменения применяются между кадрами. None - настройки из settings.json без изменения на ходу
+    :type tuning: SettingsBlock | None
+    :param preview: Общий с API блок последнего размеченного кадра для /stream, None - /stream отключён
+    :type preview: PreviewBlock | None
     :return: Ничего не возвращает
     :rtype: None
     """
 
-    # Время начала распознавания
-    detection_start_time: float = time.time()
-    # Флаг для обозначения удалось распознать лицо или нет
-    fase_detected: bool = False
-
-    while not stop_event.is_set():
-        # Получаем изображение с камеры
-        success, frame = camera.read()
-        # Если не удалось получить изображение, завершаем цикл
-        if not success:
-            break
-
-        # Если лицо распознано
-        if fase_detect(frame):
-            # Если лицо не было распознано ранее
-            if not fase_detected:
-                # Обновляем время начала обнаружения
-                detection_start_time: float = time.time()
-                # Переводим флаг
-                fase_detected: bool = True
-            # Если лицо было распознано ранее
-            else:
-                # Если флаг активен более 5 секунд
-                if time.time() - detection_start_time >= 5:
-                    detection_start_time = time.time()
-                    # Обновляем время начала обнаружения
-                    image_name = datetime.now().strftime("%Y%m%d_%H%M%S.jpg")
-                    # Сохраняем фото в папку
-                    cv2.imwrite(f"{file_path}/{image_name}", frame)
-                    # получаем коннект к БД
-                    connect = get_connection()
-                    # Сохраняем фото в БД
-                    save_image_to_db(conn=connect, filename=image_name)
-        else:
-            # Если не удалось распознать лицо, переводим флаг
-            fase_detected = False
-
-        # Интервал между распознаванием лиц в кадре
-        # Так как это отдельный процесс, можно использовать обычный time sleep
-        time.sleep(0.1)
-
-
-async def image_event_generator() -> dict:
-    """
-    Корутина - генератор для отправки события после добавления фото
+    def beat() -> None:
+        # Пульс для супервизора: процесс жив и получает кадры
+        if heartbeat is not None:
+            heartbeat.value = time.time()
 
-    :return: Словарь с данными
-    :rtype: dict
+    try:
+        _camera_process(camera_id, stop_event, event_queue, task_queue, result_queue, camera_settings,
+                        profile_event, beat, tuning, preview)
+    except Exception as error:
+        # Трейсбек выводит multiprocessing, API получает описание ошибки
+        report_error(event_queue, camera_id, f"{type(error).__name__}: {error}")
+        raise
+
+
+def report_error(event_queue: Queue, camera_id: str, message: str) -> None:
+    """
+    Функция публикации ошибки камеры, API показывает последнюю ошибку в /status
+
+    :param event_queue: Очередь событий
+    :type event_queue: multiprocessing.Queue
+    :param camera_id: Идентификатор камеры
+    :type camera_id: str
+    :param message: Описание ошибки
+    :type message: str
+    :return: Ничего не возвращает
+    :rtype: None
     """
 
-    # Получаем последнее фото из БД
-    current_image = get_latest_image_from_db(conn=get_connection())
-
-    while True:
-        # Получаем последнее фото из БД
-        new_image = get_latest_image_from_db(conn=get_connection())
-
-        # Если новое фото отличается от текущего
-        if new_image != current_image:
-            # Обновляем текущее фото
-            current_image = new_image
-            # Данные для ивента
-            data = {
-                "event": "new_image",
-                "id": None,
-                "retry": 15000,
-                "data": f"images/{new_image['file_name']}",
-            }
-            # возвращаем ивент
-            yield data
-
-        # Используем асинхронный sleep, что бы не блокировать исполнение кода
-        await asyncio.sleep(1)
+    event_queue.put(
+        {
+            "type": "error",
+            "camera_id": camera_id,
+            "message": message,
+            "time": datetime.now().isoformat(timespec="seconds"),
+        }
+    )
+
+
+def _camera_process(
+        camera_id: str,
+        stop_event: Event,
+        event_queue: Queue,
+        task_queue: Queue | None,
+        result_queue: Queue | None,
+        camera_settings: dict | None,
+        profile_event: Event | None,
+        beat: Callable[[], None],
+        tuning: SettingsBlock | None,
+        preview: PreviewBlock | None,
+) -> None:
+    # Воркер API, который запустил камеру
+    parent_pid = os.getppid()
+    # Настройки этой камеры
+    if camera_settings is None:
+        camera_settings = load_cameras(settings)[camera_id]
+    # Настройки, которые меняются на ходу через PUT /settings
+    if tuning is None:
+        tuning = SettingsBlock(camera_tuning(settings, camera_settings))
+    version, live = tuning.read()
+
+    # Распознавание в пуле воркеров или в этом процессе
+    if task_queue is not None:
+        remote = RemoteDetector(
+            camera_id=camera_id,
+            regions=live["regions"],
+            score_threshold=live["score_threshold"],
+            task_queue=task_queue,
+            result_queue=result_queue,
+        )
+        detect = remote.detect
+    else:
+        remote = None
+        detect = lambda image: detect_boxes(image, regions=live["regions"], score_threshold=live["score_threshold"])
+        # Модель загружается и прогревается до открытия камеры, кадры не копятся, пока она грузится
+        get_engine()
+    beat()
+
+    # Открываем видеокамеру: номер USB камеры, ссылка на поток, видео файл или папка с кадрами
+    camera = open_source(camera_settings)
+    if not camera.isOpened():
+        camera.release()
+        if remote is not None:
+            remote.close()
+        report_error(event_queue, camera_id, f"failed to open source {camera_settings['source']}")
+        # Ненулевой код выхода - супервизор перезапустит процесс с задержкой
+        sys.exit(1)
+
+    # Загружаем настройки конвейера
+    pipeline_settings: dict = load_settings().get("pipeline", {})
+    # Интервал отправки статистики в секундах
+    stats_interval: float = pipeline_settings.get("stats_interval", 5)
+
+    stats = PipelineStats()
+    ring = FrameRingBuffer(size=pipeline_settings.get("ring_size", 4))
+    # Тригер остановки потоков, выставляется и при отключении камеры
+    capture_stop = threading.Event()
+    capture = CaptureThread(
+        camera=camera, ring=ring, stats=stats, stop_event=capture_stop
+    )
+    # Одно соединение с БД на процесс, записи вставляются пачками
+    database_settings: dict = settings.get("database", {})
+    writer = DatabaseWriter(
+        batch_size=database_settings.get("batch_size", 50),
+        flush_interval=database_settings.get("flush_interval", 0.5),
+        stats=stats,
+    )
+    # Почти одинаковые снимки долго стоящего человека не сохраняются повторно
+    dedup_settings: dict = settings.get("dedup", {})
+    dedup_policy: str = dedup_settings.get("policy", "merge")
+    if dedup_policy not in DEDUP_POLICIES:
+        raise ValueError(f"unknown dedup policy: {dedup_policy}")
+    index: HashIndex | None = None
+    if dedup_settings.get("enabled", False):
+        index = HashIndex(
+            threshold=dedup_settings.get("threshold", 8),
+            window=dedup_settings.get("window", 300),
+            size=dedup_settings.get("size", 256),
+        )
+    # Кодирование и запись фото в пуле потоков с ограниченной очередью
+    persistence_settings: dict = settings.get("persistence", {})
+
+    def saved(file_name: str, created_at: str, size: int, extra: dict) -> None:
+        on_image_saved(
+            file_name,
+            created_at,
+            size,
+            camera_id,
+            event_queue,
+            writer,
+            thumbnail=persistence_settings.get("thumbnail_width", 200) > 0,
+            phash=extra.get("phash"),
+        )
+        # Хэш добавляется только для записанного файла: похожий снимок не объединится с фото,
+        # которое вытеснили из очереди или не смогли записать
+        if index is not None and "phash" in extra:
+            index.add(int(extra["phash"], 16), file_name, extra["hashed_at"])
+
+    persistence = ImageWriter(
+        directory=file_path,
+        stats=stats,
+        on_saved=saved,
+        workers=persistence_settings.get("workers", 2),
+        queue_size=persistence_settings.get("queue_size", 8),
+        policy=persistence_settings.get("policy", "drop_oldest"),
+        image_format=persistence_settings.get("format", "jpeg"),
+        quality=persistence_settings.get("quality", 90),
+        thumbnail_width=persistence_settings.get("thumbnail_width", 200),
+    )
+    # Размеченные кадры для /stream рисуются и кодируются, только пока их кто-то смотрит
+    preview_settings: dict = settings.get("preview", {})
+    preview_width: int = preview_settings.get("width", 640)
+    preview_params: List[int] = [cv2.IMWRITE_JPEG_QUALITY, preview_settings.get("quality", 70)]
+    # Профайлер включается во время работы через /profiler
+    profiler: ProfilerSwitch | None = None
+    if profile_event is not None:
+        profiler_settings: dict = settings.get("profiler", {})
+        profiler = ProfilerSwitch(
+            event=profile_event,
+            name=f"camera-{camera_id}",
+            directory=profiler_settings.get("directory", "profiles"),
+            interval=profiler_settings.get("interval", 0.01),
+        )
+        profiler.start()
+    capture.start()
+    writer.start()
+    persistence.start()
+
+    # Минимальный интервал между распознаваниями, 0 - распознавать каждый новый кадр
+    interval: float = 1 / live["detect_fps"] if live["detect_fps"] else 0
+    # Время следующей отправки статистики
+    next_report: float = time.monotonic() + stats_interval
+    # Событие started отправляется после первого распознавания, по нему видно, что камера готова
+    ready: bool = False
+
+    # Трекер лиц: детектор только на ключевых кадрах, между ними оптический поток.
+    # Без трекинга детектор работает на каждом кадре, трекер только сопоставляет лица между кадрами
+    tracking_settings: dict = settings.get("tracking", {})
+    tracker = FaceTracker(
+        keyframe_interval=(
+            tracking_settings.get("keyframe_interval", 5) if tracking_settings.get("enabled", True) else 1
+        ),
+        max_missed=tracking_settings.get("max_missed", 3),
+        iou_threshold=tracking_settings.get("iou_threshold", 0.3),
+    )
+
+    # Фильтр движения перед детектором, None - детектор работает без фильтра
+    motion_settings: dict = settings.get("motion", {})
+    motion: MotionGate | None = None
+    if motion_settings.get("enabled", False):
+        motion = MotionGate(
+            regions=live["regions"],
+            width=motion_settings.get("width", 160),
+            pixel_threshold=motion_settings.get("pixel_threshold", 25),
+            min_area=motion_settings.get("min_area", 0.005),
+            alpha=motion_settings.get("alpha", 0.1),
+        )
+
+    try:
+        # Если камера отключилась, поток захвата выставит capture_stop и цикл завершится
+        while not stop_event.is_set() and not capture_stop.is_set():
+            started = time.perf_counter()
+            # Берём самый новый кадр, пропущенные кадры учитываем в статистике
+            _, frame, dropped = ring.read_latest(timeout=0.5)
+            if frame is None:
+                continue
+            beat()
+            if dropped:
+                stats.inc("dropped", dropped)
+
+            # Настройки изменились через PUT /settings: между кадрами читается только номер версии
+            changed = tuning.poll(version)
+            if changed is not None:
+                version, live = changed
+                interval = 1 / live["detect_fps"] if live["detect_fps"] else 0
+                if remote is not None:
+                    remote.regions = live["regions"]
+                    remote.score_threshold = live["score_threshold"]
+                if motion is not None:
+                    motion.set_regions(live["regions"])
+                stats.inc("settings_reloads")
+
+            # Пока лиц нет, детектор запускается только если в областях что-то движется.
+            # Когда лица есть, фильтр не используется: человек может стоять неподвижно
+            moving = True
+            if motion is not None and not tracker.tracks:
+                moving = motion.check(frame)
+                stats.observe("motion", time.perf_counter() - started)
+                stats.set_gauge("motion_skip_ratio", round(motion.skip_ratio, 3))
+
+            if not moving:
+                # В областях пусто и тихо
+                tracks = []
+                stats.inc("motion_skipped")
+            elif tracker.needs_detection():
+                # Ключевой кадр - ищем лица детектором
+                detected = time.perf_counter()
+                bboxes = detect(frame)
+                stats.observe("inference", time.perf_counter() - detected)
+                tracked = time.perf_counter()
+                # Кадр в оттенках серого нужен только если есть что отслеживать
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if bboxes or tracker.tracks else None
+                tracks = tracker.update(gray=gray, detections=bboxes)
+                stats.observe("tracking", time.perf_counter() - tracked)
+                stats.inc("keyframes")
+                if not ready:
+                    ready = True
+                    # Статистика считается с первого распознавания: подключение к камере и первый вызов
+                    # детектора (или ожидание загрузки пула) не попадают в частоту кадров и перцентили
+                    stats.reset()
+                    event_queue.put({"type": "started", "camera_id": camera_id})
+            else:
+                # Между ключевыми кадрами сдвигаем рамки по оптическому потоку
+                tracked = time.perf_counter()
+                tracks = tracker.predict(gray=cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+                stats.observe("tracking", time.perf_counter() - tracked)
+            stats.inc("processed")
+
+            now = time.time()
+            for track in tracks:
+                # Если лицо в одной из областей
+                if any(in_region(bbox=track.bbox, region=region) for region in live["regions"].values()):
+                    # Пропущенное детектором лицо не продлевает сеанс
+                    if not track.missed:
+                        track.last_seen = now
+                    # Если лицо не было в области ранее, запоминаем время начала и начинаем сеанс
+                    if track.dwell_start is None:
+                        track.dwell_start = track.session_start = now
+                    # Если лицо в области дольше dwell_time и видно на кадре (а не пропущено детектором)
+                    elif now - track.dwell_start >= live["dwell_time"] and not track.missed:
+                        # Обновляем время начала обнаружения
+                        track.dwell_start = now
+                        # Время снимка фиксируем один раз: и папка дня, и имя файла берутся из него в UTC,
+                        # иначе около полуночи имя и папка разойдутся на день
+                        moment = time.time()
+                        created_at = db_timestamp(moment)
+                        image_name = shard_name(
+                            created_at,
+                            datetime.fromtimestamp(moment, tz=timezone.utc).strftime(
+                                f"{camera_id}_%Y%m%d_%H%M%S_{track.track_id}"
+                            ),
+                        )
+                        extra = {}
+                        if index is not None:
+                            hashed = time.perf_counter()
+                            value = phash(frame, track.bbox)
+                            stats.observe("phash", time.perf_counter() - hashed)
+                            matched = index.find(value, now)
+                            if matched is not None:
+                                # Хэш запоминаем под именем найденного снимка, чтобы окно сдвигалось,
+                                # пока человек стоит в области
+                                index.add(value, matched, now)
+                                if dedup_policy == "merge":
+                                    # Снимок учтён в записи похожего снимка (duplicates), он входит в сеанс
+                                    writer.merge(matched, seen_at=created_at)
+                                    track.snapshots += 1
+                                    stats.inc("dedup_merged")
+                                else:
+                                    stats.inc("dedup_suppressed")
+                                continue
+                            # Хэш попадёт в индекс только после записи файла, см. on_saved
+                            extra.update(phash=f"{value:016x}", hashed_at=now)
+                        stats.inc("dwell_events")
+                        # Отправляем кадр на сохранение в пул потоков, отброшенный кадр не входит в сеанс
+                        if persistence.submit(frame=frame, name=image_name, created_at=created_at, extra=extra):
+                            track.snapshots += 1
+                else:
+                    # Лицо вышло из области, сеанс завершён
+                    track.dwell_start = None
+                    end_session(track, camera_id=camera_id, writer=writer, stats=stats)
+            # Трекер потерял лица - их сеансы тоже завершены
+            for track in tracker.pop_removed():
+                end_session(track, camera_id=camera_id, writer=writer, stats=stats)
+
+            # Кадр для /stream кодируется один раз, все зрители получают его из общей памяти
+            if preview is not None and preview.viewers > 0:
+                annotated = time.perf_counter()
+                image = annotate_frame(frame, regions=live["regions"], tracks=tracks, width=preview_width)
+                _, data = cv2.imencode(".jpg", image, preview_params)
+                if not preview.write(data.tobytes()):
+                    stats.inc("preview_dropped")
+                stats.observe("preview", time.perf_counter() - annotated)
+
+            # Периодически отправляем статистику конвейера
+            if time.monotonic() >= next_report:
+                next_report = time.monotonic() + stats_interval
+                event_queue.put(stats_event(camera_id=camera_id, stats=stats, local=remote is None))
+                # Владелец камер завершился, не остановив их - отпускаем камеру, её запустит новый владелец
+                if os.getppid() != parent_pid:
+                    break
+
+            # Время всей итерации без ожидания
+            elapsed = time.perf_counter() - started
+            stats.observe("loop", elapsed)
+            # Ограничиваем частоту распознавания, ожидание прерывается остановкой
+            remaining = interval - elapsed
+            if remaining > 0:
+                stop_event.wait(remaining)
+
+        # Цикл завершился без команды остановки - камера отключилась или видео закончилось
+        if not stop_event.is_set():
+            report_error(event_queue, camera_id, "camera disconnected")
+    finally:
+        capture_stop.set()
+        capture.join(timeout=1)
+        # Незавершённые сеансы записываем до остановки потока записи в БД
+        for track in [*tracker.tracks.values(), *tracker.pop_removed()]:
+            end_session(track, camera_id=camera_id, writer=writer, stats=stats)
+        # Дожидаемся сохранения кадров из очереди
+        persistence.close()
+        writer.close()
+        camera.release()
+        if remote is not None:
+            remote.close()
+        if profiler is not None:
+            profiler.stop()
+        event_queue.put(stats_event(camera_id=camera_id, stats=stats, local=remote is None))
+
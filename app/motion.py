@@ -0,0 +1,149 @@
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+from numpy import ndarray
+
+
+class MotionGate:
+    """
+    Дешёвый фильтр движения перед детектором лиц.
+
+    Работает на уменьшенной серой копии части кадра, которая покрывает все области распознавания.
+    Кадр сравнивается с фоном (скользящее среднее прошлых кадров), если изменилась заметная доля пикселей -
+    есть движение. Пока ничего не движется, детектор можно не запускать. Области обрезаются по кадру:
+    если ни одна не попадает в кадр (например, после смены разрешения), фильтр считает, что движение есть,
+    и детектор работает как без фильтра.
+    """
+
+    def __init__(
+            self,
+            regions: Dict[str, Dict[str, int]],
+            width: int = 160,
+            pixel_threshold: int = 25,
+            min_area: float = 0.005,
+            alpha: float = 0.1,
+    ) -> None:
+        """
+        :param regions: Области распознавания камеры
+        :type regions: Dict[str, Dict[str, int]]
+        :param width: Ширина уменьшенной копии в пикселях
+        :type width: int
+        :param pixel_threshold: Минимальное изменение яркости пикселя, чтобы считать его изменившимся
+        :type pixel_threshold: int
+        :param min_area: Минимальная доля изменившихся пикселей, чтобы считать, что есть движение
+        :type min_area: float
+        :param alpha: Скорость обновления фона, 1 - сравнение только с предыдущим кадром
+        :type alpha: float
+        """
+
+        self.width: int = width
+        self.pixel_threshold: int = pixel_threshold
+        self.min_area: float = min_area
+        self.alpha: float = alpha
+        self._background: ndarray | None = None
+        # Области в виде (x0, y0, x1, y1) и прямоугольник, покрывающий их части внутри кадра, по размеру кадра
+        self._regions: List[Tuple[int, int, int, int]] = []
+        self._bounds: Tuple[Tuple[int, int], Tuple[int, int, int, int] | None] | None = None
+        self.set_regions(regions)
+        # Сколько кадров проверено и сколько из них без движения
+        self.checked: int = 0
+        self.skipped: int = 0
+
+    @property
+    def skip_ratio(self) -> float:
+        """
+        Доля кадров, на которых детектор не запускался
+
+        :return: Значение от 0 до 1
+        :rtype: float
+        """
+
+        return self.skipped / self.checked if self.checked else 0.0
+
+    def set_regions(self, regions: Dict[str, Dict[str, int]]) -> None:
+        """
+        Метод замены областей распознавания, фон накапливается заново
+
+        :param regions: Области распознавания камеры
+        :type regions: Dict[str, Dict[str, int]]
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self._regions = [
+            (region["x"], region["y"], region["x"] + region["width"], region["y"] + region["height"])
+            for region in regions.values()
+        ]
+        self._bounds = None
+        self._background = None
+
+    def check(self, frame: ndarray) -> bool:
+        """
+        Метод проверки, есть ли движение в областях распознавания
+
+        :param frame: Кадр
+        :type frame: ndarray
+        :return: Есть ли движение (нужно ли запускать детектор)
+        :rtype: bool
+        """
+
+        self.checked += 1
+        small = self._prepare(frame)
+        # Областей в кадре нет - не рискуем пропустить лицо
+        if small is None:
+            return True
+
+        # Первый кадр - фона ещё нет
+        if self._background is None or self._background.shape != small.shape:
+            self._background = small.astype(np.float32)
+            return True
+
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self._background))
+        changed = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+        cv2.accumulateWeighted(small, self._background, self.alpha)
+
+        if changed >= self.min_area:
+            return True
+
+        self.skipped += 1
+        return False
+
+    def _clip(self, height: int, width: int) -> Tuple[int, int, int, int] | None:
+        # Прямоугольник считается заново только при смене размера кадра или областей
+        if self._bounds is None or self._bounds[0] != (height, width):
+            clipped = [
+                (max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)) for x0, y0, x1, y1 in self._regions
+            ]
+            clipped = [(x0, y0, x1, y1) for x0, y0, x1, y1 in clipped if x1 > x0 and y1 > y0]
+            box = None
+            if clipped:
+                box = (
+                    min(x0 for x0, _, _, _ in clipped),
+                    min(y0 for _, y0, _, _ in clipped),
+                    max(x1 for _, _, x1, _ in clipped),
+                    max(y1 for _, _, _, y1 in clipped),
+                )
+            self._bounds = ((height, width), box)
+            # Кадр другого размера с прошлым фоном не сравнивается
+            self._background = None
+
+        return self._bounds[1]
+
+    def _prepare(self, frame: ndarray) -> ndarray | None:
+        box = self._clip(*frame.shape[:2])
+        if box is None:
+            return None
+        x0, y0, x1, y1 = box
+        # Срез без копирования, копируется уже уменьшенное изображение
+        view = frame[y0:y1, x0:x1]
+        scale = min(self.width / view.shape[1], 1)
+        small = cv2.resize(
+            view,
+            (max(int(view.shape[1] * scale), 1), max(int(view.shape[0] * scale), 1)),
+            interpolation=cv2.INTER_AREA,
+        )
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        # Размытие убирает шум матрицы камеры
+        return cv2.GaussianBlur(gray, (5, 5), 0)
@@ -0,0 +1,234 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Tuple
+
+import cv2
+from numpy import ndarray
+
+from pipeline import PipelineStats
+
+logger = logging.getLogger(__name__)
+
+# Расширения и параметры качества для поддерживаемых форматов
+IMAGE_FORMATS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+# Политики при переполнении очереди
+POLICIES = ("drop_newest", "drop_oldest", "block")
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """
+    Функция атомарной записи файла: сначала во временный файл рядом, затем переименование.
+    Читатель никогда не увидит недописанный файл
+
+    :param path: Путь к файлу
+    :type path: str
+    :param data: Содержимое файла
+    :type data: bytes
+    :return: Ничего не возвращает
+    :rtype: None
+    """
+
+    # Папка дня создаётся первым фото за этот день
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+class ImageWriter:
+    """
+    Сохранение кадров с отложенной записью.
+
+    Кадры попадают в очередь ограниченного размера, пул потоков кодирует их (cv2 отпускает GIL),
+    создаёт миниатюру и атомарно записывает оба файла. Распознавание не ждёт диск,
+    при переполнении очереди срабатывает политика: drop_newest - отбросить новый кадр,
+    drop_oldest - вытеснить самый старый кадр из очереди, block - ждать место не дольше block_timeout.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            stats: PipelineStats,
+            on_saved: Callable[[str, str, int, dict], None],
+            workers: int = 2,
+            queue_size: int = 8,
+            policy: str = "drop_oldest",
+            block_timeout: float = 1,
+            image_format: str = "jpeg",
+            quality: int = 90,
+            thumbnail_width: int = 200,
+    ) -> None:
+        """
+        :param directory: Папка для фото, миниатюры сохраняются в её подпапку thumbs
+        :type directory: str
+        :param stats: Статистика конвейера
+        :type stats: PipelineStats
+        :param on_saved: Функция, вызываемая после записи файлов, принимает имя файла, время снимка,
+            размер фото с миниатюрой в байтах и дополнительные данные из submit
+        :type on_saved: Callable[[str, str, int, dict], None]
+        :param workers: Количество потоков кодирования и записи
+        :type workers: int
+        :param queue_size: Максимальное количество кадров в очереди
+        :type queue_size: int
+        :param policy: Политика при переполнении очереди
+        :type policy: str
+        :param block_timeout: Максимальное время ожидания места в очереди для политики block
+        :type block_timeout: float
+        :param image_format: Формат файлов: jpeg или webp
+        :type image_format: str
+        :param quality: Качество сжатия от 0 до 100
+        :type quality: int
+        :param thumbnail_width: Ширина миниатюры в пикселях, 0 - не создавать миниатюры
+        :type thumbnail_width: int
+        """
+
+        if policy not in POLICIES:
+            raise ValueError(f"unknown persistence policy: {policy}")
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"unknown image format: {image_format}")
+
+        self.directory: str = directory
+        self.stats: PipelineStats = stats
+        self.on_saved: Callable[[str, str, int, dict], None] = on_saved
+        self.policy: str = policy
+        self.block_timeout: float = block_timeout
+        self.extension, quality_flag = IMAGE_FORMATS[image_format]
+        self.params: List[int] = [quality_flag, quality]
+        self.thumbnail_width: int = thumbnail_width
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.workers: List[threading.Thread] = [
+            threading.Thread(target=self._run, name=f"image-writer-{index}", daemon=True)
+            for index in range(workers)
+        ]
+
+    def start(self) -> None:
+        """
+        Метод запуска потоков записи
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, frame: ndarray, name: str, created_at: str, extra: dict | None = None) -> bool:
+        """
+        Метод постановки кадра в очередь на сохранение, кадр копируется,
+        так как слот буфера будет перезаписан
+
+        :param frame: Кадр
+        :type frame: ndarray
+        :param name: Имя файла без расширения относительно папки с фото, может включать папку дня
+        :type name: str
+        :param created_at: Время снимка
+        :type created_at: str
+        :param extra: Дополнительные данные снимка, передаются в on_saved без изменений
+        :type extra: dict | None
+        :return: Поставлен ли кадр в очередь
+        :rtype: bool
+        """
+
+        item = (frame.copy(), name, created_at, extra or {})
+
+        try:
+            if self.policy == "block":
+                self.queue.put(item, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(item)
+        except queue.Full:
+            if self.policy != "drop_oldest":
+                self.stats.inc("persist_dropped")
+                return False
+            # Вытесняем самый старый кадр, новый важнее
+            try:
+                self.queue.get_nowait()
+                self.stats.inc("persist_dropped")
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.stats.inc("persist_dropped")
+                return False
+        finally:
+            self.stats.set_gauge("persist_queue", self.queue.qsize())
+
+        return True
+
+    def close(self) -> None:
+        """
+        Метод остановки потоков, дожидается сохранения кадров из очереди
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def encode(self, frame: ndarray) -> Tuple[bytes, bytes | None]:
+        """
+        Метод кодирования кадра и его миниатюры
+
+        :param frame: Кадр
+        :type frame: ndarray
+        :return: Закодированный кадр и миниатюра (None, если миниатюры отключены)
+        :rtype: Tuple[bytes, bytes | None]
+        """
+
+        _, image = cv2.imencode(self.extension, frame, self.params)
+        thumbnail = None
+
+        if self.thumbnail_width:
+            height, width = frame.shape[:2]
+            # Миниатюра не больше исходного кадра
+            thumbnail_width = min(self.thumbnail_width, width)
+            small = cv2.resize(
+                frame,
+                (thumbnail_width, max(round(height * thumbnail_width / width), 1)),
+                interpolation=cv2.INTER_AREA,
+            )
+            _, thumbnail = cv2.imencode(self.extension, small, self.params)
+            thumbnail = thumbnail.tobytes()
+
+        return image.tobytes(), thumbnail
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.stats.set_gauge("persist_queue", self.queue.qsize())
+            frame, name, created_at, extra = item
+            file_name = name + self.extension
+
+            try:
+                start = time.perf_counter()
+                image, thumbnail = self.encode(frame)
+                encoded = time.perf_counter()
+                self.stats.observe("encode", encoded - start)
+
+                # Миниатюру пишем первой: когда появится фото, миниатюра уже есть
+                if thumbnail is not None:
+                    write_atomic(os.path.join(self.directory, "thumbs", file_name), thumbnail)
+                write_atomic(os.path.join(self.directory, file_name), image)
+                self.stats.observe("write", time.perf_counter() - encoded)
+
+                self.on_saved(file_name, created_at, len(image) + len(thumbnail or b""), extra)
+            except Exception:
+                # Ошибка сохранения не должна останавливать поток
+                logger.exception("failed to save image %s", file_name)
+                self.stats.inc("persist_errors")
+                continue
+
+            self.stats.inc("saved")
@@ -0,0 +1,338 @@
+import bisect
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+# Границы корзин гистограмм времени стадий в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+try:
+    import resource
+except ImportError:
+    # На Windows модуля нет, пиковая память процесса не считается
+    resource = None
+
+
+def process_usage() -> Dict[str, float | None]:
+    """
+    Функция получения ресурсов текущего процесса
+
+    :return: Процессорное время в секундах и пиковая память в мегабайтах (None, если недоступно)
+    :rtype: Dict[str, float | None]
+    """
+
+    max_rss_mb = None
+    if resource is not None:
+        # В Linux ru_maxrss в килобайтах
+        max_rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    return {"cpu_s": round(time.process_time(), 3), "max_rss_mb": max_rss_mb}
+
+
+class PipelineStats:
+    """
+    Статистика конвейера камеры: время работы каждой стадии и счётчики кадров.
+    Заполняется из нескольких потоков, поэтому все изменения под блокировкой.
+    """
+
+    def __init__(self, samples: int = 1000) -> None:
+        """
+        :param samples: Сколько последних замеров хранить для расчёта перцентилей
+        :type samples: int
+        """
+
+        self._lock = threading.Lock()
+        self._samples_size: int = samples
+        # Последние замеры времени по стадиям, в секундах
+        self.timings: Dict[str, Deque[float]] = {}
+        # Гистограммы стадий за всё время: количество замеров в каждой корзине (последняя - больше 5 секунд),
+        # сумма и количество замеров
+        self.histograms: Dict[str, dict] = {}
+        # Счётчики кадров
+        self.counters: Dict[str, int] = {}
+        # Текущие значения, например глубина очередей
+        self.gauges: Dict[str, float] = {}
+        # Время запуска, нужно для расчёта частоты кадров
+        self.started_at: float = time.monotonic()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """
+        Метод записи времени выполнения стадии
+
+        :param stage: Название стадии
+        :type stage: str
+        :param seconds: Время выполнения в секундах
+        :type seconds: float
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        with self._lock:
+            samples = self.timings.get(stage)
+            if samples is None:
+                samples = self.timings[stage] = deque(maxlen=self._samples_size)
+                self.histograms[stage] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0, "count": 0}
+            samples.append(seconds)
+            histogram = self.histograms[stage]
+            histogram["buckets"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def inc(self, counter: str, value: int = 1) -> None:
+        """
+        Метод увеличения счётчика
+
+        :param counter: Название счётчика
+        :type counter: str
+        :param value: На сколько увеличить
+        :type value: int
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def set_gauge(self, gauge: str, value: float) -> None:
+        """
+        Метод записи текущего значения
+
+        :param gauge: Название значения
+        :type gauge: str
+        :param value: Значение
+        :type value: float
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        with self._lock:
+            self.gauges[gauge] = value
+
+    def reset(self) -> None:
+        """
+        Метод сброса замеров и счётчиков, частота кадров считается заново с этого момента.
+        Текущие значения (gauges) не сбрасываются
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        with self._lock:
+            self.timings.clear()
+            self.histograms.clear()
+            self.counters.clear()
+            self.started_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Метод получения текущей статистики
+
+        :return: Словарь со счётчиками, частотой кадров, временем стадий в миллисекундах и гистограммами стадий
+        :rtype: Dict[str, Any]
+        """
+
+        with self._lock:
+            uptime = time.monotonic() - self.started_at
+            stages = {}
+            for stage, samples in self.timings.items():
+                if not samples:
+                    continue
+                ordered = sorted(samples)
+                last = len(ordered) - 1
+                stages[stage] = {
+                    "avg_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+                    **{
+                        f"p{percent}_ms": round(ordered[min(len(ordered) * percent // 100, last)] * 1000, 3)
+                        for percent in (50, 95, 99)
+                    },
+                    "max_ms": round(ordered[-1] * 1000, 3),
+                }
+
+            return {
+                "uptime": round(uptime, 3),
+                "process": process_usage(),
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "fps": {
+                    name: round(value / uptime, 3) if uptime else 0.0
+                    for name, value in self.counters.items()
+                    if name in ("captured", "processed")
+                },
+                "stages": stages,
+                "histograms": {
+                    stage: {**histogram, "buckets": list(histogram["buckets"])}
+                    for stage, histogram in self.histograms.items()
+                },
+            }
+
+
+class FrameRingBuffer:
+    """
+    Кольцевой буфер кадров фиксированного размера.
+
+    Память под кадры выделяется один раз, камера читает кадр сразу в свободный слот.
+    Побеждает самый новый кадр: читатель всегда получает последний записанный кадр,
+    а кадры, которые он не успел забрать, считаются пропущенными.
+    """
+
+    def __init__(self, size: int = 4) -> None:
+        """
+        :param size: Количество слотов, минимум 3 (последний, читаемый и записываемый)
+        :type size: int
+        """
+
+        self.size: int = max(size, 3)
+        self.frames: ndarray | None = None
+        self._condition = threading.Condition()
+        # Номер последнего записанного кадра и его слот
+        self._seq: int = 0
+        self._latest: int = -1
+        # Слот, который сейчас обрабатывает читатель
+        self._reading: int = -1
+        # Номер последнего прочитанного кадра
+        self._read_seq: int = 0
+        self._closed: bool = False
+
+    def allocate(self, shape: Tuple[int, ...], dtype=np.uint8) -> None:
+        """
+        Метод выделения памяти под кадры
+
+        :param shape: Размер кадра
+        :type shape: Tuple[int, ...]
+        :param dtype: Тип данных кадра
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self.frames = np.empty((self.size, *shape), dtype=dtype)
+
+    def acquire_write(self) -> int:
+        """
+        Метод получения слота для записи: не последний кадр и не тот, что сейчас читается
+
+        :return: Номер слота
+        :rtype: int
+        """
+
+        with self._condition:
+            for offset in range(1, self.size + 1):
+                slot = (self._latest + offset) % self.size
+                if slot not in (self._latest, self._reading):
+                    return slot
+
+        # При size >= 3 сюда попасть нельзя
+        raise RuntimeError("no free slot in ring buffer")
+
+    def commit_write(self, slot: int) -> None:
+        """
+        Метод публикации записанного кадра
+
+        :param slot: Номер слота, в который записан кадр
+        :type slot: int
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        with self._condition:
+            self._latest = slot
+            self._seq += 1
+            self._condition.notify_all()
+
+    def read_latest(self, timeout: float | None = None) -> Tuple[int, ndarray | None, int]:
+        """
+        Метод получения последнего кадра, ждёт новый кадр, если последний уже прочитан.
+        Слот остаётся за читателем до следующего вызова.
+
+        :param timeout: Максимальное время ожидания в секундах
+        :type timeout: float | None
+        :return: Номер кадра, кадр (None если кадра нет) и количество пропущенных кадров
+        :rtype: Tuple[int, ndarray | None, int]
+        """
+
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._seq > self._read_seq or self._closed, timeout=timeout
+            )
+            if self._seq <= self._read_seq:
+                return self._read_seq, None, 0
+
+            dropped = self._seq - self._read_seq - 1
+            self._read_seq = self._seq
+            self._reading = self._latest
+
+            return self._seq, self.frames[self._reading], dropped
+
+    def close(self) -> None:
+        """
+        Метод закрытия буфера, будит ожидающих читателей
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class CaptureThread(threading.Thread):
+    """
+    Поток захвата: читает кадры с камеры с её родной частотой в кольцевой буфер
+    """
+
+    def __init__(
+            self,
+            camera,
+            ring: FrameRingBuffer,
+            stats: PipelineStats,
+            stop_event: threading.Event,
+    ) -> None:
+        """
+        :param camera: Источник кадров с методом read(image)
+        :param ring: Кольцевой буфер кадров
+        :type ring: FrameRingBuffer
+        :param stats: Статистика конвейера
+        :type stats: PipelineStats
+        :param stop_event: Тригер остановки
+        :type stop_event: threading.Event
+        """
+
+        super().__init__(name="capture", daemon=True)
+        self.camera = camera
+        self.ring: FrameRingBuffer = ring
+        self.stats: PipelineStats = stats
+        self.stop_event: threading.Event = stop_event
+
+    def run(self) -> None:
+        try:
+            self._run()
+        finally:
+            # Камера отключилась или пришла остановка - будим читателя
+            self.stop_event.set()
+            self.ring.close()
+
+    def _run(self) -> None:
+        # Первый кадр читаем, чтобы узнать размер и выделить память под буфер
+        success, frame = self.camera.read()
+        if not success:
+            return
+        self.ring.allocate(shape=frame.shape, dtype=frame.dtype)
+        slot = self.ring.acquire_write()
+        self.ring.frames[slot][...] = frame
+        self.ring.commit_write(slot)
+        self.stats.inc("captured")
+
+        while not self.stop_event.is_set():
+            slot = self.ring.acquire_write()
+            start = time.perf_counter()
+            # Читаем кадр сразу в заранее выделенный слот, без новых выделений памяти
+            success, _ = self.camera.read(self.ring.frames[slot])
+            if not success:
+                break
+            self.stats.observe("capture", time.perf_counter() - start)
+            self.ring.commit_write(slot)
+            self.stats.inc("captured")
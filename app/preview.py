@@ -0,0 +1,163 @@
+import asyncio
+import ctypes
+from multiprocessing.sharedctypes import RawArray, RawValue
+from typing import AsyncIterator, Dict, Tuple
+
+from config import load_cameras
+
+# Разделитель частей multipart/x-mixed-replace
+BOUNDARY = "frame"
+
+
+class PreviewBlock:
+    """
+    Последний размеченный кадр камеры в JPEG для /stream в общей памяти.
+
+    Один писатель (процесс камеры) и сколько угодно читателей: каждый зритель сам сравнивает номер версии
+    с последним отданным кадром и берёт только самый новый кадр, поэтому медленный зритель пропускает кадры,
+    а не копит их. Запись устроена как seqlock, так же как в SettingsBlock. Блок создаётся до запуска
+    процесса камеры и достаётся ему при fork. Количество зрителей тоже в общей памяти:
+    пока оно 0, процесс камеры не рисует и не кодирует кадры.
+    """
+
+    def __init__(self, size: int = 2 * 1024 * 1024) -> None:
+        """
+        :param size: Максимальный размер кадра в JPEG в байтах
+        :type size: int
+        """
+
+        self._version = RawValue(ctypes.c_uint64, 0)
+        self._length = RawValue(ctypes.c_uint32, 0)
+        self._data = RawArray(ctypes.c_char, size)
+        self._viewers = RawValue(ctypes.c_int32, 0)
+
+    @property
+    def viewers(self) -> int:
+        """
+        Количество зрителей, меняется только в цикле событий владельца камер
+        """
+
+        return self._viewers.value
+
+    def watch(self) -> None:
+        """
+        Метод регистрации зрителя
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self._viewers.value += 1
+
+    def unwatch(self) -> None:
+        """
+        Метод отписки зрителя
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self._viewers.value -= 1
+
+    def write(self, data: bytes) -> bool:
+        """
+        Метод записи нового кадра
+
+        :param data: Кадр в JPEG
+        :type data: bytes
+        :return: Записан ли кадр, False - кадр не помещается в блок
+        :rtype: bool
+        """
+
+        if len(data) > len(self._data):
+            return False
+
+        # Нечётная версия - читатель не возьмёт недописанный кадр
+        self._version.value += 1
+        ctypes.memmove(self._data, data, len(data))
+        self._length.value = len(data)
+        self._version.value += 1
+
+        return True
+
+    def poll(self, version: int) -> Tuple[int, bytes] | None:
+        """
+        Метод получения кадра новее уже отданного
+
+        :param version: Версия последнего отданного кадра (0 - ещё ничего не отдано)
+        :type version: int
+        :return: Версия и кадр, None - нового кадра нет или он сейчас записывается
+        :rtype: Tuple[int, bytes] | None
+        """
+
+        current = self._version.value
+        if current == version or current % 2:
+            return None
+
+        data = ctypes.string_at(ctypes.addressof(self._data), self._length.value)
+        # Запись началась, пока мы читали - возьмём кадр при следующей проверке
+        if self._version.value != current:
+            return None
+
+        return current, data
+
+
+def create_previews(settings: dict) -> Dict[str, PreviewBlock]:
+    """
+    Функция создания блоков кадров для /stream для всех камер из settings.json
+
+    :param settings: Настройки приложения
+    :type settings: dict
+    :return: Блоки кадров по идентификатору камеры, пустой словарь - /stream отключён
+    :rtype: Dict[str, PreviewBlock]
+    """
+
+    preview_settings: dict = settings.get("preview", {})
+    if not preview_settings.get("enabled", False):
+        return {}
+
+    size = int(preview_settings.get("buffer_kb", 2048) * 1024)
+
+    return {camera_id: PreviewBlock(size=size) for camera_id in load_cameras(settings)}
+
+
+async def preview_frames(block: PreviewBlock, fps: float) -> AsyncIterator[bytes]:
+    """
+    Корутина - генератор кадров одного зрителя: не чаще fps кадров в секунду, всегда самый новый кадр
+
+    :param block: Блок кадров камеры
+    :type block: PreviewBlock
+    :param fps: Максимальная частота кадров зрителя
+    :type fps: float
+    :return: Кадры в JPEG
+    :rtype: AsyncIterator[bytes]
+    """
+
+    block.watch()
+    try:
+        version = 0
+        while True:
+            loaded = block.poll(version)
+            if loaded is not None:
+                version, data = loaded
+                yield data
+            await asyncio.sleep(1 / fps)
+    finally:
+        block.unwatch()
+
+
+def mjpeg_part(data: bytes) -> bytes:
+    """
+    Функция упаковки кадра в часть ответа multipart/x-mixed-replace
+
+    :param data: Кадр в JPEG
+    :type data: bytes
+    :return: Часть ответа с заголовками
+    :rtype: bytes
+    """
+
+    return (
+        f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(data)}\r\n\r\n".encode()
+        + data
+        + b"\r\n"
+    )
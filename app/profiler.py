@@ -0,0 +1,132 @@
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from multiprocessing.synchronize import Event
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Семплирующий профайлер: раз в interval секунд снимает стеки всех потоков процесса
+    и считает, сколько раз встретился каждый стек.
+
+    Код приложения не инструментируется, нагрузка зависит только от частоты снимков.
+    Результат в формате collapsed stacks (поток;функция;функция количество), его понимают
+    flamegraph.pl и speedscope.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        """
+        :param interval: Интервал между снимками в секундах
+        :type interval: float
+        """
+
+        super().__init__(name="profiler", daemon=True)
+        self.interval: float = interval
+        self.samples: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                # Свой поток не учитываем
+                if ident == self.ident:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        """
+        Метод остановки профайлера
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self) -> str:
+        """
+        Метод получения результата в формате collapsed stacks
+
+        :return: Строки вида "стек количество", самые частые стеки первыми
+        :rtype: str
+        """
+
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class ProfilerSwitch(threading.Thread):
+    """
+    Включение профайлера во время работы. Следит за общим для всех процессов тригером:
+    когда он выставлен, профайлер работает, когда сброшен - результат записывается в файл
+    directory/<name>-<pid>.folded
+    """
+
+    def __init__(
+            self, event: Event, name: str, directory: str = "profiles", interval: float = 0.01
+    ) -> None:
+        """
+        :param event: Тригер включения профайлера, общий для всех процессов
+        :type event: Event
+        :param name: Название процесса для имени файла
+        :type name: str
+        :param directory: Папка для результатов
+        :type directory: str
+        :param interval: Интервал между снимками стеков в секундах
+        :type interval: float
+        """
+
+        super().__init__(name="profiler-switch", daemon=True)
+        self.event: Event = event
+        self.process_name: str = name
+        self.directory: str = directory
+        self.interval: float = interval
+        self._stop_event = threading.Event()
+        self._profiler: SamplingProfiler | None = None
+
+    def run(self) -> None:
+        while not self._stop_event.wait(0.5):
+            enabled = self.event.is_set()
+            if enabled and self._profiler is None:
+                self._profiler = SamplingProfiler(interval=self.interval)
+                self._profiler.start()
+            elif not enabled and self._profiler is not None:
+                self._dump()
+
+    def stop(self) -> None:
+        """
+        Метод остановки, если профайлер работает - результат записывается в файл
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self._stop_event.set()
+        self.join()
+        if self._profiler is not None:
+            self._dump()
+
+    def _dump(self) -> None:
+        profiler, self._profiler = self._profiler, None
+        profiler.stop()
+        path = os.path.join(self.directory, f"{self.process_name}-{os.getpid()}.folded")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(profiler.collapsed())
+        except OSError:
+            logger.exception("failed to write profile %s", path)
+            return
+        logger.info("profile written to %s", path)
@@ -0,0 +1,513 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+from multiprocessing.queues import Queue
+from multiprocessing.synchronize import Event
+from sqlite3 import Connection
+from typing import Dict, List, Set, Tuple
+
+from pipeline import PipelineStats
+from storage import database_path, db_timestamp, shard_name
+
+logger = logging.getLogger(__name__)
+
+# Папка миниатюр внутри папки с фото
+THUMBS = "thumbs"
+
+
+class RetentionJob:
+    """
+    Очистка папки с фото. Проход выполняет по порядку:
+
+    1. Сверку папки с БД: фото из старой общей папки переносятся в папки дней, удаляются файлы без записей
+       (старше orphan_grace секунд, чтобы не задеть фото, которое ещё не попало в БД), заполняется размер фото,
+       сохранённых до появления колонки size, удаляются пустые папки дней. Записи без файлов только считаются:
+       файл может быть на отключённом диске. Удаляются они только с delete_orphan_rows.
+    2. Удаление фото старше max_age_days.
+    3. Удаление самых старых фото, пока суммарный размер больше max_size_mb.
+    4. Архивацию: фото старше archive_after_days пережимаются в уменьшенную копию. Копия пишется в новый файл,
+       запись в БД переключается на него, и только после этого оригинал удаляется.
+
+    Запись удаляется из БД раньше файла: при сбое между ними остаётся файл без записи, его удалит
+    следующая сверка, а клиент не получит ссылку на удалённый файл.
+    """
+
+    def __init__(
+            self,
+            directory: str = "static/images",
+            max_age_days: float = 0,
+            max_size_mb: float = 0,
+            archive_after_days: float = 0,
+            archive_width: int = 640,
+            archive_quality: int = 70,
+            batch_size: int = 500,
+            orphan_grace: float = 3600,
+            delete_orphan_rows: bool = False,
+            stop_event: Event | None = None,
+            stats: PipelineStats | None = None,
+    ) -> None:
+        """
+        :param directory: Папка с фото, миниатюры лежат в её подпапке thumbs
+        :type directory: str
+        :param max_age_days: Сколько дней хранить фото, 0 - без ограничения
+        :type max_age_days: float
+        :param max_size_mb: Максимальный размер фото с миниатюрами в мегабайтах, 0 - без ограничения
+        :type max_size_mb: float
+        :param archive_after_days: Через сколько дней пережимать фото в уменьшенную копию, 0 - не пережимать
+        :type archive_after_days: float
+        :param archive_width: Максимальная ширина архивной копии в пикселях
+        :type archive_width: int
+        :param archive_quality: Качество сжатия архивной копии от 0 до 100
+        :type archive_quality: int
+        :param batch_size: Количество записей, обрабатываемых за одну транзакцию
+        :type batch_size: int
+        :param orphan_grace: Возраст в секундах, после которого файл без записи в БД удаляется,
+            а запись без файла считается потерявшей файл
+        :type orphan_grace: float
+        :param delete_orphan_rows: Удалять записи, файлов которых нет, иначе они только считаются (missing_files)
+        :type delete_orphan_rows: bool
+        :param stop_event: Тригер остановки, проверяется между пачками
+        :type stop_event: Event | None
+        :param stats: Статистика очистки: счётчики удалённых фото и время стадий
+        :type stats: PipelineStats | None
+        """
+
+        self.directory: str = directory
+        self.max_age_days: float = max_age_days
+        self.max_size: int = int(max_size_mb * 1024 * 1024)
+        self.archive_after_days: float = archive_after_days
+        self.archive_width: int = archive_width
+        self.archive_quality: int = archive_quality
+        self.batch_size: int = batch_size
+        self.orphan_grace: float = orphan_grace
+        self.delete_orphan_rows: bool = delete_orphan_rows
+        self.stop_event: Event | None = stop_event
+        self.stats: PipelineStats = stats or PipelineStats()
+
+    def run_once(self) -> Dict[str, int]:
+        """
+        Метод выполнения одного прохода очистки
+
+        :return: Счётчики очистки с запуска
+        :rtype: Dict[str, int]
+        """
+
+        conn = sqlite3.connect(database=database_path, timeout=10)
+        try:
+            for stage, step, enabled in (
+                    ("reconcile", self.reconcile, True),
+                    ("expire", self.expire, self.max_age_days > 0),
+                    ("quota", self.enforce_quota, self.max_size > 0),
+                    ("archive", self.archive, self.archive_after_days > 0),
+            ):
+                if not enabled or self._stopped():
+                    continue
+                start = time.perf_counter()
+                step(conn)
+                self.stats.observe(stage, time.perf_counter() - start)
+            row = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM humans").fetchone()
+            self.stats.set_gauge("images", row[0])
+            self.stats.set_gauge("images_bytes", row[1])
+        finally:
+            conn.close()
+
+        return self.stats.snapshot()["counters"]
+
+    def expire(self, conn: Connection) -> None:
+        """
+        Метод удаления фото старше max_age_days
+
+        :param conn: Соединение с БД
+        :type conn: Connection
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        cutoff = db_timestamp(time.time() - self.max_age_days * 86400)
+        while not self._stopped():
+            rows = conn.execute(
+                "SELECT id, filename FROM humans WHERE created_at < ? ORDER BY created_at, id LIMIT ?",
+                (cutoff, self.batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            self._delete(conn, rows)
+            self.stats.inc("expired", len(rows))
+
+    def enforce_quota(self, conn: Connection) -> None:
+        """
+        Метод удаления самых старых фото, пока суммарный размер больше max_size_mb
+
+        :param conn: Соединение с БД
+        :type conn: Connection
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        total: int = conn.execute("SELECT COALESCE(SUM(size), 0) FROM humans").fetchone()[0]
+        while total > self.max_size and not self._stopped():
+            rows = conn.execute(
+                "SELECT id, filename, size FROM humans ORDER BY created_at, id LIMIT ?", (self.batch_size,)
+            ).fetchall()
+            if not rows:
+                break
+            # Удаляем ровно столько, сколько нужно, чтобы уложиться в квоту
+            victims: List[Tuple[int, str]] = []
+            for row_id, filename, size in rows:
+                if total <= self.max_size:
+                    break
+                victims.append((row_id, filename))
+                total -= size or 0
+            self._delete(conn, victims)
+            self.stats.inc("evicted", len(victims))
+
+    def archive(self, conn: Connection) -> None:
+        """
+        Метод архивации фото старше archive_after_days: фото уменьшается до archive_width и пережимается
+        с качеством archive_quality в новый файл name.archived.ext, запись в БД переключается на него,
+        оригинал удаляется. Миниатюра не меняется и переходит к копии
+
+        :param conn: Соединение с БД
+        :type conn: Connection
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        # cv2 нужен только для архивации, процесс без неё его не загружает
+        import cv2
+        from persistence import IMAGE_FORMATS, write_atomic
+
+        # Параметры качества по расширению файла
+        quality_flags = {extension: flag for extension, flag in IMAGE_FORMATS.values()}
+        cutoff = db_timestamp(time.time() - self.archive_after_days * 86400)
+
+        while not self._stopped():
+            rows = conn.execute(
+                "SELECT id, filename FROM humans WHERE archived = 0 AND created_at < ? ORDER BY created_at, id LIMIT ?",
+                (cutoff, self.batch_size),
+            ).fetchall()
+            if not rows:
+                break
+
+            updates: List[Tuple[str | None, int | None, int]] = []
+            replaced: List[str] = []
+            for row_id, filename in rows:
+                path = os.path.join(self.directory, filename)
+                root, extension = os.path.splitext(filename)
+                extension = extension.lower()
+                image = cv2.imread(path)
+                # Файла нет или формат не поддерживается - отмечаем запись, чтобы не пробовать снова
+                if image is None or extension not in quality_flags:
+                    updates.append((None, None, row_id))
+                    continue
+
+                height, width = image.shape[:2]
+                if width > self.archive_width:
+                    image = cv2.resize(
+                        image,
+                        (self.archive_width, max(round(height * self.archive_width / width), 1)),
+                        interpolation=cv2.INTER_AREA,
+                    )
+                _, encoded = cv2.imencode(extension, image, [quality_flags[extension], self.archive_quality])
+                data = encoded.tobytes()
+                # Копия заменяет оригинал, только если она меньше
+                if len(data) >= os.path.getsize(path):
+                    updates.append((None, None, row_id))
+                    continue
+
+                # Оригинал не перезаписывается: копия пишется в новый файл рядом, у неё свой адрес в /images,
+                # поэтому закэшированный браузером оригинал не расходится с файлом
+                target = f"{root}.archived{extension}"
+                write_atomic(os.path.join(self.directory, target), data)
+                thumbnail = os.path.join(self.directory, THUMBS, filename)
+                if os.path.exists(thumbnail):
+                    target_thumbnail = os.path.join(self.directory, THUMBS, target)
+                    os.makedirs(os.path.dirname(target_thumbnail), exist_ok=True)
+                    # Ссылка могла остаться от прерванного прохода
+                    if os.path.exists(target_thumbnail):
+                        os.remove(target_thumbnail)
+                    os.link(thumbnail, target_thumbnail)
+                self.stats.inc("archive_freed_bytes", os.path.getsize(path) - len(data))
+                updates.append((target, self._size(target), row_id))
+                replaced.append(filename)
+                self.stats.inc("archived")
+
+            # Запись переключается на копию одной транзакцией, оригинал удаляется только после неё.
+            # При сбое до удаления оригинал останется файлом без записи, его удалит сверка
+            with conn:
+                conn.executemany(
+                    "UPDATE humans SET archived = 1, filename = COALESCE(?, filename), size = COALESCE(?, size) "
+                    "WHERE id = ?",
+                    updates,
+                )
+            for filename in replaced:
+                for path in (os.path.join(self.directory, filename), os.path.join(self.directory, THUMBS, filename)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+
+    def reconcile(self, conn: Connection) -> None:
+        """
+        Метод сверки папки с фото и БД
+
+        :param conn: Соединение с БД
+        :type conn: Connection
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self._shard_legacy(conn)
+
+        # Проверяем записи: есть ли файл и известен ли размер.
+        # Свежие записи не проверяем: их файл мог ещё не попасть на место
+        deadline = time.time() - self.orphan_grace
+        cutoff = db_timestamp(deadline)
+        missing_files = 0
+        last_id = 0
+        while not self._stopped():
+            rows = conn.execute(
+                "SELECT id, filename, size FROM humans WHERE id > ? AND created_at < ? ORDER BY id LIMIT ?",
+                (last_id, cutoff, self.batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            missing: List[Tuple[int, str]] = []
+            sizes: List[Tuple[int, int]] = []
+            for row_id, filename, size in rows:
+                if not os.path.exists(os.path.join(self.directory, filename)):
+                    missing.append((row_id, filename))
+                    continue
+                if size is None:
+                    sizes.append((self._size(filename), row_id))
+            missing_files += len(missing)
+            if missing and self.delete_orphan_rows:
+                self._delete(conn, missing)
+                self.stats.inc("orphan_rows", len(missing))
+            if sizes:
+                with conn:
+                    conn.executemany("UPDATE humans SET size = ? WHERE id = ?", sizes)
+
+        # Записи без файлов за последний проход, без delete_orphan_rows они остаются в БД
+        self.stats.set_gauge("missing_files", missing_files)
+        if missing_files and not self.delete_orphan_rows:
+            logger.warning("%d images in the database have no file, keeping the rows", missing_files)
+        if self._stopped():
+            return
+
+        # Проверяем файлы: фото и миниатюры без записей удаляем.
+        # Имена сверяются с БД пачками по индексу, весь список файлов в памяти не держим
+        thumbs = os.path.join(self.directory, THUMBS)
+        for root in (self.directory, thumbs):
+            candidates: List[Tuple[str, str]] = []
+            for path, filename in self._walk(root, skip=thumbs if root == self.directory else None):
+                try:
+                    if os.path.getmtime(path) >= deadline:
+                        continue
+                except FileNotFoundError:
+                    continue
+                candidates.append((path, filename))
+                if len(candidates) >= self.batch_size:
+                    self._remove_orphans(conn, candidates)
+                    candidates = []
+            self._remove_orphans(conn, candidates)
+
+        self._remove_empty_dirs(deadline)
+
+    def _remove_orphans(self, conn: Connection, candidates: List[Tuple[str, str]]) -> None:
+        # Удаляем файлы из пачки, имён которых нет в БД. Недописанные .tmp файлы остаются после сбоя записи
+        names = [filename for _, filename in candidates if not filename.endswith(".tmp")]
+        known: Set[str] = set()
+        if names:
+            placeholders = ", ".join("?" * len(names))
+            known = {
+                row[0]
+                for row in conn.execute(f"SELECT filename FROM humans WHERE filename IN ({placeholders})", names)
+            }
+        for path, filename in candidates:
+            if filename in known:
+                continue
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.stats.inc("orphan_files")
+            self.stats.inc("freed_bytes", size)
+
+    def _shard_legacy(self, conn: Connection) -> None:
+        # Фото, сохранённые до разбивки по дням, лежат прямо в папке с фото - переносим их в папки дней
+        # Записи без файлов остаются в старом формате, поэтому идём по id, чтобы не выбирать их снова
+        last_id = 0
+        while not self._stopped():
+            rows = conn.execute(
+                "SELECT id, filename, created_at FROM humans WHERE id > ? AND filename NOT LIKE '%/%' "
+                "ORDER BY id LIMIT ?",
+                (last_id, self.batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            moved: List[Tuple[str, int]] = []
+            missing: List[Tuple[int, str]] = []
+            for row_id, filename, created_at in rows:
+                target = shard_name(created_at, filename)
+                try:
+                    self._move(filename, target)
+                except FileNotFoundError:
+                    missing.append((row_id, filename))
+                    continue
+                moved.append((target, row_id))
+            with conn:
+                conn.executemany("UPDATE humans SET filename = ? WHERE id = ?", moved)
+            self.stats.inc("sharded", len(moved))
+            # Записи без файлов удаляются только с delete_orphan_rows, иначе их посчитает сверка
+            if missing and self.delete_orphan_rows:
+                self._delete(conn, missing)
+                self.stats.inc("orphan_rows", len(missing))
+
+    def _move(self, filename: str, target: str) -> None:
+        source = os.path.join(self.directory, filename)
+        destination = os.path.join(self.directory, target)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(source, destination)
+        # Миниатюры может не быть, если они отключены
+        thumbnail = os.path.join(self.directory, THUMBS, filename)
+        if os.path.exists(thumbnail):
+            thumbnail_destination = os.path.join(self.directory, THUMBS, target)
+            os.makedirs(os.path.dirname(thumbnail_destination), exist_ok=True)
+            os.replace(thumbnail, thumbnail_destination)
+
+    def _delete(self, conn: Connection, rows: List[Tuple[int, str]]) -> None:
+        # Сначала записи, затем файлы
+        with conn:
+            conn.executemany("DELETE FROM humans WHERE id = ?", [(row_id,) for row_id, _ in rows])
+        for _, filename in rows:
+            for path in (os.path.join(self.directory, filename), os.path.join(self.directory, THUMBS, filename)):
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                self.stats.inc("freed_bytes", size)
+
+    def _size(self, filename: str) -> int:
+        # Размер фото с миниатюрой
+        size = 0
+        for path in (os.path.join(self.directory, filename), os.path.join(self.directory, THUMBS, filename)):
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+
+        return size
+
+    def _walk(self, root: str, skip: str | None = None):
+        # Файлы папки с путём относительно неё в формате имени из БД
+        for path, directories, files in os.walk(root):
+            if skip is not None and os.path.abspath(path) == os.path.abspath(root):
+                directories[:] = [name for name in directories if os.path.join(path, name) != skip]
+            for name in files:
+                full_path = os.path.join(path, name)
+                yield full_path, os.path.relpath(full_path, root).replace(os.sep, "/")
+
+    def _remove_empty_dirs(self, deadline: float) -> None:
+        # Пустые папки дней удаляются, только если давно не менялись: в новую папку сейчас может писаться фото
+        thumbs = os.path.join(self.directory, THUMBS)
+        for path, directories, files in os.walk(self.directory, topdown=False):
+            if path in (self.directory, thumbs) or files or directories:
+                continue
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.rmdir(path)
+            except OSError:
+                continue
+
+    def _stopped(self) -> bool:
+        return self.stop_event is not None and self.stop_event.is_set()
+
+
+def create_job(retention_settings: dict, stop_event: Event | None = None) -> RetentionJob:
+    """
+    Функция создания задачи очистки по настройкам retention
+
+    :param retention_settings: Раздел retention настроек
+    :type retention_settings: dict
+    :param stop_event: Тригер остановки
+    :type stop_event: Event | None
+    :return: Задача очистки
+    :rtype: RetentionJob
+    """
+
+    return RetentionJob(
+        directory=retention_settings.get("directory", "static/images"),
+        max_age_days=retention_settings.get("max_age_days", 0),
+        max_size_mb=retention_settings.get("max_size_mb", 0),
+        archive_after_days=retention_settings.get("archive_after_days", 0),
+        archive_width=retention_settings.get("archive_width", 640),
+        archive_quality=retention_settings.get("archive_quality", 70),
+        batch_size=retention_settings.get("batch_size", 500),
+        orphan_grace=retention_settings.get("orphan_grace", 3600),
+        delete_orphan_rows=retention_settings.get("delete_orphan_rows", False),
+        stop_event=stop_event,
+    )
+
+
+def retention_worker(stop_event: Event, event_queue: Queue | None = None) -> None:
+    """
+    Функция запущенная в процессе очистки, раз в retention.interval секунд выполняет проход очистки.
+    Статистика отправляется в очередь событий под ключом retention, её видно в /pipeline и /metrics
+
+    :param stop_event: Тригер для прекращения бесконечного цикла
+    :type stop_event: Event
+    :param event_queue: Очередь для публикации статистики, None - не публиковать
+    :type event_queue: multiprocessing.Queue | None
+    :return: Ничего не возвращает
+    :rtype: None
+    """
+
+    from config import settings
+
+    retention_settings: dict = settings.get("retention", {})
+    job = create_job(retention_settings, stop_event=stop_event)
+    # Воркер API, который запустил очистку
+    parent_pid = os.getppid()
+
+    while not stop_event.is_set():
+        try:
+            job.run_once()
+        except Exception:
+            # Ошибка одного прохода не останавливает очистку
+            logger.exception("retention pass failed")
+            job.stats.inc("errors")
+        if event_queue is not None:
+            event_queue.put({"type": "stats", "camera_id": "retention", **job.stats.snapshot()})
+        next_run = time.monotonic() + retention_settings.get("interval", 3600)
+        while not stop_event.is_set() and time.monotonic() < next_run:
+            stop_event.wait(min(next_run - time.monotonic(), 5))
+            # Владелец камер завершился, не остановив очистку - её запустит новый владелец
+            if os.getppid() != parent_pid:
+                return
+
+
+if __name__ == "__main__":
+    from config import settings
+
+    parser = argparse.ArgumentParser(description="Один проход очистки папки с фото по настройкам retention")
+    parser.add_argument("--max-age-days", type=float, help="Переопределить retention.max_age_days")
+    parser.add_argument("--max-size-mb", type=float, help="Переопределить retention.max_size_mb")
+    parser.add_argument("--archive-after-days", type=float, help="Переопределить retention.archive_after_days")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    options = dict(settings.get("retention", {}))
+    for key in ("max_age_days", "max_size_mb", "archive_after_days"):
+        if getattr(args, key) is not None:
+            options[key] = getattr(args, key)
+    print(json.dumps(create_job(options).run_once(), indent=2))
@@ -1,6 +1,6 @@
-from typing import List
+from typing import Dict, List
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class Camera(BaseModel):
@@ -9,3 +9,28 @@ class Camera(BaseModel):
 
 class Humans(BaseModel):
     images: List[str]
+    next_cursor: str | None = None
+
+
+class Region(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    x: int = Field(ge=0, description="Отступ левого верхнего угла области слева")
+    y: int = Field(ge=0, description="Отступ левого верхнего угла области сверху")
+    width: int = Field(gt=0, description="Ширина области")
+    height: int = Field(gt=0, description="Высота области")
+
+
+class CameraSettings(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    regions: Dict[str, Region] | None = Field(
+        None, min_length=1, max_length=32, description="Именованные области распознавания"
+    )
+    dwell_time: float | None = Field(
+        None, gt=0, le=3600, description="Сколько секунд лицо должно быть в области до снимка"
+    )
+    detect_fps: float | None = Field(
+        None, ge=0, le=120, description="Максимальная частота распознавания, 0 - каждый новый кадр"
+    )
+    score_threshold: float | None = Field(None, gt=0, le=1, description="Минимальная уверенность детектора")
@@ -0,0 +1,194 @@
+import os
+import time
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+from numpy import ndarray
+
+# Расширения файлов, которые читаются из папки с кадрами
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+# Скорость воспроизведения: native - с частотой записи, max - так быстро, как успевает читатель
+SPEEDS = ("native", "max")
+
+
+class FrameSource:
+    """
+    Источник кадров из файлов с тем же интерфейсом, что у cv2.VideoCapture (isOpened, read и release).
+
+    В режиме native кадры отдаются с частотой fps, как с настоящей камеры,
+    в режиме max - сразу, так можно замерить предельную скорость конвейера.
+    """
+
+    def __init__(self, fps: float, speed: str = "native", loop: bool = False) -> None:
+        """
+        :param fps: Частота кадров источника
+        :type fps: float
+        :param speed: Скорость воспроизведения: native или max
+        :type speed: str
+        :param loop: Начинать сначала после последнего кадра
+        :type loop: bool
+        """
+
+        if speed not in SPEEDS:
+            raise ValueError(f"unknown source speed: {speed}")
+
+        self.interval: float = 1 / fps if speed == "native" and fps > 0 else 0
+        self.loop: bool = loop
+        # Время, когда нужно отдать следующий кадр
+        self._next: float | None = None
+
+    def read(self, image: ndarray | None = None) -> Tuple[bool, ndarray | None]:
+        """
+        Метод чтения следующего кадра
+
+        :param image: Массив, в который записать кадр, None - создать новый
+        :type image: ndarray | None
+        :return: Прочитан ли кадр и сам кадр
+        :rtype: Tuple[bool, ndarray | None]
+        """
+
+        self._pace()
+        success, frame = self._read(image)
+        if not success and self.loop:
+            self._rewind()
+            success, frame = self._read(image)
+
+        return success, frame
+
+    def isOpened(self) -> bool:
+        """
+        Метод проверки, открыт ли источник
+
+        :return: Есть ли кадры для чтения
+        :rtype: bool
+        """
+
+        raise NotImplementedError
+
+    def release(self) -> None:
+        """
+        Метод освобождения источника
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+    def _pace(self) -> None:
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next is not None and self._next > now:
+            time.sleep(self._next - now)
+        # Отставание не копится: если читатель опоздал, следующий кадр отсчитывается от текущего момента
+        self._next = max(self._next or now, now) + self.interval
+
+    def _read(self, image: ndarray | None) -> Tuple[bool, ndarray | None]:
+        raise NotImplementedError
+
+    def _rewind(self) -> None:
+        raise NotImplementedError
+
+
+class VideoFileSource(FrameSource):
+    """
+    Источник кадров из видео файла
+    """
+
+    def __init__(self, path: str, speed: str = "native", loop: bool = False) -> None:
+        """
+        :param path: Путь к видео файлу
+        :type path: str
+        :param speed: Скорость воспроизведения: native (частота из файла) или max
+        :type speed: str
+        :param loop: Начинать сначала после последнего кадра
+        :type loop: bool
+        """
+
+        self.capture = cv2.VideoCapture(path)
+        super().__init__(fps=self.capture.get(cv2.CAP_PROP_FPS) or 30, speed=speed, loop=loop)
+
+    def isOpened(self) -> bool:
+        return self.capture.isOpened()
+
+    def release(self) -> None:
+        self.capture.release()
+
+    def _read(self, image: ndarray | None) -> Tuple[bool, ndarray | None]:
+        return self.capture.read() if image is None else self.capture.read(image)
+
+    def _rewind(self) -> None:
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+
+class ImageDirSource(FrameSource):
+    """
+    Источник кадров из папки с изображениями, кадры идут в порядке имён файлов
+    """
+
+    def __init__(self, path: str, fps: float = 30, speed: str = "native", loop: bool = False) -> None:
+        """
+        :param path: Путь к папке с изображениями
+        :type path: str
+        :param fps: Частота кадров для режима native
+        :type fps: float
+        :param speed: Скорость воспроизведения: native или max
+        :type speed: str
+        :param loop: Начинать сначала после последнего кадра
+        :type loop: bool
+        """
+
+        super().__init__(fps=fps, speed=speed, loop=loop)
+        self.files: List[str] = sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self._index: int = 0
+
+    def isOpened(self) -> bool:
+        return bool(self.files)
+
+    def _read(self, image: ndarray | None) -> Tuple[bool, ndarray | None]:
+        while self._index < len(self.files):
+            frame = cv2.imread(self.files[self._index])
+            self._index += 1
+            # Файл, который не удалось прочитать, пропускаем
+            if frame is None:
+                continue
+            if image is None:
+                return True, frame
+            # Кадр записывается в переданный массив, изображение другого размера приводится к нему
+            if frame.shape == image.shape:
+                np.copyto(image, frame)
+            else:
+                cv2.resize(frame, (image.shape[1], image.shape[0]), dst=image)
+            return True, image
+
+        return False, None
+
+    def _rewind(self) -> None:
+        self._index = 0
+
+
+def open_source(camera_settings: dict):
+    """
+    Функция открытия источника кадров камеры: папка с изображениями, видео файл,
+    иначе номер USB камеры или ссылка на поток (cv2.VideoCapture)
+
+    :param camera_settings: Настройки камеры: source, speed (native или max), loop, fps (для папки)
+    :type camera_settings: dict
+    :return: Источник кадров с методами isOpened, read и release
+    """
+
+    source = camera_settings["source"]
+    speed: str = camera_settings.get("speed", "native")
+    loop: bool = camera_settings.get("loop", False)
+
+    if isinstance(source, str) and os.path.isdir(source):
+        return ImageDirSource(path=source, fps=camera_settings.get("fps", 30), speed=speed, loop=loop)
+    if isinstance(source, str) and os.path.isfile(source):
+        return VideoFileSource(path=source, speed=speed, loop=loop)
+
+    # Камера и поток отдают кадры со своей частотой
+    return cv2.VideoCapture(source)
@@ -0,0 +1,714 @@
+import asyncio
+import base64
+import binascii
+import functools
+import itertools
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from sqlite3 import Connection, Cursor, Error
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple, TypeVar
+
+from pipeline import PipelineStats
+
+logger = logging.getLogger(__name__)
+
+# Путь к файлу БД
+database_path = "database.db"
+
+T = TypeVar("T")
+
+
+def get_connection(check_same_thread: bool = True) -> Connection:
+    """
+    Функция получения соединения с БД
+
+    :param check_same_thread: Запретить использование соединения из других потоков
+    :type check_same_thread: bool
+    :return: Соединение с БД
+    :rtype: Connection
+    """
+
+    # timeout - сколько ждать, пока другой процесс держит блокировку записи
+    with sqlite3.connect(
+            database=database_path, timeout=10, check_same_thread=check_same_thread
+    ) as conn:
+        return conn
+
+
+def db_timestamp(moment: float | None = None) -> str:
+    """
+    Функция получения времени в формате колонки created_at (UTC, как CURRENT_TIMESTAMP в SQLite)
+
+    :param moment: Время в секундах, None - текущее время
+    :type moment: float | None
+    :return: Время в формате YYYY-MM-DD HH:MM:SS
+    :rtype: str
+    """
+
+    if moment is None:
+        moment = time.time()
+
+    return datetime.fromtimestamp(moment, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def shard_name(created_at: str, name: str) -> str:
+    """
+    Функция получения имени фото в папке его дня: YYYY/MM/DD/name.
+    Фото раскладываются по дням, чтобы в одной папке не копились сотни тысяч файлов
+
+    :param created_at: Время снимка в формате YYYY-MM-DD HH:MM:SS
+    :type created_at: str
+    :param name: Имя файла
+    :type name: str
+    :return: Путь относительно папки с фото, он же хранится в БД
+    :rtype: str
+    """
+
+    return f"{created_at[:10].replace('-', '/')}/{name}"
+
+
+def check_static() -> None:
+    """
+    Функция для проверки существования папок static, images и images/thumbs
+
+    :return: Ничего не возвращает
+    :rtype: None
+    """
+
+    # Путь к приложению
+    app_path = os.path.abspath(os.path.dirname(__file__))
+
+    # Если папки не существует, создаём
+    if not os.path.exists(os.path.join(app_path, "static")):
+        os.mkdir(os.path.join(app_path, "static"))
+
+    # Если папки не существует, создаём
+    if not os.path.exists(os.path.join(app_path, "static", "images")):
+        os.mkdir(os.path.join(app_path, "static", "images"))
+
+    # Если папки миниатюр не существует, создаём
+    if not os.path.exists(os.path.join(app_path, "static", "images", "thumbs")):
+        os.mkdir(os.path.join(app_path, "static", "images", "thumbs"))
+
+
+def _create_humans(cursor: Cursor) -> None:
+    """Миграция 1: таблица фото"""
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS humans (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT NOT NULL,
+                    created_at TEXT DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """
+    )
+
+
+def _add_camera_id(cursor: Cursor) -> None:
+    """Миграция 2: колонка camera_id для нескольких камер"""
+
+    # В БД, обновлённых до появления миграций, колонка уже может быть
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(humans)")]
+    if "camera_id" not in columns:
+        cursor.execute("ALTER TABLE humans ADD COLUMN camera_id TEXT NOT NULL DEFAULT '0'")
+
+
+def _add_created_at_indexes(cursor: Cursor) -> None:
+    """Миграция 3: индексы для выборки по диапазону дат, в том числе по одной камере"""
+
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_humans_created_at ON humans (created_at, id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_humans_camera_created_at ON humans (camera_id, created_at, id)"
+    )
+
+
+def _add_retention_columns(cursor: Cursor) -> None:
+    """Миграция 4: размер фото с миниатюрой и отметка об архивации для очистки папки с фото"""
+
+    cursor.execute("ALTER TABLE humans ADD COLUMN size INTEGER")
+    cursor.execute("ALTER TABLE humans ADD COLUMN archived INTEGER NOT NULL DEFAULT 0")
+    # Частичный индекс: архивированные записи не просматриваются при поиске кандидатов в архив
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_humans_unarchived ON humans (created_at, id) WHERE archived = 0"
+    )
+
+
+def _add_dedup_columns(cursor: Cursor) -> None:
+    """Миграция 5: перцептивный хэш лица, количество объединённых похожих снимков и время последнего из них"""
+
+    cursor.execute("ALTER TABLE humans ADD COLUMN phash TEXT")
+    cursor.execute("ALTER TABLE humans ADD COLUMN duplicates INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE humans ADD COLUMN last_seen TEXT")
+
+
+# Сводки сеансов: таблица и длина префикса времени начала сеанса, который задаёт корзину
+ROLLUPS: Dict[str, Tuple[str, int]] = {
+    "minute": ("sessions_minutely", len("YYYY-MM-DD HH:MM")),
+    "hour": ("sessions_hourly", len("YYYY-MM-DD HH")),
+}
+
+
+def session_bucket(started_at: str, bucket: str) -> str:
+    """
+    Функция получения корзины сводки для времени начала сеанса
+
+    :param started_at: Время начала сеанса в формате YYYY-MM-DD HH:MM:SS
+    :type started_at: str
+    :param bucket: Размер корзины: minute, hour или day
+    :type bucket: str
+    :return: Начало корзины в формате YYYY-MM-DD HH:MM:SS
+    :rtype: str
+    """
+
+    # Дневной сводки нет, дни собираются из часовой
+    prefix = started_at[:len("YYYY-MM-DD") if bucket == "day" else ROLLUPS[bucket][1]]
+
+    # Отброшенные минуты и секунды заменяем нулями
+    return prefix + "0000-00-00 00:00:00"[len(prefix):]
+
+
+def _create_sessions(cursor: Cursor) -> None:
+    """Миграция 6: сеансы нахождения лица в области и их сводки по минутам и часам"""
+
+    # Журнал сеансов: записи только добавляются, сводки считаются из них
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    camera_id TEXT NOT NULL,
+                    started_at TEXT NOT NULL,
+                    ended_at TEXT NOT NULL,
+                    duration REAL NOT NULL,
+                    snapshots INTEGER NOT NULL
+                    )
+                """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_started_at ON sessions (started_at, id)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sessions_camera_started_at ON sessions (camera_id, started_at, id)"
+    )
+    # Сводки: одна строка на корзину и камеру, диапазон корзин читается по первичному ключу
+    for table, _ in ROLLUPS.values():
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                        bucket TEXT NOT NULL,
+                        camera_id TEXT NOT NULL,
+                        sessions INTEGER NOT NULL,
+                        snapshots INTEGER NOT NULL,
+                        duration REAL NOT NULL,
+                        max_duration REAL NOT NULL,
+                        PRIMARY KEY (bucket, camera_id)
+                        ) WITHOUT ROWID
+                    """
+        )
+
+
+def _add_filename_index(cursor: Cursor) -> None:
+    """Миграция 7: индекс по имени файла для сверки папки с фото и БД"""
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_humans_filename ON humans (filename)")
+
+
+# Миграции схемы по порядку, номер версии схемы = количество применённых миграций (PRAGMA user_version)
+MIGRATIONS: List[Callable[[Cursor], None]] = [
+    _create_humans,
+    _add_camera_id,
+    _add_created_at_indexes,
+    _add_retention_columns,
+    _add_dedup_columns,
+    _create_sessions,
+    _add_filename_index,
+]
+
+
+def create_table(conn: Connection) -> None:
+    """
+    Функция создания таблиц в БД, применяет к БД миграции, которых в ней ещё нет
+
+    :param conn: Соединение с базой данных
+    :type conn: Connection
+    :return: Ничего не возвращает
+    :rtype: None
+    """
+
+    try:
+        # Создаём курсор для выполнения запроса в БД
+        cursor = conn.cursor()
+        # WAL сохраняется в файле БД: читатели не блокируют запись и наоборот
+        cursor.execute("PRAGMA journal_mode=WAL")
+
+        while True:
+            # Блокировка записи берётся до чтения версии: воркеры API, запущенные одновременно,
+            # применяют миграции по очереди, а не одну и ту же дважды
+            cursor.execute("BEGIN IMMEDIATE")
+            # Текущая версия схемы
+            version: int = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.commit()
+                break
+            MIGRATIONS[version](cursor)
+            # PRAGMA не поддерживает параметры, version - всегда число
+            cursor.execute(f"PRAGMA user_version = {version + 1}")
+            # Сохраняем в БД после каждой миграции
+            conn.commit()
+    except Error:
+        logger.exception("database migration failed")
+        conn.rollback()
+
+
+# Запросы потока записи: новое фото и объединение похожего снимка с уже сохранённым
+INSERT_IMAGE = "INSERT INTO humans (filename, camera_id, created_at, size, phash) VALUES (?, ?, ?, ?, ?)"
+MERGE_IMAGE = "UPDATE humans SET duplicates = duplicates + 1, last_seen = ? WHERE filename = ?"
+# Сеанс и добавление его в сводки: сводка обновляется на месте, а не пересчитывается
+INSERT_SESSION = (
+    "INSERT INTO sessions (camera_id, started_at, ended_at, duration, snapshots) VALUES (?, ?, ?, ?, ?)"
+)
+ROLLUP_SESSION = {
+    bucket: f"""INSERT INTO {table} (bucket, camera_id, sessions, snapshots, duration, max_duration)
+    VALUES (?, ?, 1, ?, ?, ?)
+    ON CONFLICT (bucket, camera_id) DO UPDATE SET
+    sessions = sessions + 1,
+    snapshots = snapshots + excluded.snapshots,
+    duration = duration + excluded.duration,
+    max_duration = MAX(max_duration, excluded.max_duration)"""
+    for bucket, (table, _) in ROLLUPS.items()
+}
+
+
+class DatabaseWriter(threading.Thread):
+    """
+    Поток записи в БД с одним долгоживущим соединением.
+
+    Записи копятся в очереди и вставляются пачками в одной транзакции:
+    когда набралось batch_size записей или прошло flush_interval секунд с первой записи пачки.
+    """
+
+    def __init__(
+            self, batch_size: int = 50, flush_interval: float = 0.5, stats: PipelineStats | None = None
+    ) -> None:
+        """
+        :param batch_size: Максимальное количество записей в одной транзакции
+        :type batch_size: int
+        :param flush_interval: Максимальное время ожидания записи в БД в секундах
+        :type flush_interval: float
+        :param stats: Статистика конвейера, в неё пишется время записи пачки (стадия db_write)
+        :type stats: PipelineStats | None
+        """
+
+        super().__init__(name="database-writer", daemon=True)
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+        self.stats: PipelineStats = stats or PipelineStats()
+        self.queue: queue.Queue = queue.Queue()
+
+    def add(
+            self,
+            filename: str,
+            camera_id: str,
+            created_at: str | None = None,
+            size: int | None = None,
+            phash: str | None = None,
+    ) -> None:
+        """
+        Метод добавления записи о фото в очередь на запись
+
+        :param filename: Имя файла
+        :type filename: str
+        :param camera_id: Идентификатор камеры
+        :type camera_id: str
+        :param created_at: Время снимка, None - текущее время
+        :type created_at: str | None
+        :param size: Размер фото с миниатюрой в байтах, None - неизвестен (заполнит сверка папки с БД)
+        :type size: int | None
+        :param phash: Перцептивный хэш лица в hex, None - не считался
+        :type phash: str | None
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        # Время фиксируем сейчас, а не при записи пачки
+        self.queue.put((INSERT_IMAGE, (filename, camera_id, created_at or db_timestamp(), size, phash)))
+
+    def merge(self, filename: str, seen_at: str | None = None) -> None:
+        """
+        Метод объединения похожего снимка с сохранённым: увеличивается счётчик duplicates и время last_seen.
+        Запросы выполняются в порядке постановки, поэтому объединение не обгонит вставку, стоящую в очереди раньше
+
+        :param filename: Имя файла сохранённого снимка
+        :type filename: str
+        :param seen_at: Время похожего снимка, None - текущее время
+        :type seen_at: str | None
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self.queue.put((MERGE_IMAGE, (seen_at or db_timestamp(), filename)))
+
+    def add_session(
+            self, camera_id: str, started_at: str, ended_at: str, duration: float, snapshots: int
+    ) -> None:
+        """
+        Метод добавления завершённого сеанса: запись в журнал и в сводки по минутам и часам
+        попадают в одну транзакцию пачки
+
+        :param camera_id: Идентификатор камеры
+        :type camera_id: str
+        :param started_at: Время входа лица в область
+        :type started_at: str
+        :param ended_at: Время, когда лицо последний раз было в области
+        :type ended_at: str
+        :param duration: Длительность сеанса в секундах
+        :type duration: float
+        :param snapshots: Количество снимков за сеанс
+        :type snapshots: int
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self.queue.put((INSERT_SESSION, (camera_id, started_at, ended_at, duration, snapshots)))
+        for bucket, query in ROLLUP_SESSION.items():
+            self.queue.put(
+                (query, (session_bucket(started_at, bucket), camera_id, snapshots, duration, duration))
+            )
+
+    def close(self) -> None:
+        """
+        Метод остановки потока, оставшиеся записи сохраняются
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self.queue.put(None)
+        self.join()
+
+    def run(self) -> None:
+        conn = sqlite3.connect(database=database_path, timeout=10)
+        # В режиме WAL NORMAL не теряет целостность БД, но не ждёт fsync на каждую транзакцию
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            closed = False
+            while not closed:
+                # Ждём первую запись пачки
+                item = self.queue.get()
+                if item is None:
+                    break
+                batch: List[Tuple[str, tuple]] = [item]
+                deadline = time.monotonic() + self.flush_interval
+
+                # Добираем пачку до batch_size или до истечения flush_interval
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        closed = True
+                        break
+                    batch.append(item)
+
+                self._flush(conn=conn, batch=batch)
+        finally:
+            conn.close()
+
+    def _flush(self, conn: Connection, batch: List[Tuple[str, tuple]]) -> None:
+        start = time.perf_counter()
+        try:
+            with conn:
+                # Подряд идущие одинаковые запросы выполняются одним executemany, порядок сохраняется
+                for query, items in itertools.groupby(batch, key=lambda item: item[0]):
+                    conn.executemany(query, [params for _, params in items])
+        except Error:
+            logger.exception("failed to write %d rows", len(batch))
+            self.stats.inc("db_errors")
+            return
+        self.stats.observe("db_write", time.perf_counter() - start)
+        self.stats.inc("db_rows", len(batch))
+
+
+def encode_cursor(created_at: str, row_id: int) -> str:
+    """
+    Функция создания курсора страницы: позиция последней отданной записи
+
+    :param created_at: Время последней записи
+    :type created_at: str
+    :param row_id: Id последней записи
+    :type row_id: int
+    :return: Курсор в виде строки
+    :rtype: str
+    """
+
+    return base64.urlsafe_b64encode(json.dumps([created_at, row_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Функция разбора курсора страницы
+
+    :param cursor: Курсор в виде строки
+    :type cursor: str
+    :return: Время и id последней отданной записи
+    :rtype: Tuple[str, int]
+    :raises ValueError: Если курсор повреждён
+    """
+
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, json.JSONDecodeError, TypeError, ValueError) as exc:
+        raise ValueError("invalid cursor") from exc
+    if not isinstance(created_at, str) or not isinstance(row_id, int):
+        raise ValueError("invalid cursor")
+
+    return created_at, row_id
+
+
+def get_images_page(
+        conn: Connection,
+        start_date: str,
+        end_date: str,
+        camera_id: str | None = None,
+        after: Tuple[str, int] | None = None,
+        limit: int = 100,
+) -> List[Tuple[int, str, str, str]]:
+    """
+    Функция получения страницы фото по фильтру дат.
+    Страницы строятся по ключу (created_at, id): следующая страница начинается сразу после
+    последней записи предыдущей, поэтому каждая страница - один проход по индексу без OFFSET
+
+    :param conn: Соединение с базой данных
+    :type conn: Connection
+    :param start_date: Дата начала
+    :type start_date: str
+    :param end_date: Дата окончания
+    :type end_date: str
+    :param camera_id: Идентификатор камеры, None - все камеры
+    :type camera_id: str | None
+    :param after: Время и id последней записи предыдущей страницы, None - первая страница
+    :type after: Tuple[str, int] | None
+    :param limit: Максимальное количество записей на странице
+    :type limit: int
+    :return: Записи (id, имя файла, время, камера)
+    :rtype: List[Tuple[int, str, str, str]]
+    """
+
+    # Запрос для БД, диапазон дат выбирается по индексу
+    query: str = """SELECT id, filename, created_at, camera_id FROM humans WHERE created_at BETWEEN ? AND ?"""
+    params: tuple = (start_date, end_date)
+    # Фильтр по камере
+    if camera_id is not None:
+        query += " AND camera_id = ?"
+        params += (camera_id,)
+    # Продолжаем после последней отданной записи
+    if after is not None:
+        query += " AND (created_at, id) > (?, ?)"
+        params += after
+    query += " ORDER BY created_at, id LIMIT ?"
+    params += (limit,)
+
+    try:
+        # Создаём курсор для выполнения запроса в БД
+        cursor = conn.cursor()
+        # Выполняем запрос и получаем данные
+        return cursor.execute(query, params).fetchall()
+    except Error:
+        logger.exception("failed to read images page")
+
+    # Если ошибка возвращаем, что записей нет
+    return []
+
+
+def get_session_stats(
+        conn: Connection,
+        start_date: str,
+        end_date: str,
+        bucket: str = "hour",
+        camera_id: str | None = None,
+) -> List[Tuple[str, int, int, float, float]]:
+    """
+    Функция получения статистики сеансов по корзинам из сводок, журнал сеансов не читается.
+    Дневные корзины собираются из часовых: каждая корзина - не больше 24 строк сводки на камеру
+
+    :param conn: Соединение с базой данных
+    :type conn: Connection
+    :param start_date: Дата начала, корзина, в которую она попадает, учитывается целиком
+    :type start_date: str
+    :param end_date: Дата окончания
+    :type end_date: str
+    :param bucket: Размер корзины: minute, hour или day
+    :type bucket: str
+    :param camera_id: Идентификатор камеры, None - все камеры
+    :type camera_id: str | None
+    :return: Корзины (начало, сеансы, снимки, суммарная и максимальная длительность)
+    :rtype: List[Tuple[str, int, int, float, float]]
+    """
+
+    table = ROLLUPS["hour" if bucket == "day" else bucket][0]
+    # Начало дня из начала часа
+    period = "substr(bucket, 1, 10) || ' 00:00:00'" if bucket == "day" else "bucket"
+
+    # Запрос для БД, диапазон корзин выбирается по первичному ключу
+    query: str = f"""SELECT {period} AS period, SUM(sessions), SUM(snapshots), SUM(duration), MAX(max_duration)
+    FROM {table} WHERE bucket BETWEEN ? AND ?"""
+    # Диапазон начинается с начала корзины, иначе первый день собрался бы только из часов после start_date
+    params: tuple = (session_bucket(start_date, bucket), end_date)
+    # Фильтр по камере
+    if camera_id is not None:
+        query += " AND camera_id = ?"
+        params += (camera_id,)
+    query += " GROUP BY period ORDER BY period"
+
+    try:
+        # Создаём курсор для выполнения запроса в БД
+        cursor = conn.cursor()
+        # Выполняем запрос и получаем данные
+        return cursor.execute(query, params).fetchall()
+    except Error:
+        logger.exception("failed to read session stats")
+
+    # Если ошибка возвращаем, что сеансов нет
+    return []
+
+
+class AsyncDatabase:
+    """
+    Асинхронный доступ к БД для обработчиков FastAPI.
+
+    Запросы sqlite3 блокирующие, поэтому выполняются в отдельном пуле потоков,
+    у каждого потока своё соединение из ограниченного пула. Цикл событий только ждёт результат,
+    медленный запрос не останавливает остальные запросы и SSE.
+    """
+
+    def __init__(self, pool_size: int = 4) -> None:
+        """
+        :param pool_size: Количество потоков и соединений с БД
+        :type pool_size: int
+        """
+
+        self.pool_size: int = pool_size
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="database")
+        # Свободные соединения, создаются по мере необходимости, не больше pool_size
+        self._connections: queue.Queue = queue.Queue()
+        self._created: int = 0
+        self._lock = threading.Lock()
+        # Время ожидания в очереди и время выполнения запросов
+        self.stats = PipelineStats()
+        # Запросы, которые ждут свободный поток
+        self.queued: int = 0
+        # Запросы, которые сейчас выполняются
+        self.running: int = 0
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Метод выполнения функции работы с БД в пуле потоков
+
+        :param func: Функция, первым аргументом принимает соединение conn
+        :type func: Callable[..., T]
+        :return: Результат функции
+        :rtype: T
+        """
+
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(self._call, func, submitted, *args, **kwargs),
+        )
+
+    async def iterate(
+            self, func: Callable[..., List[Tuple]], key: Callable[[Tuple], tuple], **kwargs
+    ) -> AsyncIterator[Tuple]:
+        """
+        Асинхронный генератор постраничного чтения: каждая страница - отдельный запрос в пуле,
+        соединение не занимается на всё время выдачи
+
+        :param func: Функция чтения страницы, принимает conn, after, limit
+        :type func: Callable[..., List[Tuple]]
+        :param key: Функция получения позиции after из последней записи страницы
+        :type key: Callable[[Tuple], tuple]
+        :return: Записи
+        :rtype: AsyncIterator[Tuple]
+        """
+
+        after = kwargs.pop("after", None)
+        limit = kwargs.pop("limit", 500)
+
+        while True:
+            rows = await self.run(func, after=after, limit=limit, **kwargs)
+            for row in rows:
+                yield row
+            if len(rows) < limit:
+                break
+            after = key(rows[-1])
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Метод получения метрик пула: размер очереди и время ожидания/выполнения запросов
+
+        :return: Метрики пула
+        :rtype: Dict[str, Any]
+        """
+
+        return {
+            "pool_size": self.pool_size,
+            "connections": self._created,
+            "queued": self.queued,
+            "running": self.running,
+            **self.stats.snapshot(),
+        }
+
+    def close(self) -> None:
+        """
+        Метод остановки пула и закрытия соединений
+
+        :return: Ничего не возвращает
+        :rtype: None
+        """
+
+        self._executor.shutdown(wait=True)
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+    def _call(self, func: Callable[..., T], submitted: float, *args, **kwargs) -> T:
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        self.stats.observe("wait", started - submitted)
+
+        conn = self._acquire()
+        try:
+            return func(conn, *args, **kwargs)
+        finally:
+            self._connections.put(conn)
+            with self._lock:
+                self.running -= 1
+            self.stats.observe("query", time.perf_counter() - started)
+            self.stats.inc("queries")
+
+    def _acquire(self) -> Connection:
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            # Потоков столько же, сколько соединений, поэтому новое соединение
+            # создаётся только пока пул не заполнен
+            self._created += 1
+
+        # Соединение переходит между потоками пула, но используется одним потоком за раз
+        return get_connection(check_same_thread=False)
@@ -0,0 +1,220 @@
+import itertools
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+from numpy import ndarray
+
+# Рамка лица (x, y, ширина, высота) в координатах кадра
+BBox = Tuple[int, int, int, int]
+
+
+def iou(a: BBox, b: BBox) -> float:
+    """
+    Функция расчёта пересечения над объединением двух рамок
+
+    :param a: Первая рамка
+    :type a: BBox
+    :param b: Вторая рамка
+    :type b: BBox
+    :return: Значение от 0 (не пересекаются) до 1 (совпадают)
+    :rtype: float
+    """
+
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    inter = max(x1 - x0, 0) * max(y1 - y0, 0)
+    union = a[2] * a[3] + b[2] * b[3] - inter
+
+    return inter / union if union else 0.0
+
+
+class Track:
+    """
+    Отслеживаемое лицо: рамка, точки для оптического потока и время нахождения в области
+    """
+
+    def __init__(self, track_id: int, bbox: BBox) -> None:
+        self.track_id: int = track_id
+        self.bbox: BBox = bbox
+        # Сколько ключевых кадров подряд детектор не нашёл это лицо
+        self.missed: int = 0
+        # Точки внутри рамки для оптического потока
+        self.points: ndarray | None = None
+        # Время, с которого лицо находится в области, None - лицо вне области
+        self.dwell_start: float | None = None
+        # Сеанс нахождения в области: время входа, время, когда лицо последний раз было видно в области,
+        # и количество снимков. В отличие от dwell_start, время входа не сдвигается после снимка
+        self.session_start: float | None = None
+        self.last_seen: float | None = None
+        self.snapshots: int = 0
+
+
+class FaceTracker:
+    """
+    Трекер лиц между ключевыми кадрами.
+
+    Детектор запускается на ключевых кадрах: каждые keyframe_interval кадров, если нет ни одного лица
+    или если оптический поток потерял точки (резкое движение). Между ключевыми кадрами рамки сдвигаются
+    по оптическому потоку (Лукас-Канаде), это намного дешевле детектора.
+    На ключевом кадре рамки сопоставляются с найденными по IoU, так у лица сохраняется id,
+    а пропуск лица детектором на нескольких кадрах подряд (до max_missed) не сбрасывает трек.
+    """
+
+    def __init__(
+            self, keyframe_interval: int = 5, max_missed: int = 3, iou_threshold: float = 0.3
+    ) -> None:
+        """
+        :param keyframe_interval: Запускать детектор каждые N кадров, 1 - на каждом кадре
+        :type keyframe_interval: int
+        :param max_missed: Сколько ключевых кадров подряд лицо может не находиться, прежде чем трек удалится
+        :type max_missed: int
+        :param iou_threshold: Минимальное пересечение рамок для сопоставления
+        :type iou_threshold: float
+        """
+
+        self.keyframe_interval: int = max(keyframe_interval, 1)
+        self.max_missed: int = max_missed
+        self.iou_threshold: float = iou_threshold
+        self.tracks: Dict[int, Track] = {}
+        # Удалённые треки, которые ещё не забрал вызывающий (нужны, чтобы закрыть их сеансы)
+        self._removed: List[Track] = []
+        self._ids = itertools.count(1)
+        self._since_keyframe: int = 0
+        self._lost: bool = False
+        self._prev_gray: ndarray | None = None
+
+    def needs_detection(self) -> bool:
+        """
+        Метод проверки, нужен ли детектор на следующем кадре
+
+        :return: Нужно ли запускать детектор
+        :rtype: bool
+        """
+
+        return (
+                not self.tracks
+                or self._lost
+                or self._since_keyframe >= self.keyframe_interval
+        )
+
+    def update(self, gray: ndarray, detections: List[BBox]) -> List[Track]:
+        """
+        Метод обновления треков на ключевом кадре по результатам детектора
+
+        :param gray: Кадр в оттенках серого
+        :type gray: ndarray
+        :param detections: Найденные рамки лиц
+        :type detections: List[BBox]
+        :return: Активные треки
+        :rtype: List[Track]
+        """
+
+        unmatched = list(range(len(detections)))
+
+        # Жадно сопоставляем треки с рамками по убыванию пересечения
+        pairs = sorted(
+            (
+                (iou(track.bbox, detections[index]), track_id, index)
+                for track_id, track in self.tracks.items()
+                for index in unmatched
+            ),
+            reverse=True,
+        )
+        matched_tracks = set()
+        for overlap, track_id, index in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if track_id in matched_tracks or index not in unmatched:
+                continue
+            matched_tracks.add(track_id)
+            unmatched.remove(index)
+            track = self.tracks[track_id]
+            track.bbox = detections[index]
+            track.missed = 0
+
+        # Треки без пары: лицо могло не найтись на одном кадре, удаляем только после max_missed
+        for track_id in list(self.tracks):
+            if track_id not in matched_tracks:
+                self.tracks[track_id].missed += 1
+                if self.tracks[track_id].missed > self.max_missed:
+                    self._removed.append(self.tracks.pop(track_id))
+
+        # Новые лица
+        for index in unmatched:
+            track_id = next(self._ids)
+            self.tracks[track_id] = Track(track_id=track_id, bbox=detections[index])
+
+        for track in self.tracks.values():
+            track.points = self._features(gray, track.bbox)
+
+        self._prev_gray = gray
+        self._since_keyframe = 1
+        self._lost = False
+
+        return list(self.tracks.values())
+
+    def pop_removed(self) -> List[Track]:
+        """
+        Метод получения треков, удалённых с прошлого вызова
+
+        :return: Удалённые треки
+        :rtype: List[Track]
+        """
+
+        removed, self._removed = self._removed, []
+
+        return removed
+
+    def predict(self, gray: ndarray) -> List[Track]:
+        """
+        Метод сдвига рамок по оптическому потоку между ключевыми кадрами
+
+        :param gray: Кадр в оттенках серого
+        :type gray: ndarray
+        :return: Активные треки
+        :rtype: List[Track]
+        """
+
+        self._since_keyframe += 1
+
+        for track in self.tracks.values():
+            if track.points is None or len(track.points) < 3:
+                self._lost = True
+                continue
+
+            points, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, track.points, None)
+            good = status.reshape(-1) == 1
+            # Мало точек отследилось - лицо резко сместилось, нужен детектор
+            if good.sum() < 3:
+                self._lost = True
+                track.points = None
+                continue
+
+            # Сдвигаем рамку на медианное смещение точек, медиана устойчива к выбросам
+            shift = np.median(points[good] - track.points[good], axis=0).reshape(-1)
+            x, y, w, h = track.bbox
+            track.bbox = (int(round(x + shift[0])), int(round(y + shift[1])), w, h)
+            track.points = points[good].reshape(-1, 1, 2)
+
+        self._prev_gray = gray
+
+        return list(self.tracks.values())
+
+    @staticmethod
+    def _features(gray: ndarray, bbox: BBox) -> ndarray | None:
+        x, y, w, h = bbox
+        height, width = gray.shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, width), min(y + h, height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        # Ищем углы только внутри рамки лица и переводим их в координаты кадра
+        points = cv2.goodFeaturesToTrack(
+            gray[y0:y1, x0:x1], maxCorners=20, qualityLevel=0.01, minDistance=3
+        )
+        if points is not None:
+            points += np.array([x0, y0], dtype=np.float32)
+
+        return points
@@ -0,0 +1,171 @@
+import ctypes
+import json
+from multiprocessing.sharedctypes import RawArray, RawValue
+from typing import Dict, Tuple
+
+from config import load_cameras
+
+# Настройки, которые меняются без перезапуска процесса камеры
+FIELDS = ("regions", "dwell_time", "detect_fps", "score_threshold")
+
+
+def camera_tuning(settings: dict, camera: dict) -> dict:
+    """
+    Функция получения начальных настроек камеры из settings.json
+
+    :param settings: Настройки приложения
+    :type settings: dict
+    :param camera: Настройки камеры из load_cameras
+    :type camera: dict
+    :return: Области, время нахождения в области, частота распознавания и порог уверенности детектора
+    :rtype: dict
+    """
+
+    pipeline_settings: dict = settings.get("pipeline", {})
+
+    return {
+        "regions": camera["regions"],
+        "dwell_time": pipeline_settings.get("dwell_time", 5),
+        "detect_fps": pipeline_settings.get("detect_fps", 10),
+        "score_threshold": settings.get("detection", {}).get("score_threshold", 0.5),
+    }
+
+
+def score_floor(settings: dict) -> float:
+    """
+    Функция получения нижней границы уверенности детектора: с ней создаётся бэкенд,
+    порог камеры можно менять на ходу только не ниже неё
+
+    :param settings: Настройки приложения
+    :type settings: dict
+    :return: Минимальная уверенность детектора
+    :rtype: float
+    """
+
+    detection_settings: dict = settings.get("detection", {})
+
+    return min(detection_settings.get("min_score", 0.3), detection_settings.get("score_threshold", 0.5))
+
+
+class SettingsBlock:
+    """
+    Настройки одной камеры в общей памяти с номером версии.
+
+    Блок создаётся в процессе API до запуска процесса камеры и достаётся ему при fork, поэтому
+    переживает перезапуски камеры. Запись устроена как seqlock: на время записи JSON версия нечётная,
+    после записи - следующая чётная. Процесс камеры на каждом кадре сравнивает только версию
+    (чтение общей памяти без системных вызовов) и перечитывает JSON, когда она изменилась.
+    Пишет только процесс API, поэтому блокировка записи не нужна.
+    """
+
+    def __init__(self, values: dict, size: int = 65536) -> None:
+        """
+        :param values: Начальные настройки
+        :type values: dict
+        :param size: Максимальный размер настроек в JSON в байтах
+        :type size: int
+        """
+
+        self._version = RawValue(ctypes.c_uint64, 0)
+        self._length = RawValue(ctypes.c_uint32, 0)
+        self._data = RawArray(ctypes.c_char, size)
+        # Последние записанные настройки, актуальны только в процессе, который пишет
+        self.values: dict = {}
+        self.write(values)
+
+    @property
+    def version(self) -> int:
+        """
+        Номер версии настроек, чётный - запись завершена
+        """
+
+        return self._version.value
+
+    def validate(self, values: dict) -> bytes:
+        """
+        Метод проверки настроек перед записью
+
+        :param values: Новые настройки
+        :type values: dict
+        :return: Настройки в JSON
+        :rtype: bytes
+        :raises ValueError: Если настройки не помещаются в блок
+        """
+
+        data = json.dumps(values, separators=(",", ":")).encode()
+        if len(data) > len(self._data):
+            raise ValueError(f"settings do not fit into {len(self._data)} bytes")
+
+        return data
+
+    def write(self, values: dict) -> int:
+        """
+        Метод записи настроек
+
+        :param values: Новые настройки
+        :type values: dict
+        :return: Номер новой версии
+        :rtype: int
+        :raises ValueError: Если настройки не помещаются в блок
+        """
+
+        data = self.validate(values)
+
+        # Нечётная версия - читатель не возьмёт недописанные данные
+        self._version.value += 1
+        ctypes.memmove(self._data, data, len(data))
+        self._length.value = len(data)
+        self._version.value += 1
+        self.values = values
+
+        return self._version.value
+
+    def poll(self, version: int) -> Tuple[int, dict] | None:
+        """
+        Метод проверки новой версии, вызывается на каждом кадре
+
+        :param version: Версия, которую уже прочитал вызывающий (0 - ещё ничего не прочитано)
+        :type version: int
+        :return: Новая версия и настройки, None - настройки не менялись или сейчас записываются
+        :rtype: Tuple[int, dict] | None
+        """
+
+        current = self._version.value
+        if current == version or current % 2:
+            return None
+
+        data = ctypes.string_at(ctypes.addressof(self._data), self._length.value)
+        # Запись началась, пока мы читали - попробуем на следующем кадре
+        if self._version.value != current:
+            return None
+
+        return current, json.loads(data)
+
+    def read(self) -> Tuple[int, dict]:
+        """
+        Метод чтения текущих настроек, если они сейчас записываются - ждёт окончания записи
+
+        :return: Версия и настройки
+        :rtype: Tuple[int, dict]
+        """
+
+        while True:
+            loaded = self.poll(0)
+            if loaded is not None:
+                return loaded
+
+
+def create_blocks(settings: dict) -> Dict[str, SettingsBlock]:
+    """
+    Функция создания блоков настроек для всех камер из settings.json
+
+    :param settings: Настройки приложения
+    :type settings: dict
+    :return: Блоки настроек по идентификатору камеры
+    :rtype: Dict[str, SettingsBlock]
+    """
+
+    return {
+        camera_id: SettingsBlock(camera_tuning(settings, camera))
+        for camera_id, camera in load_cameras(settings).items()
+    }
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# Модули приложения импортируются как модули верхнего уровня, как при запуске из директории /app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+import retention  # noqa: E402
+import storage  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    Пустая БД со всеми миграциями во временной папке
+    """
+
+    path = str(tmp_path / "database.db")
+    monkeypatch.setattr(storage, "database_path", path)
+    # retention импортирует путь к БД при загрузке модуля
+    monkeypatch.setattr(retention, "database_path", path)
+    conn = storage.get_connection()
+    storage.create_table(conn)
+    yield conn
+    conn.close()
@@ -0,0 +1,259 @@
+import asyncio
+import json
+import multiprocessing
+import shutil
+import tempfile
+import threading
+
+import pytest
+
+from broker import EventBroker
+from control import CameraControl, OwnerUnavailable
+from preview import PreviewBlock
+from tuning import SettingsBlock
+
+
+class FakeWorker:
+    restarts = 0
+
+
+class FakeManager:
+    """
+    Менеджер камер без процессов: состояние камер - словарь
+    """
+
+    def __init__(self) -> None:
+        self.cameras = {"0": {}, "1": {}}
+        self.tuning = {camera_id: SettingsBlock({"dwell_time": 5}, size=64) for camera_id in self.cameras}
+        self.previews = {"0": PreviewBlock(size=64)}
+        self.profile_event = threading.Event()
+        self.task_queue = None
+        self.workers = {}
+        self.lock = asyncio.Lock()
+
+    def is_running(self, camera_id):
+        return camera_id in self.workers
+
+    def start(self, camera_id):
+        self.workers[camera_id] = FakeWorker()
+
+    def stop(self, camera_id):
+        del self.workers[camera_id]
+
+    def stop_all(self):
+        self.workers.clear()
+
+    def status(self):
+        return {"cameras": {camera_id: {"running": self.is_running(camera_id)} for camera_id in self.cameras}}
+
+    def supervise(self):
+        pass
+
+
+@pytest.fixture
+def socket_dir():
+    # Путь Unix сокета ограничен ~100 символами, временная папка pytest может быть длиннее
+    directory = tempfile.mkdtemp(prefix="control-", dir="/tmp")
+    yield directory
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def make_control(socket_dir, manager=None, broker=None):
+    return CameraControl(
+        manager=manager or FakeManager(),
+        broker=broker or EventBroker(),
+        event_queue=multiprocessing.Queue(),
+        socket_path=f"{socket_dir}/camera.sock",
+        lock_path=f"{socket_dir}/camera.lock",
+        supervise_interval=0.05,
+        retry_interval=0.05,
+        timeout=2,
+    )
+
+
+def with_owner(socket_dir, scenario):
+    """
+    Запускает владельца камер и выполняет сценарий с клиентом, который ходит к нему только через сокет
+    """
+
+    async def main():
+        owner = make_control(socket_dir)
+        await owner.start()
+        # Клиент не берёт блокировку: lockf в одном процессе не исключает сам себя
+        client = make_control(socket_dir)
+        try:
+            return await scenario(owner, client)
+        finally:
+            await owner.stop()
+
+    return asyncio.run(main())
+
+
+async def raw_request(socket_path, *lines):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        for line in lines:
+            writer.write(line + b"\n")
+        await writer.drain()
+        return [await asyncio.wait_for(reader.readline(), timeout=2) for _ in lines]
+    finally:
+        writer.close()
+
+
+def test_owner_takes_lock(socket_dir):
+    async def scenario(owner, client):
+        return owner.owner, client.owner
+
+    assert with_owner(socket_dir, scenario) == (True, False)
+
+
+def test_commands_over_socket(socket_dir):
+    async def scenario(owner, client):
+        return [
+            await client.call("start", camera_id="0"),
+            await client.call("start", camera_id="0"),
+            await client.call("status"),
+            await client.call("stop", camera_id="0"),
+            await client.call("profiler", enabled=True),
+            await client.call("metrics"),
+        ]
+
+    started, again, state, stopped, profiler, metrics = with_owner(socket_dir, scenario)
+
+    assert started == {"started": True}
+    assert again == {"started": False}
+    assert state == {"cameras": {"0": {"running": True}, "1": {"running": False}}}
+    assert stopped == {"stopped": True}
+    assert profiler == {"enabled": True}
+    assert metrics["running"] == {"0": False, "1": False}
+    assert "events" in metrics["queues"]
+
+
+def test_errors_are_returned_as_json(socket_dir):
+    async def scenario(owner, client):
+        return await client.call("reboot"), await client.call("start", camera_id="9")
+
+    unknown_op, unknown_camera = with_owner(socket_dir, scenario)
+
+    assert unknown_op == {"ok": False, "error": "unknown operation reboot"}
+    assert unknown_camera == {"ok": False, "error": "camera 9 not found"}
+
+
+def test_several_requests_on_one_connection(socket_dir):
+    async def scenario(owner, client):
+        return await raw_request(owner.socket_path, b'{"op": "settings"}', b'{"op": "profiler"}')
+
+    settings, profiler = with_owner(socket_dir, scenario)
+
+    assert json.loads(settings)["0"]["dwell_time"] == 5
+    assert json.loads(profiler) == {"enabled": False}
+
+
+@pytest.mark.parametrize(
+    "request_line",
+    [
+        b"not json",
+        b"[1, 2]",
+        b'{"camera_id": "0"}',
+        # Пропущенный и лишний параметры команды
+        b'{"op": "start"}',
+        b'{"op": "status", "camera_id": "0", "force": true}',
+        b'{"op": "start", "camera_id": ["0"]}',
+        b'{"op": "update_settings", "changes": [1]}',
+        # preview без камеры или с неверной частотой кадров
+        b'{"op": "preview", "fps": 5}',
+        b'{"op": "preview", "camera_id": "0", "fps": 0}',
+    ],
+)
+def test_malformed_request_gets_error_reply(socket_dir, request_line):
+    async def scenario(owner, client):
+        # Соединение остаётся открытым: следующий запрос выполняется
+        return await raw_request(owner.socket_path, request_line, b'{"op": "profiler"}')
+
+    error, profiler = with_owner(socket_dir, scenario)
+
+    assert json.loads(error)["ok"] is False
+    assert json.loads(error)["error"]
+    assert json.loads(profiler) == {"enabled": False}
+
+
+def test_update_settings_is_all_or_nothing(socket_dir):
+    async def scenario(owner, client):
+        # Настройки камеры 1 с этим значением не помещаются в блок
+        owner.manager.tuning["1"].write({"dwell_time": 5, "padding": "x" * 30})
+        failed = await client.call("update_settings", changes={"regions": "y" * 20})
+        updated = await client.call("update_settings", changes={"dwell_time": 7})
+        single = await client.call("update_settings", changes={"dwell_time": 9}, camera_id="0")
+        return failed, updated, single, await client.call("settings")
+
+    failed, updated, single, settings = with_owner(socket_dir, scenario)
+
+    assert "error" in failed
+    assert updated["0"]["dwell_time"] == updated["1"]["dwell_time"] == 7
+    assert list(single) == ["0"]
+    assert settings["0"]["dwell_time"] == 9
+    assert settings["1"]["dwell_time"] == 7
+    assert "regions" not in settings["0"] and "regions" not in settings["1"]
+
+
+def test_subscribe_relays_events(socket_dir):
+    async def scenario(owner, client):
+        reader, writer = await asyncio.open_unix_connection(owner.socket_path)
+        writer.write(b'{"op": "subscribe"}\n')
+        await writer.drain()
+        # Ждём, пока владелец зарегистрирует ретранслятор
+        while not owner.broker.relays:
+            await asyncio.sleep(0.01)
+        owner.broker.dispatch({"type": "new_image", "camera_id": "0", "file_name": "a.jpg"})
+        line = await asyncio.wait_for(reader.readline(), timeout=2)
+        writer.close()
+        return json.loads(line)
+
+    assert with_owner(socket_dir, scenario) == {"type": "new_image", "camera_id": "0", "file_name": "a.jpg"}
+
+
+def test_preview_frames_over_socket(socket_dir):
+    async def scenario(owner, client):
+        block = owner.manager.previews["0"]
+        block.write(b"jpeg")
+        frames = await client.preview("0", fps=50)
+        frame = await asyncio.wait_for(frames.__anext__(), timeout=2)
+        viewers = block.viewers
+        await frames.aclose()
+        return frame, viewers
+
+    assert with_owner(socket_dir, scenario) == (b"jpeg", 1)
+
+
+def test_call_without_owner(socket_dir):
+    async def main():
+        with pytest.raises(OwnerUnavailable):
+            await make_control(socket_dir).call("status")
+
+    asyncio.run(main())
+
+
+def test_follower_skips_malformed_events(socket_dir, monkeypatch):
+    lines = [b"{broken", b"[1, 2]", json.dumps({"type": "new_image", "camera_id": "0"}).encode()]
+
+    async def main():
+        async def serve(reader, writer):
+            await reader.readline()
+            for line in lines:
+                writer.write(line + b"\n")
+            await writer.drain()
+
+        server = await asyncio.start_unix_server(serve, path=f"{socket_dir}/camera.sock")
+        broker = EventBroker()
+        subscriber = broker.subscribe()
+        follower = make_control(socket_dir, broker=broker)
+        # Владелец - тестовый сервер, блокировку фолловер не берёт
+        monkeypatch.setattr(follower, "_try_lock", lambda: False)
+        await follower.start()
+        try:
+            return await asyncio.wait_for(subscriber.get(), timeout=2)
+        finally:
+            await follower.stop()
+            server.close()
+
+    assert asyncio.run(main()) == {"type": "new_image", "camera_id": "0"}
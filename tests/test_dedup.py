@@ -0,0 +1,94 @@
+import threading
+
+import numpy as np
+
+from dedup import HashIndex, phash
+
+
+def test_find_nearest_within_threshold():
+    index = HashIndex(threshold=4, window=60)
+    index.add(0b0000, "a.jpg", now=100)
+    index.add(0b1111, "b.jpg", now=100)
+
+    assert index.find(0b0111, now=101) == "b.jpg"
+    assert index.find(0b0001, now=101) == "a.jpg"
+    # 5 отличающихся бит от обоих снимков
+    assert index.find(0b111110000, now=101) is None
+
+
+def test_empty_index():
+    assert HashIndex().find(123, now=0) is None
+
+
+def test_window_expires_old_hashes():
+    index = HashIndex(threshold=0, window=10)
+    index.add(42, "a.jpg", now=100)
+
+    assert index.find(42, now=110) == "a.jpg"
+    assert index.find(42, now=110.5) is None
+    # Устаревший хэш удалён из индекса
+    assert index.find(42, now=100) is None
+
+
+def test_readding_match_extends_window():
+    # Пока человек стоит в области, найденный снимок добавляется снова и окно сдвигается
+    index = HashIndex(threshold=0, window=10)
+    index.add(42, "a.jpg", now=100)
+    index.add(42, index.find(42, now=108), now=108)
+
+    assert index.find(42, now=115) == "a.jpg"
+
+
+def test_size_limit_drops_oldest():
+    index = HashIndex(threshold=0, window=60, size=2)
+    for value, name in ((1, "a.jpg"), (2, "b.jpg"), (3, "c.jpg")):
+        index.add(value, name, now=100)
+
+    assert index.find(1, now=100) is None
+    assert index.find(3, now=100) == "c.jpg"
+
+
+def test_concurrent_add_and_find():
+    # Хэши добавляют потоки записи фото, пока цикл распознавания ищет
+    index = HashIndex(threshold=0, window=60, size=64)
+    errors = []
+
+    def writer():
+        for value in range(2000):
+            index.add(value, f"{value}.jpg", now=100)
+
+    def reader():
+        try:
+            for value in range(2000):
+                index.find(value, now=100)
+        except RuntimeError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=writer), threading.Thread(target=reader)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert index.find(1999, now=100) == "1999.jpg"
+
+
+def test_phash_is_stable_for_similar_images():
+    rng = np.random.default_rng(0)
+    image = (rng.random((120, 100, 3)) * 255).astype(np.uint8)
+    brighter = np.clip(image.astype(np.int16) + 10, 0, 255).astype(np.uint8)
+    other = (rng.random((120, 100, 3)) * 255).astype(np.uint8)
+
+    assert (phash(image) ^ phash(brighter)).bit_count() <= 8
+    assert (phash(image) ^ phash(other)).bit_count() > 8
+
+
+def test_phash_uses_bbox_clipped_to_frame():
+    image = np.zeros((100, 100, 3), dtype=np.uint8)
+    image[:50, :50] = 255
+    image[10:20, 10:20] = 0
+
+    assert phash(image, (0, 0, 50, 50)) == phash(image[:50, :50])
+    # Рамка трекера выходит за кадр
+    assert phash(image, (-10, -10, 60, 60)) == phash(image[:50, :50])
@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+import pytest
+from PIL import Image
+
+import images
+from images import ResizeCache
+
+
+@pytest.fixture
+def sources(tmp_path):
+    directory = tmp_path / "src"
+    directory.mkdir()
+    for index in range(4):
+        Image.new("RGB", (1600, 1200), (index * 60, 0, 0)).save(directory / f"{index}.jpg", quality=95)
+    Image.new("RGB", (100, 80)).save(directory / "small.jpg")
+    return directory
+
+
+def cache_files(directory):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, files in os.walk(directory)
+        for name in files
+        if name != images.LOCK_FILE
+    )
+
+
+@pytest.mark.parametrize("lockf", [True, False])
+def test_cache_evicts_across_instances(tmp_path, sources, monkeypatch, lockf):
+    # Без lockf (Windows) кэш работает так же, блокировка между процессами не нужна
+    if not lockf:
+        monkeypatch.setattr(images, "fcntl", None)
+    directory = str(tmp_path / "cache")
+
+    async def main():
+        # Два экземпляра - как два воркера API с общей папкой кэша. Каждый видит только свои копии
+        # с последнего обхода, поэтому обходим папку после каждого пережатия
+        first = ResizeCache(directory, max_size_mb=0.02, widths=[320, 640], scan_interval=0)
+        second = ResizeCache(directory, max_size_mb=0.02, widths=[320, 640], scan_interval=0)
+        for index in range(4):
+            cache = first if index % 2 else second
+            await cache.get(str(sources / f"{index}.jpg"), f"{index}.jpg", 640)
+        return first
+
+    first = asyncio.run(main())
+
+    total = sum(os.path.getsize(os.path.join(directory, name)) for name in cache_files(directory))
+    assert total <= first.max_size
+    # Остались самые новые копии
+    assert cache_files(directory)[-1] == os.path.join("640", "3.jpg")
+    assert first.snapshot()["gauges"]["image_cache_bytes"] == total
+
+
+def test_hit_does_not_touch_copy(tmp_path, sources):
+    cache = ResizeCache(str(tmp_path / "cache"), widths=[320])
+
+    async def main():
+        path = await cache.get(str(sources / "0.jpg"), "0.jpg", 320)
+        modified = os.stat(path).st_mtime_ns
+        return path, modified, await cache.get(str(sources / "0.jpg"), "0.jpg", 320)
+
+    path, modified, again = asyncio.run(main())
+
+    assert again == path
+    assert os.stat(path).st_mtime_ns == modified
+    assert Image.open(path).width == 320
+    assert cache.snapshot()["counters"] == {"misses": 1, "hits": 1}
+
+
+def test_passthrough_is_remembered(tmp_path, sources):
+    cache = ResizeCache(str(tmp_path / "cache"), widths=[320, 640])
+
+    async def main():
+        return [await cache.get(str(sources / "small.jpg"), "small.jpg", width) for width in (320, 640)]
+
+    assert asyncio.run(main()) == [None, None]
+    assert cache.snapshot()["counters"] == {"passthrough": 2}
+    assert cache_files(tmp_path / "cache") == []
+
+
+def test_concurrent_requests_share_one_resize(tmp_path, sources):
+    cache = ResizeCache(str(tmp_path / "cache"), widths=[320])
+
+    async def main():
+        return await asyncio.gather(*[cache.get(str(sources / "0.jpg"), "0.jpg", 320) for _ in range(5)])
+
+    assert len(set(asyncio.run(main()))) == 1
+    assert cache.snapshot()["counters"] == {"misses": 1, "coalesced": 4}
@@ -0,0 +1,189 @@
+import queue
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+import inference
+import models
+from inference import RemoteDetector, inference_worker
+
+SHAPE = (4, 4, 3)
+
+
+class StubEngine:
+    """
+    Движок без модели: запоминает пачки, рамка лица - значение первого пикселя кадра
+    """
+
+    def __init__(self, delay: float = 0) -> None:
+        self.delay = delay
+        self.batches = []
+
+    def detect(self, items):
+        values = [int(frame[0, 0, 0]) for frame, _, _ in items]
+        self.batches.append(values)
+        time.sleep(self.delay)
+        return [[(value, 0, 1, 1)] for value in values]
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = StubEngine()
+    monkeypatch.setattr(models, "get_engine", lambda: engine)
+    # Блоки создаёт и удаляет тест в этом же процессе, трекер ресурсов должен о них знать
+    monkeypatch.setattr(inference.resource_tracker, "unregister", lambda *args: None)
+    return engine
+
+
+@pytest.fixture
+def blocks():
+    created = []
+
+    def create(value):
+        shm = SharedMemory(create=True, size=int(np.prod(SHAPE)))
+        np.ndarray(SHAPE, dtype=np.uint8, buffer=shm.buf)[:] = value
+        created.append(shm)
+        return shm
+
+    yield create
+    for shm in created:
+        shm.close()
+        shm.unlink()
+
+
+def task(camera_id, seq, shm):
+    return camera_id, seq, shm.name, SHAPE, np.dtype(np.uint8).str, {}, 0.5
+
+
+def run_worker(task_queue, result_queues, until):
+    stop_event = threading.Event()
+    thread = threading.Thread(target=inference_worker, args=(task_queue, result_queues, stop_event))
+    thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not until() and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        stop_event.set()
+        thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def drain(result_queue):
+    results = []
+    while True:
+        try:
+            results.append(result_queue.get_nowait())
+        except queue.Empty:
+            return results
+
+
+def test_batch_routes_results_to_cameras(engine, blocks):
+    task_queue = queue.Queue()
+    result_queues = {"0": queue.Queue(), "1": queue.Queue()}
+    task_queue.put(task("0", 1, blocks(10)))
+    task_queue.put(task("1", 1, blocks(20)))
+    task_queue.put(task("0", 2, blocks(30)))
+
+    run_worker(task_queue, result_queues, until=lambda: result_queues["0"].qsize() == 2)
+
+    # Задачи, уже лежащие в очереди, выполняются одной пачкой
+    assert engine.batches == [[10, 20, 30]]
+    assert drain(result_queues["0"]) == [(1, [(10, 0, 1, 1)]), (2, [(30, 0, 1, 1)])]
+    assert drain(result_queues["1"]) == [(1, [(20, 0, 1, 1)])]
+
+
+def test_replaced_block_in_one_batch(engine, blocks):
+    # Камера не дождалась ответа (или перезапустилась) и записала следующий кадр в новый блок:
+    # задачи со старым и новым блоком одной камеры попадают в одну пачку
+    task_queue = queue.Queue()
+    result_queues = {"0": queue.Queue()}
+    task_queue.put(task("0", 1, blocks(1)))
+    task_queue.put(task("0", 2, blocks(2)))
+
+    run_worker(task_queue, result_queues, until=lambda: result_queues["0"].qsize() == 2)
+
+    assert engine.batches == [[1, 2]]
+    assert [seq for seq, _ in drain(result_queues["0"])] == [1, 2]
+
+
+def test_replaced_block_across_batches(engine, blocks):
+    task_queue = queue.Queue()
+    result_queues = {"0": queue.Queue()}
+    first, second = blocks(1), blocks(2)
+    task_queue.put(task("0", 1, first))
+    replaced = []
+
+    def replace():
+        # Следующий кадр - в новом блоке, после ответа на первый
+        if not replaced and result_queues["0"].qsize() == 1:
+            replaced.append(True)
+            task_queue.put(task("0", 2, second))
+        return result_queues["0"].qsize() == 2
+
+    run_worker(task_queue, result_queues, until=replace)
+
+    assert engine.batches == [[1], [2]]
+
+
+def test_removed_block_is_skipped(engine, blocks):
+    task_queue = queue.Queue()
+    result_queues = {"0": queue.Queue(), "1": queue.Queue()}
+    removed = SharedMemory(create=True, size=int(np.prod(SHAPE)))
+    removed.close()
+    removed.unlink()
+    task_queue.put(task("0", 1, removed))
+    task_queue.put(task("1", 1, blocks(5)))
+
+    run_worker(task_queue, result_queues, until=lambda: result_queues["1"].qsize() == 1)
+
+    assert engine.batches == [[5]]
+    assert drain(result_queues["0"]) == []
+
+
+def test_remote_detector_after_timeout(engine):
+    # Первая пачка отвечает позже timeout: следующий кадр пишется в новый блок, опоздавший ответ отбрасывается
+    engine.delay = 0.3
+    task_queue, result_queue = queue.Queue(), queue.Queue()
+    detector = RemoteDetector("0", {}, 0.5, task_queue, result_queue, timeout=0.1)
+    stop_event = threading.Event()
+    thread = threading.Thread(target=inference_worker, args=(task_queue, {"0": result_queue}, stop_event))
+    thread.start()
+    try:
+        frame = np.zeros(SHAPE, dtype=np.uint8)
+        frame[:] = 1
+        assert detector.detect(frame) == []
+        stale = detector.shm.name
+        engine.delay = 0
+        detector.timeout = 2
+        frame[:] = 2
+        assert detector.detect(frame) == [(2, 0, 1, 1)]
+        assert detector.shm.name != stale
+        frame[:] = 3
+        assert detector.detect(frame) == [(3, 0, 1, 1)]
+    finally:
+        stop_event.set()
+        thread.join(timeout=5)
+        detector.close()
+
+    # Воркер прочитал первый кадр из старого блока целиком
+    assert engine.batches[0] == [1]
+
+
+def test_remote_detector_ignores_replies_to_other_processes(engine):
+    task_queue, result_queue = queue.Queue(), queue.Queue()
+    # Ответ прошлому процессу камеры с тем же номером запроса
+    result_queue.put(((0, 1), [(9, 9, 9, 9)]))
+    detector = RemoteDetector("0", {}, 0.5, task_queue, result_queue, timeout=2)
+    stop_event = threading.Event()
+    thread = threading.Thread(target=inference_worker, args=(task_queue, {"0": result_queue}, stop_event))
+    thread.start()
+    try:
+        assert detector.detect(np.full(SHAPE, 4, dtype=np.uint8)) == [(4, 0, 1, 1)]
+    finally:
+        stop_event.set()
+        thread.join(timeout=5)
+        detector.close()
@@ -0,0 +1,73 @@
+import numpy as np
+
+from motion import MotionGate
+
+REGION = {"x": 100, "y": 50, "width": 200, "height": 100}
+
+
+def frame(value=0, shape=(480, 640, 3)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+def test_still_frames_are_skipped_and_motion_is_detected():
+    gate = MotionGate({"door": REGION}, alpha=1)
+
+    assert gate.check(frame()) is True  # фона ещё нет
+    assert gate.check(frame()) is False
+    moved = frame()
+    moved[60:140, 120:280] = 255
+    assert gate.check(moved) is True
+    assert gate.skip_ratio == 1 / 3
+
+
+def test_motion_outside_regions_is_ignored():
+    gate = MotionGate({"door": REGION}, alpha=1)
+    gate.check(frame())
+    moved = frame()
+    moved[300:, 400:] = 255
+
+    assert gate.check(moved) is False
+
+
+def test_regions_outside_frame_fail_open():
+    # Кадр меньше, чем при настройке областей: ни одна область не попадает в кадр
+    gate = MotionGate({"door": {"x": 1000, "y": 800, "width": 100, "height": 100}})
+
+    for _ in range(3):
+        assert gate.check(frame(shape=(480, 640, 3))) is True
+    assert gate.skipped == 0
+
+
+def test_regions_are_clamped_to_frame():
+    # Одна область за пределами кадра, другая выходит за край: проверяется только часть внутри кадра
+    gate = MotionGate(
+        {
+            "outside": {"x": 2000, "y": 0, "width": 10, "height": 10},
+            "edge": {"x": 600, "y": 400, "width": 200, "height": 200},
+        },
+        alpha=1,
+    )
+    gate.check(frame())
+
+    assert gate.check(frame()) is False
+    moved = frame()
+    moved[420:, 610:] = 255
+    assert gate.check(moved) is True
+
+
+def test_resolution_change_resets_background():
+    gate = MotionGate({"door": REGION}, alpha=1)
+    gate.check(frame())
+    gate.check(frame())
+
+    # Новый размер кадра - фон накапливается заново
+    assert gate.check(frame(shape=(240, 320, 3))) is True
+    assert gate.check(frame(shape=(240, 320, 3))) is False
+
+
+def test_set_regions_recomputes_bounds():
+    gate = MotionGate({"door": REGION}, alpha=1)
+    gate.check(frame())
+    gate.set_regions({"far": {"x": 5000, "y": 5000, "width": 10, "height": 10}})
+
+    assert gate.check(frame()) is True
@@ -0,0 +1,67 @@
+import pytest
+
+from storage import decode_cursor, encode_cursor, get_images_page
+
+
+@pytest.fixture
+def images(database):
+    # Несколько фото с одинаковым временем: порядок страниц задаёт id
+    rows = [(f"{index}.jpg", str(index % 2), f"2024-01-01 00:00:0{index // 3}") for index in range(10)]
+    database.executemany("INSERT INTO humans (filename, camera_id, created_at) VALUES (?, ?, ?)", rows)
+    database.commit()
+    return database
+
+
+def read_all(conn, limit, camera_id=None):
+    pages, after = [], None
+    while page := get_images_page(
+            conn, "2024-01-01 00:00:00", "2024-01-01 23:59:59", camera_id=camera_id, after=after, limit=limit
+    ):
+        pages.append(page)
+        # Курсор передаётся клиенту строкой и возвращается в следующем запросе
+        after = decode_cursor(encode_cursor(page[-1][2], page[-1][0]))
+    return pages
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("2024-01-01 00:00:00", 42)) == ("2024-01-01 00:00:00", 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", "WzEsIDJd", "eyJhIjogMX0="])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("limit", [1, 3, 4, 10, 100])
+def test_pages_cover_all_rows_once(images, limit):
+    pages = read_all(images, limit)
+
+    ids = [row[0] for page in pages for row in page]
+    assert ids == list(range(1, 11))
+    assert all(len(page) <= limit for page in pages)
+
+
+def test_pages_by_camera(images):
+    rows = [row for page in read_all(images, 2, camera_id="1") for row in page]
+
+    assert [row[1] for row in rows] == ["1.jpg", "3.jpg", "5.jpg", "7.jpg", "9.jpg"]
+    assert {row[3] for row in rows} == {"1"}
+
+
+def test_page_respects_date_range(images):
+    page = get_images_page(images, "2024-01-01 00:00:01", "2024-01-01 00:00:02", limit=100)
+
+    assert [row[1] for row in page] == ["3.jpg", "4.jpg", "5.jpg", "6.jpg", "7.jpg", "8.jpg"]
+
+
+def test_page_after_new_rows(images):
+    # Фото, добавленные между запросами страниц, не сдвигают следующую страницу
+    first = get_images_page(images, "2024-01-01 00:00:00", "2024-01-01 23:59:59", limit=5)
+    images.execute("INSERT INTO humans (filename, created_at) VALUES ('early.jpg', '2024-01-01 00:00:00')")
+    images.commit()
+    second = get_images_page(
+        images, "2024-01-01 00:00:00", "2024-01-01 23:59:59", after=(first[-1][2], first[-1][0]), limit=5
+    )
+
+    assert [row[0] for row in second] == [6, 7, 8, 9, 10]
@@ -0,0 +1,161 @@
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from retention import THUMBS, RetentionJob
+from storage import db_timestamp
+
+OLD = "2020-01-01 00:00:00"
+
+
+@pytest.fixture
+def images(tmp_path):
+    directory = tmp_path / "images"
+    (directory / THUMBS).mkdir(parents=True)
+    return directory
+
+
+def put_file(directory, name, data=b"x" * 10, age=0):
+    path = directory / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    if age:
+        moment = time.time() - age
+        os.utime(path, (moment, moment))
+    return path
+
+
+def insert(conn, filename, created_at=OLD, size=None):
+    conn.execute("INSERT INTO humans (filename, created_at, size) VALUES (?, ?, ?)", (filename, created_at, size))
+    conn.commit()
+
+
+def filenames(conn):
+    return [row[0] for row in conn.execute("SELECT filename FROM humans ORDER BY id")]
+
+
+def make_job(directory, **options):
+    defaults = dict(max_age_days=0, max_size_mb=0, archive_after_days=0, orphan_grace=60, batch_size=2)
+    return RetentionJob(str(directory), **{**defaults, **options})
+
+
+def test_reconcile_keeps_rows_without_files(database, images):
+    insert(database, "2020/01/01/gone.jpg")
+    job = make_job(images)
+
+    job.reconcile(database)
+
+    assert filenames(database) == ["2020/01/01/gone.jpg"]
+    assert job.stats.snapshot()["gauges"]["missing_files"] == 1
+
+
+def test_reconcile_deletes_rows_without_files_when_enabled(database, images):
+    insert(database, "2020/01/01/gone.jpg")
+    # Запись моложе orphan_grace: файл мог ещё не попасть на место
+    insert(database, "2020/01/01/fresh.jpg", created_at=db_timestamp())
+    job = make_job(images, delete_orphan_rows=True)
+
+    job.reconcile(database)
+
+    assert filenames(database) == ["2020/01/01/fresh.jpg"]
+    assert job.stats.snapshot()["counters"]["orphan_rows"] == 1
+
+
+def test_reconcile_removes_old_files_without_rows(database, images):
+    put_file(images, "2020/01/01/kept.jpg", age=3600)
+    put_file(images, f"{THUMBS}/2020/01/01/kept.jpg", age=3600)
+    put_file(images, "2020/01/01/orphan.jpg", age=3600)
+    put_file(images, f"{THUMBS}/2020/01/01/orphan.jpg", age=3600)
+    put_file(images, "2020/01/01/kept.jpg.tmp", age=3600)
+    # Файл моложе orphan_grace: запись о нём может быть ещё в очереди на запись
+    put_file(images, "2020/01/01/new.jpg")
+    insert(database, "2020/01/01/kept.jpg")
+    job = make_job(images)
+
+    job.reconcile(database)
+
+    remaining = sorted(
+        os.path.relpath(os.path.join(root, name), images) for root, _, files in os.walk(images) for name in files
+    )
+    assert remaining == ["2020/01/01/kept.jpg", "2020/01/01/new.jpg", f"{THUMBS}/2020/01/01/kept.jpg"]
+    assert job.stats.snapshot()["counters"]["orphan_files"] == 3
+    # Размер старых записей заполняется по файлам
+    assert database.execute("SELECT size FROM humans").fetchone()[0] == 20
+
+
+def test_reconcile_shards_legacy_files(database, images):
+    put_file(images, "legacy.jpg")
+    put_file(images, f"{THUMBS}/legacy.jpg")
+    insert(database, "legacy.jpg", created_at="2021-02-03 04:05:06")
+    insert(database, "missing.jpg")
+
+    make_job(images).reconcile(database)
+
+    assert filenames(database) == ["2021/02/03/legacy.jpg", "missing.jpg"]
+    assert (images / "2021/02/03/legacy.jpg").exists()
+    assert (images / THUMBS / "2021/02/03/legacy.jpg").exists()
+
+
+def test_expire_deletes_old_rows_and_files(database, images):
+    put_file(images, "2020/01/01/old.jpg")
+    put_file(images, f"{THUMBS}/2020/01/01/old.jpg")
+    put_file(images, "2020/01/01/new.jpg")
+    insert(database, "2020/01/01/old.jpg")
+    insert(database, "2020/01/01/new.jpg", created_at=db_timestamp())
+    job = make_job(images, max_age_days=1)
+
+    job.expire(database)
+
+    assert filenames(database) == ["2020/01/01/new.jpg"]
+    assert not (images / "2020/01/01/old.jpg").exists()
+    assert not (images / THUMBS / "2020/01/01/old.jpg").exists()
+    assert (images / "2020/01/01/new.jpg").exists()
+    assert job.stats.snapshot()["counters"]["expired"] == 1
+
+
+def test_quota_evicts_oldest(database, images):
+    for index in range(5):
+        put_file(images, f"2020/01/01/{index}.jpg", data=b"x" * 400 * 1024)
+        insert(database, f"2020/01/01/{index}.jpg", created_at=f"2020-01-01 00:00:0{index}", size=400 * 1024)
+    job = make_job(images, max_size_mb=1)
+
+    job.enforce_quota(database)
+
+    assert filenames(database) == ["2020/01/01/3.jpg", "2020/01/01/4.jpg"]
+    assert job.stats.snapshot()["counters"]["evicted"] == 3
+
+
+def test_archive_writes_new_file(database, images):
+    rng = np.random.default_rng(0)
+    image = (rng.random((480, 1280, 3)) * 255).astype(np.uint8)
+    source = images / "2020/01/01/a.jpg"
+    source.parent.mkdir(parents=True)
+    cv2.imwrite(str(source), image, [cv2.IMWRITE_JPEG_QUALITY, 100])
+    put_file(images, f"{THUMBS}/2020/01/01/a.jpg", data=b"thumb")
+    insert(database, "2020/01/01/a.jpg")
+    job = make_job(images, archive_after_days=1, archive_width=320)
+
+    job.archive(database)
+
+    row = database.execute("SELECT filename, archived, size FROM humans").fetchone()
+    archived = images / "2020/01/01/a.archived.jpg"
+    assert row[:2] == ("2020/01/01/a.archived.jpg", 1)
+    assert cv2.imread(str(archived)).shape[1] == 320
+    assert (images / THUMBS / "2020/01/01/a.archived.jpg").read_bytes() == b"thumb"
+    assert row[2] == archived.stat().st_size + len(b"thumb")
+    # Оригинал удалён после переключения записи на копию
+    assert not source.exists()
+    assert not (images / THUMBS / "2020/01/01/a.jpg").exists()
+
+
+def test_run_once_skips_disabled_stages(database, images):
+    put_file(images, "2020/01/01/old.jpg")
+    insert(database, "2020/01/01/old.jpg")
+
+    counters = make_job(images).run_once()
+
+    assert filenames(database) == ["2020/01/01/old.jpg"]
+    assert "expired" not in counters and "archived" not in counters
@@ -0,0 +1,47 @@
+import pytest
+
+from storage import DatabaseWriter, get_session_stats, session_bucket
+
+
+@pytest.mark.parametrize(
+    "bucket, expected",
+    [("minute", "2024-01-01 10:30:00"), ("hour", "2024-01-01 10:00:00"), ("day", "2024-01-01 00:00:00")],
+)
+def test_session_bucket(bucket, expected):
+    assert session_bucket("2024-01-01 10:30:45", bucket) == expected
+
+
+@pytest.fixture
+def sessions(database):
+    writer = DatabaseWriter(flush_interval=0.01)
+    writer.start()
+    # Сеансы первого дня до и после 12:00, второго дня - утром
+    for started_at, duration in (
+            ("2024-01-01 09:15:00", 10.0),
+            ("2024-01-01 12:30:00", 20.0),
+            ("2024-01-01 12:45:00", 30.0),
+            ("2024-01-02 08:00:00", 40.0),
+    ):
+        writer.add_session("0", started_at, started_at, duration, 1)
+    writer.add_session("1", "2024-01-01 12:40:00", "2024-01-01 12:40:00", 5.0, 2)
+    writer.close()
+    return database
+
+
+def test_day_buckets_are_whole(sessions):
+    # Диапазон начинается посреди первого дня, но день учитывается целиком
+    rows = get_session_stats(sessions, "2024-01-01 12:00:00", "2024-01-02 23:59:59", bucket="day")
+
+    assert rows == [("2024-01-01 00:00:00", 4, 5, 65.0, 30.0), ("2024-01-02 00:00:00", 1, 1, 40.0, 40.0)]
+
+
+def test_hour_buckets_by_camera(sessions):
+    rows = get_session_stats(sessions, "2024-01-01 12:50:00", "2024-01-01 23:59:59", bucket="hour", camera_id="0")
+
+    assert rows == [("2024-01-01 12:00:00", 2, 2, 50.0, 30.0)]
+
+
+def test_minute_buckets_range(sessions):
+    rows = get_session_stats(sessions, "2024-01-01 12:30:30", "2024-01-01 12:40:00", bucket="minute")
+
+    assert [row[0] for row in rows] == ["2024-01-01 12:30:00", "2024-01-01 12:40:00"]
@@ -0,0 +1,96 @@
+import sqlite3
+import threading
+
+import storage
+from storage import MIGRATIONS, DatabaseWriter, create_table, get_connection
+
+
+def columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def indexes(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_migrations_create_schema(database):
+    assert database.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert database.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert {"camera_id", "size", "archived", "phash", "duplicates", "last_seen"} <= set(columns(database, "humans"))
+    assert {"idx_humans_created_at", "idx_humans_camera_created_at", "idx_humans_filename"} <= indexes(database)
+    assert columns(database, "sessions")
+
+
+def test_migrations_are_idempotent(database):
+    database.execute("INSERT INTO humans (filename) VALUES ('a.jpg')")
+    database.commit()
+
+    create_table(database)
+
+    assert database.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert database.execute("SELECT filename FROM humans").fetchall() == [("a.jpg",)]
+
+
+def test_migrations_upgrade_legacy_database(tmp_path, monkeypatch):
+    # БД, созданная до появления миграций: таблица и колонка camera_id уже есть, user_version = 0
+    monkeypatch.setattr(storage, "database_path", str(tmp_path / "legacy.db"))
+    conn = get_connection()
+    conn.execute(
+        "CREATE TABLE humans (id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT NOT NULL, "
+        "created_at TEXT DATETIME DEFAULT CURRENT_TIMESTAMP, camera_id TEXT NOT NULL DEFAULT '0')"
+    )
+    conn.execute("INSERT INTO humans (filename, camera_id) VALUES ('old.jpg', '1')")
+    conn.commit()
+
+    create_table(conn)
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert conn.execute("SELECT filename, camera_id, archived FROM humans").fetchall() == [("old.jpg", "1", 0)]
+    conn.close()
+
+
+def test_concurrent_migrations(tmp_path, monkeypatch):
+    # Воркеры API, запущенные одновременно, не применяют одну миграцию дважды
+    monkeypatch.setattr(storage, "database_path", str(tmp_path / "concurrent.db"))
+    errors = []
+
+    def migrate():
+        conn = get_connection(check_same_thread=False)
+        try:
+            create_table(conn)
+        except sqlite3.Error as error:
+            errors.append(error)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=migrate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    conn = get_connection()
+    assert not errors
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    conn.close()
+
+
+def test_database_writer_keeps_order(database):
+    writer = DatabaseWriter(batch_size=3, flush_interval=0.01)
+    writer.start()
+    for index in range(5):
+        writer.add(f"{index}.jpg", camera_id="0", created_at="2024-01-01 00:00:00", size=10)
+    # Объединение стоит после вставки в очереди и не должно её обогнать
+    writer.merge("4.jpg", seen_at="2024-01-01 00:00:05")
+    writer.add_session("0", "2024-01-01 00:00:10", "2024-01-01 00:00:20", 10.0, 2)
+    writer.close()
+
+    assert database.execute("SELECT COUNT(*), SUM(size) FROM humans").fetchone() == (5, 50)
+    assert database.execute("SELECT duplicates, last_seen FROM humans WHERE filename = '4.jpg'").fetchone() == (
+        1,
+        "2024-01-01 00:00:05",
+    )
+    assert database.execute("SELECT bucket, sessions, snapshots FROM sessions_hourly").fetchall() == [
+        ("2024-01-01 00:00:00", 1, 2)
+    ]
+    assert writer.stats.snapshot()["counters"]["db_rows"] == 9